@@ -0,0 +1,423 @@
+"""
+Class AtlasFuncs builds and queries an atlas of precomputed ice column responses. Routine hole-mode
+runs use a single layer of bubbly ice (layer_type 1) whose outputs (albedo, BBA, F_btm_net and
+F_top_pls) are smooth functions of five inputs: density, bubble radius (grain_rds), thickness (dz),
+solar zenith angle and glacier algae concentration. The atlas solves the column with the usual
+solvers on a grid over these axes (one depth sweep per density, radius and algae value, see
+TwoStreamFuncs.call_snicar_sweep) and afterwards answers any point inside the grid by
+interpolation, in microseconds instead of a column solve.
+
+The spectra at all grid points are highly correlated, so each output is stored as a mean spectrum
+plus a few principal components (truncated SVD): the coefficients of the components at each grid
+point and the component spectra. The number of components is the smallest that reproduces every
+grid point within TOLERANCE. F_btm_net falls off roughly exponentially with thickness and spans
+many orders of magnitude, so its logarithm is stored (values below FLOOR are stored as FLOOR).
+Queries interpolate the coefficients multilinearly: linear in density, thickness, cosine of the
+solar zenith and algae, and in log radius (as OpticsTables).
+
+Interpolation is not exact, so build compares the atlas with direct solves at random points inside
+the grid (check) and keeps the largest errors with the atlas. They are printed by the build and
+should be looked at before an atlas is used in place of the solver. Loading is quiet, but get warns
+(warnings.warn) when the stored errors of an atlas exceed TOLERANCE.
+
+Functions in this class include:
+
+1) build
+    Solves the column on a grid over the five axes and returns the compressed atlas
+
+2) query
+    Returns the interpolated column outputs (as call_snicar) at one point
+
+3) column
+    Returns the interpolated column for params, as a replacement for call_snicar
+
+4) check
+    Compares the atlas with direct solves at random points and returns the largest errors
+
+5) save
+    Writes an atlas to a compressed .npz file
+
+6) load
+    Reads an atlas written by save
+
+7) get
+    Returns an atlas, loading it from a path once per process
+
+"""
+
+
+class AtlasFuncs:
+
+    ATLAS_FILE = 'column_atlas.npz' # default atlas file, in the CryoconiteRTM data folder (SpectralGrid.DATA_DIR)
+
+    # default grid (the bubble radii must be within the bubbly ice tables, see OpticsTables)
+    AXES = {'density': (600, 700, 800, 850, 900), 'grain_rds': (500, 600, 700, 850, 1000),\
+        'dz': (0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.0), 'solzen': (10, 20, 30, 40, 50, 60, 70, 80),\
+        'algae': (0, 1000, 2500, 5000, 10000, 20000)}
+
+    OUTPUTS = ('albedo', 'F_top_pls', 'F_btm_net') # spectral outputs, compressed
+    TOLERANCE = {'albedo': 1e-4, 'F_top_pls': 1e-4, 'F_btm_net': 1e-3} # albedo absolute, F_top_pls relative to its maximum, log(F_btm_net) absolute
+    FLOOR = 1e-10 # smallest F_btm_net stored (W m-2)
+
+    _atlases = {}
+
+    def __init__(self):
+
+
+        return
+
+
+    def build(axes=None, incoming_i=4, DIRECT=True, dir_base=None, n_check=20, verbose=True):
+
+        """
+        Solves the single-layer bubbly ice column at every combination of the values in axes (a
+        dictionary with some or all of the keys of AXES, the others take the default values) for
+        irradiance profile incoming_i and DIRECT, and returns the atlas as a named tuple:
+
+            axes        the grid values of each axis
+            outputs     for each spectral output, the mean spectrum, the coefficients of its
+                        components at every grid point and the component spectra
+            BBA         the broadband albedo at every grid point
+            incoming_i, DIRECT, dir_base
+            error       the largest errors against direct solves at n_check random points (see check)
+            key         a hash of the contents, identifying the atlas in caches
+
+        Every axis must be increasing. An axis with one value is held at that value.
+
+        """
+
+        import collections
+        import time
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+        from CacheFuncs import CacheFuncs
+
+        axes = {name: np.array((axes or {}).get(name, default), dtype=float) for name, default in AtlasFuncs.AXES.items()}
+
+        for name, values in axes.items():
+            if values.ndim != 1 or len(values) == 0 or np.any(np.diff(values) <= 0):
+                raise ValueError(f"ERROR: atlas axis {name} must be a list of increasing values")
+
+        shape = tuple(len(values) for values in axes.values())
+        solzens = [int(x) if float(x).is_integer() else float(x) for x in axes['solzen']] # irradiance files are per whole degree
+        values = {name: None for name in AtlasFuncs.OUTPUTS}
+        BBA = np.empty(shape)
+        start = time.time()
+
+        for i, density in enumerate(axes['density']):
+            for j, grain_rds in enumerate(axes['grain_rds']):
+                for m, algae in enumerate(axes['algae']):
+
+                    # all thicknesses and angles of this ice in one sweep
+                    params = TwoStreamFuncs.generate_ice_physical_params([density], [grain_rds], [1], [axes['dz'][0]],\
+                        algae, solzens if len(solzens) > 1 else solzens[0], incoming_i, DIRECT, dir_base=dir_base)
+
+                    for k, (albedo, bba, F_btm_net, F_top_pls) in\
+                        enumerate(TwoStreamFuncs.call_snicar_sweep(params, [[dz] for dz in axes['dz']])):
+
+                        spectra = {'albedo': albedo, 'F_top_pls': F_top_pls, 'F_btm_net': F_btm_net}
+
+                        for name in AtlasFuncs.OUTPUTS:
+                            x = np.reshape(spectra[name], (len(solzens), -1))
+                            if values[name] is None:
+                                values[name] = np.empty(shape + (x.shape[1],), dtype=np.float32)
+                            values[name][i,j,k,:,m] = x
+
+                        BBA[i,j,k,:,m] = bba
+
+            if verbose:
+                print(f"atlas: density {density} solved ({time.time() - start:.0f} s)")
+
+        outputs = {}
+
+        for name in AtlasFuncs.OUTPUTS:
+
+            x = values.pop(name)
+            x = x.reshape(-1, x.shape[-1]).astype(float) # grid points x wavelengths
+
+            if name == 'F_btm_net':
+                x = np.log(np.maximum(x, AtlasFuncs.FLOOR))
+                tolerance = AtlasFuncs.TOLERANCE[name]
+            elif name == 'F_top_pls':
+                tolerance = AtlasFuncs.TOLERANCE[name] * np.max(np.abs(x))
+            else:
+                tolerance = AtlasFuncs.TOLERANCE[name]
+
+            mean, coefficients, components = AtlasFuncs._compress(x, tolerance)
+            outputs[name] = (mean, coefficients.reshape(shape + (-1,)).astype(float), components.astype(float))
+
+            if verbose:
+                print(f"atlas: {name} stored with {components.shape[0]} components")
+
+        key = CacheFuncs.key('atlas', {name: list(values) for name, values in axes.items()}, incoming_i, DIRECT,\
+            [x for name in AtlasFuncs.OUTPUTS for x in outputs[name]], BBA, data_dirs=CacheFuncs.data_dirs(params))
+
+        atlas = collections.namedtuple("atlas", "axes, outputs, BBA, incoming_i, DIRECT, dir_base, error, key")(\
+            axes, outputs, BBA, int(incoming_i), bool(DIRECT), dir_base, {}, key)
+
+        if n_check > 0:
+            atlas.error.update(AtlasFuncs.check(atlas, n_check))
+
+            if verbose:
+                print("atlas: largest errors against direct solves", atlas.error)
+
+        return atlas
+
+
+    def _compress(x, tolerance):
+
+        # returns the mean of the rows of x, and the coefficients and component spectra of the
+        # fewest principal components that reproduce every row within tolerance
+
+        import numpy as np
+
+        mean = x.mean(axis=0)
+        U, S, Vt = np.linalg.svd(x - mean, full_matrices=False)
+
+        def error(k):
+            return np.max(np.abs((U[:,:k] * S[:k]) @ Vt[:k] + mean - x)) if k > 0 else np.max(np.abs(mean - x))
+
+        # error falls with the number of components, so the smallest sufficient one is bisected
+        lo, hi = 0, len(S)
+
+        while lo < hi:
+            k = (lo + hi) // 2
+            if error(k) <= tolerance:
+                hi = k
+            else:
+                lo = k + 1
+
+        # rounded to the float32 precision they are saved with
+        return mean, (U[:,:lo] * S[:lo]).astype(np.float32), Vt[:lo].astype(np.float32)
+
+
+    def _corners(atlas, point):
+
+        # returns the grid indices (axes x corners) and weights of the multilinear interpolation at
+        # point (one value per axis); only axes with more than one value have two corners
+
+        import bisect
+        import math
+        import itertools
+        import numpy as np
+
+        transforms = {'grain_rds': math.log, 'solzen': lambda x: math.cos(math.radians(x))}
+        lower, weights = [], []
+
+        for (name, values), value in zip(atlas.axes.items(), point):
+
+            value = float(value)
+
+            if not values[0] - 1e-9*abs(values[0]) <= value <= values[-1] + 1e-9*abs(values[-1]):
+                raise ValueError(f"ERROR: {name} = {value} is outside the atlas ({values[0]} - {values[-1]})")
+
+            if len(values) == 1:
+                lower.append(0)
+                weights.append(None)
+                continue
+
+            i = min(max(bisect.bisect_right(values, value) - 1, 0), len(values) - 2)
+            f = transforms.get(name, float)
+            lower.append(i)
+            weights.append(min(max((f(value) - f(values[i])) / (f(values[i+1]) - f(values[i])), 0.0), 1.0))
+
+        varying = [n for n, w in enumerate(weights) if w is not None]
+        index, weight = [], []
+
+        for corner in itertools.product((0, 1), repeat=len(varying)):
+            w = math.prod(weights[n] if c else 1 - weights[n] for n, c in zip(varying, corner))
+            if w > 0:
+                shift = dict(zip(varying, corner))
+                index.append([i + shift.get(n, 0) for n, i in enumerate(lower)])
+                weight.append(w)
+
+        return np.array(index).T, np.array(weight)
+
+
+    def query(atlas, density, grain_rds, dz, solzen, algae=0):
+
+        """
+        Returns albedo, BBA, F_btm_net and F_top_pls (as TwoStreamFuncs.call_snicar, on the SNICAR
+        wavelength grid) for a single layer of bubbly ice with density (kg m-3), bubble radius
+        grain_rds (um) and thickness dz (m), at solar zenith angle solzen (degrees) and glacier
+        algae concentration algae, interpolated from atlas. Points outside the atlas raise a
+        ValueError.
+
+        """
+
+        import numpy as np
+
+        index, weight = AtlasFuncs._corners(atlas, (density, grain_rds, dz, solzen, algae))
+        index = tuple(index)
+
+        spectra = {}
+
+        for name, (mean, coefficients, components) in atlas.outputs.items():
+            spectra[name] = mean + (weight @ coefficients[index]) @ components
+
+        F_btm_net = np.exp(spectra['F_btm_net'])
+        F_btm_net[F_btm_net <= AtlasFuncs.FLOOR] = 0
+
+        return spectra['albedo'], float(weight @ atlas.BBA[index]), F_btm_net, spectra['F_top_pls']
+
+
+    def column(atlas, params):
+
+        """
+        Returns the interpolated column (albedo, BBA, F_btm_net, F_top_pls) for params, in place of
+        TwoStreamFuncs.call_snicar(params). atlas is an atlas or the path of one (see get). params
+        must describe a single layer of bubbly ice at one solar zenith angle, with the irradiance of
+        the atlas; otherwise a ValueError is raised.
+
+        """
+
+        import numpy as np
+
+        atlas = AtlasFuncs.get(atlas)
+
+        if len(params.dz) != 1 or tuple(params.layer_type) != (1,):
+            raise ValueError("ERROR: the atlas only holds single-layer bubbly ice columns (layer_type [1])")
+
+        if np.ndim(params.solzen) > 0 or params.incoming_i != atlas.incoming_i or bool(params.DIRECT) != atlas.DIRECT:
+            raise ValueError("ERROR: the atlas needs one solar zenith angle and the incoming_i and DIRECT it was built with"\
+                " ({}, {})".format(atlas.incoming_i, atlas.DIRECT))
+
+        return AtlasFuncs.query(atlas, params.rho_layers[0], params.grain_rds[0], params.dz[0], params.solzen,\
+            float(np.ravel(params.mss_cnc_glacier_algae)[0]))
+
+
+    def check(atlas, n=20, seed=0):
+
+        """
+        Compares the atlas with direct column solves (TwoStreamFuncs.call_snicar) at n random points
+        inside the grid (uniform in density, log radius, log thickness, whole degrees of solar zenith
+        and algae) and returns the largest errors over the points. The spectral outputs are measured
+        in the same terms as TOLERANCE, so get can compare the two:
+
+            albedo, BBA         absolute error
+            F_top_pls           largest spectral error relative to the peak of the spectrum
+            F_btm_net           largest absolute error of log(F_btm_net), with values below FLOOR as FLOOR
+            F_btm_net_total     relative error of the spectrally integrated F_btm_net
+
+        """
+
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+
+        rng = np.random.default_rng(seed)
+        axes = atlas.axes
+        error = {'n': int(n), 'albedo': 0.0, 'BBA': 0.0, 'F_btm_net': 0.0, 'F_top_pls': 0.0, 'F_btm_net_total': 0.0}
+
+        def draw(name, log=False):
+            lo, hi = axes[name][0], axes[name][-1]
+            return float(np.exp(rng.uniform(np.log(lo), np.log(hi)))) if log else float(rng.uniform(lo, hi))
+
+        for _ in range(n):
+
+            # whole degrees of solar zenith, for which irradiance files exist
+            density, grain_rds, dz, algae = draw('density'), draw('grain_rds', True), draw('dz', True), draw('algae')
+            solzen = int(rng.integers(np.ceil(axes['solzen'][0]), np.floor(axes['solzen'][-1]) + 1))
+
+            params = TwoStreamFuncs.generate_ice_physical_params([density], [grain_rds], [1], [dz], algae, solzen,\
+                atlas.incoming_i, atlas.DIRECT, dir_base=atlas.dir_base)
+
+            albedo, BBA, F_btm_net, F_top_pls = TwoStreamFuncs.call_snicar(params)
+            a_albedo, a_BBA, a_F_btm_net, a_F_top_pls = AtlasFuncs.query(atlas, density, grain_rds, dz, solzen, algae)
+
+            error['albedo'] = max(error['albedo'], float(np.max(np.abs(a_albedo - albedo))))
+            error['BBA'] = max(error['BBA'], float(abs(a_BBA - BBA)))
+            error['F_btm_net'] = max(error['F_btm_net'], float(np.max(np.abs(np.log(np.maximum(a_F_btm_net, AtlasFuncs.FLOOR))\
+                - np.log(np.maximum(F_btm_net, AtlasFuncs.FLOOR))))))
+            error['F_top_pls'] = max(error['F_top_pls'], float(np.max(np.abs(a_F_top_pls - F_top_pls)) / np.max(np.abs(F_top_pls))))
+            error['F_btm_net_total'] = max(error['F_btm_net_total'], float(abs(np.sum(a_F_btm_net) / np.sum(F_btm_net) - 1)))
+
+        return error
+
+
+    def save(atlas, path=None):
+
+        """
+        Writes atlas to path (default ATLAS_FILE in the CryoconiteRTM data folder) as a compressed
+        .npz file
+
+        """
+
+        import json
+        import numpy as np
+
+        arrays = {'axis_' + name: values for name, values in atlas.axes.items()}
+
+        for name, (mean, coefficients, components) in atlas.outputs.items():
+            arrays.update({name + '_mean': mean, name + '_coefficients': coefficients.astype(np.float32),\
+                name + '_components': components.astype(np.float32)})
+
+        meta = {'incoming_i': atlas.incoming_i, 'DIRECT': atlas.DIRECT, 'dir_base': atlas.dir_base, 'error': atlas.error,\
+            'key': atlas.key}
+
+        np.savez_compressed(AtlasFuncs._default_path() if path is None else path, BBA=atlas.BBA, meta=json.dumps(meta), **arrays)
+
+        return
+
+
+    def load(path=None, verbose=False):
+
+        """
+        Reads the atlas written by save to path (default ATLAS_FILE in the CryoconiteRTM data folder).
+        With verbose its errors against direct solves are printed.
+
+        """
+
+        import collections
+        import json
+        import numpy as np
+
+        with np.load(AtlasFuncs._default_path() if path is None else path, allow_pickle=False) as f:
+            axes = {name: f['axis_' + name] for name in AtlasFuncs.AXES}
+            outputs = {name: (f[name + '_mean'], f[name + '_coefficients'].astype(float), f[name + '_components'].astype(float))\
+                for name in AtlasFuncs.OUTPUTS}
+            BBA = f['BBA']
+            meta = json.loads(str(f['meta']))
+
+        if verbose:
+            print("atlas: largest errors against direct solves", meta['error'])
+
+        return collections.namedtuple("atlas", "axes, outputs, BBA, incoming_i, DIRECT, dir_base, error, key")(\
+            axes, outputs, BBA, meta['incoming_i'], meta['DIRECT'], meta['dir_base'], meta['error'], meta['key'])
+
+
+    def get(atlas):
+
+        """
+        Returns atlas if it is an atlas, or the atlas saved at the path atlas, which is only read
+        once per process. A warning is given when an atlas is read whose stored errors against direct
+        solves exceed TOLERANCE.
+
+        """
+
+        import warnings
+
+        if not isinstance(atlas, str):
+            return atlas
+
+        if atlas not in AtlasFuncs._atlases:
+
+            loaded = AtlasFuncs.load(atlas)
+            exceeded = {name: loaded.error[name] for name in AtlasFuncs.OUTPUTS\
+                if loaded.error.get(name, 0) > AtlasFuncs.TOLERANCE[name]}
+
+            if exceeded:
+                warnings.warn(f"atlas {atlas}: largest errors against direct solves {exceeded} exceed TOLERANCE"\
+                    f" {AtlasFuncs.TOLERANCE}")
+
+            AtlasFuncs._atlases[atlas] = loaded
+
+        return AtlasFuncs._atlases[atlas]
+
+
+    def _default_path():
+
+        # ATLAS_FILE in the CryoconiteRTM data folder
+
+        from SpectralGrid import SpectralGrid
+
+        return SpectralGrid.DATA_DIR + AtlasFuncs.ATLAS_FILE
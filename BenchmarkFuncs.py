@@ -0,0 +1,401 @@
+"""
+Class BenchmarkFuncs contains an end-to-end benchmark harness that measures how full model runs scale
+with the size of the problem. Each case runs a complete hole-mode or surface-mode workflow on
+generated inputs in a fresh process (so that peak memory and in-memory caches belong to that case
+only) and records wall time, peak resident memory (RSS) and, optionally, Python allocation counts
+from tracemalloc in a second run (tracing slows the model down, so it is never timed).
+
+The scaling axes are:
+
+    hole_count      surface-mode (SurfaceFuncs.patch_albedo) over a population of n distinct holes
+    point_spacing   hole-mode (SurfaceFuncs.hole_fluxes) for one hole, hole_w/point_spacing points
+    layer_count     one SNICAR column solve (TwoStreamFuncs.call_snicar) with n layers
+    batch_size      one SNICAR column solve for a batch of n solar zenith angles
+
+compare_solvers runs the two radiative transfer solvers (Toon and adding-doubling) on the same
+columns of granular layers, where both are valid, and reports their speed and the differences
+between their outputs.
+
+Functions in this class include:
+
+1) default_config
+    Returns the configuration shared by all cases (ice column, hole geometry, tolerance)
+
+2) generate_holes
+    Generates a population of n distinct holes with reproducible random dimensions
+
+3) run_case
+    Runs one case in the current process and returns its measurements
+
+4) measure
+    Runs one case in a fresh process (and optionally again with tracemalloc)
+
+5) run
+    Runs every value of every requested axis and returns the results with fitted scaling exponents
+
+6) save_summary
+    Writes the results as JSON
+
+7) plot
+    Plots wall time and peak memory against problem size for each axis (log-log)
+
+8) compare_solvers
+    Runs both radiative transfer solvers on the same columns and reports speed and consistency
+
+"""
+
+
+class BenchmarkFuncs:
+
+    def __init__(self):
+
+
+        return
+
+
+    def default_config():
+
+        """
+        Returns a dictionary describing the ice column and holes used for every case. Any entry can
+        be changed before calling run. Hole dimensions are in metres, as in surface-mode. The column has a
+        single layer of thickness depth except on the layer_count axis, where depth is split equally
+        between the layers.
+
+        """
+
+        return {'density': 850, 'grain_rds': 850, 'layer_type': 1, 'depth': 0.2, 'algae': 0, 'solzen': 45,\
+            'incoming_i': 4, 'DIRECT': True, 'tolerance': 1e-10, 'hole_w': 0.2, 'hole_d': 0.2, 'water_fraction': 0.5,\
+            'point_spacing': 0.01, 'study_area': 100, 'seed': 0}
+
+
+    def generate_holes(n, config):
+
+        """
+        Returns a population table (see HoleDistFuncs) of n distinct holes. Widths and depths are drawn
+        uniformly between half and one and a half times config hole_w and hole_d, rounded to the point
+        spacing so that the number of floor points is well defined, and every hole has the same
+        fractional water level.
+
+        """
+
+        import numpy as np
+        from HoleDistFuncs import HoleDistFuncs
+
+        rng = np.random.default_rng(config['seed'])
+        step = config['point_spacing']
+
+        hole_w = np.maximum(step, np.round(rng.uniform(0.5, 1.5, n)*config['hole_w']/step)*step)
+        hole_d = np.round(rng.uniform(0.5, 1.5, n)*config['hole_d'], 3)
+
+        population, total = HoleDistFuncs.discrete_population(hole_d, hole_w, hole_d*config['water_fraction'], np.ones(n))
+
+        return population
+
+
+    def run_case(axis, value, config):
+
+        """
+        Runs the workload for one value of one axis in the current process. Returns a dictionary with
+        the problem size along the axis and the wall time of the workload (s).
+
+        """
+
+        import time
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SurfaceFuncs import SurfaceFuncs
+        from SpectralGrid import SpectralGrid
+
+        WL = SpectralGrid.default().WL
+        cryoconite_albedo = np.ones(len(WL))*0.2
+
+        def make_params(n_layers, solzen):
+            return TwoStreamFuncs.generate_ice_physical_params([config['density']]*n_layers, [config['grain_rds']]*n_layers,\
+                [config['layer_type']]*n_layers, [config['depth']/n_layers]*n_layers, [config['algae']]*n_layers, solzen,\
+                config['incoming_i'], config['DIRECT'])
+
+        if axis == 'hole_count':
+            population = BenchmarkFuncs.generate_holes(int(value), config)
+            params = make_params(1, config['solzen'])
+            work = lambda: SurfaceFuncs.patch_albedo(population, int(value), config['study_area'], cryoconite_albedo,\
+                WL, params, config['tolerance'], config['point_spacing'])
+            size = int(value)
+
+        elif axis == 'point_spacing':
+            params = make_params(1, config['solzen'])
+            work = lambda: SurfaceFuncs.hole_fluxes(config['hole_d'], config['hole_w'], config['hole_d']*config['water_fraction'],\
+                cryoconite_albedo, WL, params, config['tolerance'], value)
+            size = max(1, int(round(config['hole_w']/value)))
+
+        elif axis == 'layer_count':
+            params = make_params(int(value), config['solzen'])
+            work = lambda: TwoStreamFuncs.call_snicar(params)
+            size = int(value)
+
+        elif axis == 'batch_size':
+            angles = [int(a) for a in np.round(np.linspace(config['solzen'], config['solzen']+30, int(value)))]
+            params = make_params(1, angles if int(value) > 1 else angles[0])
+            work = lambda: TwoStreamFuncs.call_snicar(params)
+            size = int(value)
+
+        else:
+            raise ValueError(f"ERROR: unknown benchmark axis '{axis}'")
+
+        start = time.perf_counter()
+        work()
+        wall_time = time.perf_counter() - start
+
+        return {'axis': axis, 'value': value, 'size': size, 'wall_time': wall_time}
+
+
+    def _child(axis, value, config, trace):
+
+        # runs in a fresh process: measures peak RSS, or allocations if trace is True. Allocations are
+        # counted as increases of the traced memory between profiler events (calls and returns, in
+        # every thread), which misses temporaries freed before the next event
+
+        import resource
+        import sys
+        import threading
+        import tracemalloc
+
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        to_mb = 1/1024**2 if sys.platform == 'darwin' else 1/1024
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*to_mb
+
+        if trace:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            counts = {'allocations': 0, 'allocated': 0, 'last': tracemalloc.get_traced_memory()[0]}
+
+            def profile(frame, event, arg):
+                current = tracemalloc.get_traced_memory()[0]
+                if current > counts['last']:
+                    counts['allocations'] += 1
+                    counts['allocated'] += current - counts['last']
+                counts['last'] = current
+
+            threading.setprofile(profile)
+            sys.setprofile(profile)
+
+        try:
+            result = BenchmarkFuncs.run_case(axis, value, config)
+
+        finally:
+            if trace:
+                sys.setprofile(None)
+                threading.setprofile(None)
+
+        if trace:
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            diff = after.compare_to(before, 'filename')
+            return {'alloc_peak_mb': peak/1024**2, 'alloc_count': counts['allocations'],\
+                'alloc_mb': counts['allocated']/1024**2, 'retained_blocks': sum(stat.count_diff for stat in diff),\
+                'retained_mb': sum(stat.size_diff for stat in diff)/1024**2}
+
+        result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*to_mb
+        result['rss_before_mb'] = rss_before
+
+        return result
+
+
+    def measure(axis, value, config, allocations=False):
+
+        """
+        Runs one case in a fresh process and returns its measurements (wall time, peak RSS and the
+        RSS of the process before the workload started). If allocations is True the case is run a
+        second time, in another fresh process, with tracemalloc to record the peak traced memory, the
+        number and total size of allocations during the run (alloc_count, alloc_mb) and the number and
+        size of blocks still alive at the end of the run (retained_blocks, retained_mb).
+
+        """
+
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        ctx = multiprocessing.get_context('spawn')
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            result = pool.submit(BenchmarkFuncs._child, axis, value, config, False).result()
+
+        if allocations:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                result.update(pool.submit(BenchmarkFuncs._child, axis, value, config, True).result())
+
+        return result
+
+
+    def run(axes, config=None, repeats=1, allocations=False, verbose=True):
+
+        """
+        axes: dictionary of axis name -> list of values, e.g.
+            {'hole_count': [1, 2, 4, 8], 'point_spacing': [0.04, 0.02, 0.01], 'layer_count': [1, 4, 16],
+            'batch_size': [1, 4, 16]}
+
+        Each case is run repeats times and the fastest run is kept. Returns a dictionary with the
+        configuration, a description of the machine, the results of every case and, for each axis,
+        the fitted exponent b of wall_time ~ size**b (1 = linear scaling).
+
+        """
+
+        import os
+        import platform
+        import numpy as np
+
+        config = dict(BenchmarkFuncs.default_config(), **(config or {}))
+
+        results = {}
+        exponents = {}
+
+        for axis, values in axes.items():
+
+            results[axis] = []
+
+            for value in values:
+
+                runs = [BenchmarkFuncs.measure(axis, value, config, allocations) for _ in range(repeats)]
+                best = min(runs, key=lambda r: r['wall_time'])
+                best['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+                results[axis].append(best)
+
+                if verbose:
+                    print(f"{axis} = {value}: size {best['size']}, {best['wall_time']:.3f} s, peak RSS {best['peak_rss_mb']:.1f} MB")
+
+            sizes = np.array([r['size'] for r in results[axis]], dtype=float)
+            times = np.array([r['wall_time'] for r in results[axis]])
+
+            if len(np.unique(sizes)) > 1:
+                exponents[axis] = float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+            else:
+                exponents[axis] = None
+
+        machine = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),\
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+        return {'config': config, 'machine': machine, 'results': results, 'scaling_exponents': exponents}
+
+
+    def save_summary(summary, path):
+
+        """
+        Writes the output of run to path as JSON
+
+        """
+
+        import json
+
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2, default=float)
+
+        return
+
+
+    def plot(summary, path):
+
+        """
+        Plots wall time and peak RSS against problem size for every axis on log-log axes and saves the
+        figure to path
+
+        """
+
+        import matplotlib.pyplot as plt
+
+        axes = list(summary['results'].keys())
+        fig, ax = plt.subplots(2, len(axes), figsize=(4*len(axes), 7), squeeze=False)
+
+        labels = {'hole_count': 'number of holes', 'point_spacing': 'points per hole floor',\
+            'layer_count': 'number of layers', 'batch_size': 'solar angles per solve'}
+
+        for i, axis in enumerate(axes):
+
+            sizes = [r['size'] for r in summary['results'][axis]]
+            exponent = summary['scaling_exponents'][axis]
+
+            ax[0,i].loglog(sizes, [r['wall_time'] for r in summary['results'][axis]], marker='o')
+            ax[0,i].set_title(axis if exponent is None else f"{axis} (slope {exponent:.2f})")
+            ax[0,i].set_ylabel('wall time (s)')
+
+            ax[1,i].loglog(sizes, [r['peak_rss_mb'] for r in summary['results'][axis]], marker='o', color='r')
+            ax[1,i].set_ylabel('peak RSS (MB)')
+            ax[1,i].set_xlabel(labels.get(axis, axis))
+
+        fig.tight_layout()
+        fig.savefig(path)
+
+        return
+
+
+    def compare_solvers(layer_counts=None, solzens=None, config=None, repeats=5, verbose=True):
+
+        """
+        Solves columns of layer_counts granular layers (default 1, 4, 16 and 64, splitting
+        config depth equally) at each of solzens (default 30, 50 and 70 degrees) with both
+        radiative transfer solvers (TwoStreamFuncs.call_snicar with solver 'toon' and
+        'adding_doubling'). The columns use config density, grain radius and algae but are always
+        granular (layer_type 0), since the Toon solver has no solid ice layers.
+
+        Each column is solved once by each solver before timing (to read the input files) and the
+        fastest of repeats solves is kept. Returns a dictionary with the configuration and, for every
+        column, the time of each solver (s), the speedup of Toon over adding-doubling and the
+        largest absolute differences in spectral albedo, broadband albedo (BBA) and in F_btm_net and
+        F_top_pls relative to the incoming flux.
+
+        """
+
+        import io
+        import contextlib
+        import time
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SNICAR_feeder import SOLVERS
+
+        config = dict(BenchmarkFuncs.default_config(), **(config or {}))
+        layer_counts = [1, 4, 16, 64] if layer_counts is None else layer_counts
+        solzens = [30, 50, 70] if solzens is None else solzens
+
+        results = []
+
+        for n_layers in layer_counts:
+
+            for solzen in solzens:
+
+                params = TwoStreamFuncs.generate_ice_physical_params([config['density']]*n_layers,\
+                    [config['grain_rds']]*n_layers, [0]*n_layers, [config['depth']/n_layers]*n_layers,\
+                    [config['algae']]*n_layers, solzen, config['incoming_i'], config['DIRECT'])
+
+                incoming = np.sum(TwoStreamFuncs.generate_incoming_irradiance(params, trim=False))
+                outputs = {}
+                times = {}
+
+                # the solvers print diagnostics for every solve
+                with contextlib.redirect_stdout(io.StringIO()):
+
+                    for solver in SOLVERS:
+
+                        outputs[solver] = TwoStreamFuncs.call_snicar(params, solver=solver)
+                        times[solver] = np.inf
+
+                        for _ in range(repeats):
+                            start = time.perf_counter()
+                            TwoStreamFuncs.call_snicar(params, solver=solver)
+                            times[solver] = min(times[solver], time.perf_counter() - start)
+
+                (albedo_t, BBA_t, F_btm_net_t, F_top_pls_t), (albedo_a, BBA_a, F_btm_net_a, F_top_pls_a) =\
+                    [outputs[solver] for solver in SOLVERS]
+
+                result = {'layers': n_layers, 'solzen': solzen, 'toon_time': times['toon'],\
+                    'adding_doubling_time': times['adding_doubling'], 'speedup': times['adding_doubling']/times['toon'],\
+                    'albedo_diff': float(np.max(np.abs(albedo_t - albedo_a))), 'BBA_diff': float(np.abs(BBA_t - BBA_a)),\
+                    'F_btm_net_diff': float(np.max(np.abs(F_btm_net_t - F_btm_net_a))/incoming),\
+                    'F_top_pls_diff': float(np.max(np.abs(F_top_pls_t - F_top_pls_a))/incoming)}
+
+                results.append(result)
+
+                if verbose:
+                    print(f"{n_layers} layers, solzen {solzen}: Toon {result['toon_time']*1e3:.1f} ms, adding-doubling"\
+                        f" {result['adding_doubling_time']*1e3:.1f} ms ({result['speedup']:.1f}x), max albedo difference"\
+                        f" {result['albedo_diff']:.2e}, BBA difference {result['BBA_diff']:.2e}")
+
+        return {'config': config, 'results': results}
@@ -0,0 +1,383 @@
+"""
+Class CacheFuncs contains a persistent on-disk cache for the two expensive tiers of the model: SNICAR
+column solves (TwoStreamFuncs.call_snicar) and hole floor results for single points
+(ControlFuncs.CalculateFluxes). Results are kept between runs so that rerunning a sweep with one
+changed hole only pays for the columns and points that changed.
+
+The cache is switched on by passing cache_dir (and optionally cache_size, in bytes) to
+TwoStreamFuncs.generate_ice_physical_params. Entries are content addressed: the key is a sha256 hash
+of a canonical form of every input (numbers, lists and arrays with equal values give equal keys),
+a cache version and the versions (size and modification time) of the data files and model source
+files the result depends on, so editing the optical property files or the solvers invalidates
+old entries automatically.
+
+Each entry is one .npz file written to a temporary file and renamed into place, so several worker
+processes can share a cache directory without locking on reads or writes. Reading an entry updates
+its modification time, which is used as the last-access time for least recently used (LRU) eviction
+once the cache grows beyond cache_size. Every put adds the size of its entry to a running estimate
+of the cache size (a .size file updated under a lock file), so the entries are only scanned when
+the estimate goes over cache_size. Eviction then deletes entries until the cache is at EVICT_TO of
+its limit, so the next scans are many puts away. The scan also corrects the estimate, e.g. after
+entries were deleted by hand.
+
+Functions in this class include:
+
+1) key
+    Returns the canonical hash of any number of inputs
+
+2) data_dirs
+    Returns the data directories that results for params depend on
+
+3) data_version
+    Returns a hash of the size and modification time of files or directory trees
+
+4) column_inputs
+    Collects the fields of params that determine a SNICAR column solve
+
+5) get
+    Returns a cached result or None
+
+6) put
+    Stores a result and evicts least recently used entries if the estimated cache size is too large
+
+7) evict
+    Deletes least recently used entries until the cache is within its size limit
+
+"""
+
+
+class CacheFuncs:
+
+    # increment when a change to the model changes results without changing a data or source file
+    CACHE_VERSION = 1
+
+    # source files that results depend on, including the wavelength grid and file paths (SpectralGrid) and
+    # the file readers (IOFuncs); the data directories come from data_dirs
+    SOURCE_FILES = ['TwoStreamFuncs.py', 'SNICAR_feeder.py', 'adding_doubling_solver.py', 'Toon_RT_solver.py',\
+        'ControlFuncs.py', 'SpecReflFuncs.py', 'OpticsTables.py', 'CylinderFuncs.py', 'SpectralGrid.py', 'IOFuncs.py']
+
+    DEFAULT_SIZE = 2e9 # bytes
+    EVICT_TO = 0.9 # eviction leaves the cache at this fraction of its size limit
+
+    _versions = {}
+
+    def __init__(self):
+
+
+        return
+
+
+    def key(*objs, data_dirs=None):
+
+        """
+        Returns a hex sha256 hash of a canonical form of objs. Numbers are hashed by value (1 and 1.0
+        are the same), lists and tuples of numbers are hashed like arrays of float64, and dicts are
+        hashed with their keys sorted. The cache version and the versions of the source files and of
+        the data directories data_dirs (by default the directories used without params, see
+        data_dirs) are always included.
+
+        """
+
+        import hashlib
+        import numbers
+        import os
+        import numpy as np
+
+        h = hashlib.sha256()
+
+        def update(obj):
+
+            if obj is None:
+                h.update(b'N')
+
+            elif isinstance(obj, str):
+                h.update(b'S' + str(len(obj)).encode() + b':' + obj.encode())
+
+            elif isinstance(obj, (numbers.Number, np.number, np.bool_)):
+                h.update(b'F' + np.float64(obj).tobytes())
+
+            elif isinstance(obj, dict):
+                h.update(b'D' + str(len(obj)).encode())
+                for k in sorted(obj, key=str):
+                    update(str(k))
+                    update(obj[k])
+
+            elif isinstance(obj, np.ndarray) or (isinstance(obj, (list, tuple)) and\
+                all(isinstance(x, (numbers.Number, np.number, np.bool_)) for x in obj)):
+                arr = np.ascontiguousarray(obj, dtype=np.float64)
+                h.update(b'A' + str(arr.shape).encode() + arr.tobytes())
+
+            elif isinstance(obj, (list, tuple)):
+                h.update(b'L' + str(len(obj)).encode())
+                for x in obj:
+                    update(x)
+
+            else:
+                raise ValueError(f"ERROR: cannot build a cache key from an object of type {type(obj).__name__}")
+
+        here = os.path.dirname(os.path.abspath(__file__))
+
+        update(CacheFuncs.CACHE_VERSION)
+        update(CacheFuncs.data_version(CacheFuncs.data_dirs() if data_dirs is None else data_dirs))
+        update(CacheFuncs.data_version([os.path.join(here, f) for f in CacheFuncs.SOURCE_FILES]))
+        update(list(objs))
+
+        return h.hexdigest()
+
+
+    def data_dirs(params=None):
+
+        """
+        Returns the data directories that results for params depend on: the BioSNICAR Data folder
+        (see TwoStreamFuncs.data_dir) and the CryoconiteRTM data folder of the spectral grid
+
+        """
+
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SpectralGrid import SpectralGrid
+
+        return [TwoStreamFuncs.data_dir(params) + 'Data/', SpectralGrid.default().data_dir]
+
+
+    def data_version(paths):
+
+        """
+        Returns a hash of the path, size and modification time of every file in paths (files or
+        directory trees). Missing paths are included as missing. Versions are calculated once per
+        process.
+
+        """
+
+        import hashlib
+        import os
+
+        paths = tuple(paths)
+
+        if paths not in CacheFuncs._versions:
+
+            h = hashlib.sha256()
+
+            for path in paths:
+
+                if os.path.isdir(path):
+                    files = sorted(os.path.join(root, f) for root, dirs, names in os.walk(path) for f in names)
+                else:
+                    files = [path]
+
+                for f in files:
+                    try:
+                        stat = os.stat(f)
+                        h.update(f"{f}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+                    except OSError:
+                        h.update(f"{f}:missing;".encode())
+
+            CacheFuncs._versions[paths] = h.hexdigest()
+
+        return CacheFuncs._versions[paths]
+
+
+    def column_inputs(params):
+
+        """
+        Returns the fields of params that determine the result of a SNICAR column solve
+
+        """
+
+        return {'rho_layers': params.rho_layers, 'grain_rds': params.grain_rds, 'layer_type': params.layer_type,\
+            'dz': params.dz, 'mss_cnc_glacier_algae': params.mss_cnc_glacier_algae, 'solzen': params.solzen,\
+            'incoming_i': params.incoming_i, 'DIRECT': params.DIRECT, 'dir_base': getattr(params, 'dir_base', None)}
+
+
+    def get(cache_dir, key):
+
+        """
+        Returns the tuple stored under key, or None if there is no (readable) entry
+
+        """
+
+        import os
+        import zipfile
+        import numpy as np
+
+        path = os.path.join(cache_dir, key[:2], key + '.npz')
+
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                value = tuple(f['arr_%d' % i][()] for i in range(len(f.files)))
+            os.utime(path) # mark as recently used
+
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+        return value
+
+
+    def put(cache_dir, key, value, max_size=DEFAULT_SIZE):
+
+        """
+        Stores tuple value (of arrays and numbers) under key, then evicts least recently used entries
+        if the cache is larger than max_size bytes. The size of the cache is kept as a running
+        estimate, so the entries are only scanned when the estimate is over max_size.
+
+        """
+
+        import os
+        import tempfile
+        import numpy as np
+
+        subdir = os.path.join(cache_dir, key[:2])
+        os.makedirs(subdir, exist_ok=True)
+
+        path = os.path.join(subdir, key + '.npz')
+        fd, tmp = tempfile.mkstemp(dir=subdir, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, *[np.asarray(x) for x in value])
+
+            change = os.path.getsize(tmp)
+            try:
+                change -= os.path.getsize(path) # replacing an entry
+            except OSError:
+                pass
+
+            os.replace(tmp, path)
+
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        with CacheFuncs._lock(cache_dir):
+
+            size = CacheFuncs._read_size(cache_dir)
+
+            if size is None or size + change > max_size:
+                CacheFuncs._evict(cache_dir, CacheFuncs.EVICT_TO*max_size)
+            else:
+                CacheFuncs._write_size(cache_dir, size + change)
+
+        return
+
+
+    def evict(cache_dir, max_size=DEFAULT_SIZE):
+
+        """
+        Deletes the least recently used entries until the cache is no larger than max_size bytes and
+        resets the size estimate. Temporary files left by interrupted writes are removed after an
+        hour. If another process holds the cache lock, this call returns straight away.
+
+        """
+
+        import os
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        with CacheFuncs._lock(cache_dir, block=False) as locked:
+
+            if locked:
+                CacheFuncs._evict(cache_dir, max_size)
+
+        return
+
+
+    def _evict(cache_dir, max_size):
+
+        # scans every entry and deletes the least recently used ones until the total is no larger than
+        # max_size, then writes the total to the size file. The caller holds the lock
+
+        import os
+        import time
+
+        entries = []
+        now = time.time()
+
+        for sub in os.scandir(cache_dir):
+
+            if not sub.is_dir():
+                continue
+
+            for entry in os.scandir(sub.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                if entry.name.endswith('.npz'):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+                elif entry.name.endswith('.tmp') and now - stat.st_mtime > 3600:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+        total = sum(size for mtime, size, path in entries)
+
+        for mtime, size, path in sorted(entries):
+
+            if total <= max_size:
+                break
+
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        CacheFuncs._write_size(cache_dir, total)
+
+        return
+
+
+    def _lock(cache_dir, block=True):
+
+        # context manager holding the cache lock file; yields False if block is False and another
+        # process holds the lock. Without fcntl (Windows) there is no locking
+
+        import contextlib
+        import os
+
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+
+        @contextlib.contextmanager
+        def lock():
+
+            with open(os.path.join(cache_dir, '.lock'), 'w') as f:
+
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        yield False
+                        return
+
+                yield True
+
+        return lock()
+
+
+    def _read_size(cache_dir):
+
+        # the size estimate in bytes, or None if there is none
+
+        import os
+
+        try:
+            with open(os.path.join(cache_dir, '.size')) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+
+    def _write_size(cache_dir, size):
+
+        import os
+
+        with open(os.path.join(cache_dir, '.size'), 'w') as f:
+            f.write(str(int(max(size, 0))))
+
+        return
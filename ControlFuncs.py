@@ -7,6 +7,28 @@ Functions in this class include:
 
 1) CalculateFluxes
     Sets variable values and makes calls to external functions to calculate energy flux at cryoconite sediment layer
+    (optionally interpolating the ice column from an atlas, see AtlasFuncs)
+
+2) RefractiveIndices
+    Loads the spectral refractive indices of air, water and ice
+
+3) DirectBeam
+    Calculates the direct beam energy reaching a point on the hole floor for all wavelengths at once
+
+4) DirectFraction
+    Calculates the fraction of the hole floor reached by the direct beam at each wavelength
+
+5) FloorMean
+    Calculates the exact mean of CalculateFluxes across the hole floor from a few evaluations
+
+6) FloorIrradiance
+    Calculates the parts of CalculateFluxes that do not depend on the cryoconite albedo
+
+7) AlbedoFluxes
+    Calculates the energy absorbed by the cryoconite and escaping the hole for one or many albedo spectra
+
+8) ScreenAlbedos
+    Calculates CalculateFluxes (or FloorMean) for a matrix of cryoconite albedo spectra at once
 
 AUTHOR: JOSEPH COOK, April 2020
 www.tothepoles.co.uk
@@ -22,7 +44,7 @@ class ControlFuncs:
 
         return
 
-    def Validate_Input_Data(hole_d, hole_w, hole_water_d, solzen, total_cryoconite_area, study_area):
+    def Validate_Input_Data(hole_d, hole_w, hole_water_d, solzen, total_cryoconite_area=None, study_area=None):
 
         if hole_water_d > hole_d:
             raise ValueError("ERROR: The water is deeper than the cryoconite hole")
@@ -39,8 +61,8 @@ class ControlFuncs:
         else:
             pass
 
-        if total_cryoconite_area>study_area:
-            raise ValueError (f"Cryconite area = {np.sum(hole_areas*n_holes)} Total study area is less than total cryocontie area")
+        if (total_cryoconite_area is not None) and (study_area is not None) and (total_cryoconite_area>study_area):
+            raise ValueError (f"Cryconite area = {total_cryoconite_area} Total study area is less than total cryocontie area")
         
         else:
             pass
@@ -48,165 +70,419 @@ class ControlFuncs:
         return 
 
 
-    def CalculateFluxes(hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL, params, n_internal_reflections):
+    def RefractiveIndices():
 
-        import numpy as np
-        import math
-        from SpecReflFuncs import specFuncs
-        from TwoStreamFuncs import TwoStreamFuncs
+        """
+        Returns the spectral real (n) and imaginary (k) refractive indices of air, water and ice on
+        the 470-band wavelength grid used for the direct beam calculations. The arrays are loaded once
+        and shared (read-only) through SpectralGrid.
 
-        #############################################
-        # HARD CODED AND DERIVED VARIABLE DEFINITIONS
-        #############################################
+        """
 
-        dz = [hole_d] # thickness of each vertical layer (unit = m)
-        R_sfc = np.mean(cryoconite_albedo) # reflectance of underlying surface - set across all wavelengths
-        theta = 90-params.solzen # calculated from SZA
-        nAir = np.ones(shape=(470))+0.0003 # define n and k for air (array of ones)
-        kAir = np.zeros(shape=(470))+0.00000001
+        from SpectralGrid import SpectralGrid
 
-        # import spectral refractive index for water
-        nWat = np.genfromtxt('/home/joe/Code/CryoconiteRTM/Data/water_n.csv', delimiter=",")
-        kWat = np.genfromtxt ('/home/joe/Code/CryoconiteRTM/Data/water_k.csv', delimiter=",")
-        kWat = kWat[0:-1:10] #every 10th element to match resolution of SNICAR
+        return SpectralGrid.default().refractive_indices()
 
-        nIce = np.genfromtxt('/home/joe/Code/CryoconiteRTM/Data/ice_n.csv', delimiter=",")
-        nIce[nIce<1.0] = 1.0 # prevent math domain error - this is a negligible adjustment to a few wavelengths
-        kIce = np.genfromtxt ('/home/joe/Code/CryoconiteRTM/Data/ice_k.csv', delimiter=",")
 
-        incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+    def DirectBeam(hole_d, hole_w, hole_water_d, point, theta, incoming, WL, nAir, kAir, nWat, kWat, nIce, kIce, abs_coeff=None,\
+        direct=None):
 
-        # set up empty lists
-        R_airtowat = []
-        R_wattoice = []
-        dir_energy_at_hole_floor = []
-        upbeam = []
-        incoming_new = np.copy(incoming)
+        """
+        Calculates the direct beam energy reaching "point" on the hole floor, accounting for refraction
+        at the water surface, Fresnel losses at the water surface and at each wall reflection, and
+        absorption along the path through the water. All wavelengths are evaluated together.
 
-        ####################################
-        # CALCULATE TRANSPORT OF DIRECT BEAM
-        ####################################
+        abs_coeff is the absorption coefficient of water on WL (SpectralGrid.water_abs_coeff); it is
+        calculated from kWat if not given.
+
+        direct is an optional boolean array (one per wavelength) that sets whether the beam reaches
+        the floor directly instead of testing "point" against the critical angle (see FloorMean).
+
+        Returns the spectral direct beam energy at the hole floor and the spectral Fresnel reflectance
+        of the air/water boundary.
+
+        """
+
+        import numpy as np
+        from SpecReflFuncs import specFuncs
 
         # 1) Illumination geometry
 
         # if there is no water, no refraction of incoming beam occurs so t_theta = theta
         if hole_water_d == 0:
 
-            t_theta = theta
-            t_theta_mean = theta
+            t_theta = np.ones(len(WL))*theta
 
         else: # calculate adjusted solar elevation angle after direct beam refracted at air-water boundary
             t_theta = specFuncs.trans_angle(theta,nAir,nWat) 
 
         # call critical angle function to determine whether the direct beam reaches the hole floor at "point"
-        ang_crit = specFuncs.critical_angle(theta, hole_d, hole_w, point) # calculate critical angle
-
-        # 2) For each wavelength, calculate losses at medium boundaries and apply for n interactions
-        for i in range(len(WL)):
-            
-            # calculate losses expected at each type of transition (air/water, water/ice)
-            result1 = specFuncs.fresnel(nAir[i],nWat[i],kAir[i],kWat[i],theta)
-            R_airtowat.append(result1)
-
-            result2 = specFuncs.fresnel(nWat[i],nIce[i],kWat[i],kIce[i],t_theta[i])
-            R_wattoice.append(result2)
-
-            #calculate radiance reflected from water surface
-            reflected_from_water_surface = incoming*result1
-
-            if t_theta[i] > ang_crit:
-
-                # direct beam only hits point on hole floor when the refracted illumination angle 
-                # exceeds the critical angle,
-                
-                if hole_water_d > 0: 
-                    # if there is water, some energy is lost when beam enters from air
-                    incoming_new[i] = incoming_new[i]*(1-R_airtowat[i])
-
-                # the beam energy at the hole floor is just the total incoming after
-                #  air/water fresnel loss
-                dir_energy_at_hole_floor.append(incoming_new[i]) 
-
-                # there are no reflections and the beam does not hit the hole wall
-                beamHitsWall = False
-                SurfStrike_d = hole_w/2
-                n_wat_reflections = 0
-
-
-            else:
-                # if the beam does not directly illuminate the point on the floor, 
-                # it may still reach the floor after multiple reflections betwen the 
-                # hole walls. The following function calculates the number of reflections
-                # between the hole walls before and after entering the water and prior 
-                # to the beam striking the hole floor
-
-                n_air_reflections, n_wat_reflections, total_reflections, SurfStrike_d,\
-                beamHitsWall = specFuncs.test_multiple_reflections(
-                    theta, t_theta[i], hole_d, hole_w, hole_water_d, nAir, nWat, verbose=False)
-        
-                # Use calculated # reflections to remove energy from the beam
-                for j in range(int(n_air_reflections)+1):
-                    # add one to account for the specular reflection occurring when beam 
-                    # hits water surface (not in air_reflections or wat_reflections)
-                    incoming_new[i] = incoming_new[i]*R_airtowat[i] 
-
-                for j in range(int(n_wat_reflections)):
-                    
-                    incoming_new[i] = incoming_new[i]*R_wattoice[i]
-                
-                # this gives the amount of energy available at the hole floor
-                dir_energy_at_hole_floor.append(incoming_new[i]) 
-                
-        
+        if direct is None:
+            ang_crit = specFuncs.critical_angle(theta, hole_d, hole_w, point) # calculate critical angle
+
+        else:
+            # illumination given per wavelength: only the longest wavelength's state is needed for
+            # the path length, so set a critical angle below or above t_theta to match it
+            direct = np.asarray(direct, dtype=bool)
+            ang_crit = 0 if direct[-1] else 90
+
+        # 2) calculate losses at medium boundaries and apply for n interactions
+
+        # calculate losses expected at each type of transition (air/water, water/ice)
+        R_airtowat = specFuncs.fresnel(nAir,nWat,kAir,kWat,theta)
+        R_wattoice = specFuncs.fresnel(nWat,nIce,kWat,kIce,t_theta)
+
+        # direct beam only hits point on hole floor when the refracted illumination angle 
+        # exceeds the critical angle
+        if direct is None:
+            direct = t_theta > ang_crit
+
+        dir_energy_at_hole_floor = np.array(incoming, dtype=float)
+
+        if hole_water_d > 0: 
+            # if there is water, some energy is lost when beam enters from air
+            dir_energy_at_hole_floor[direct] = dir_energy_at_hole_floor[direct]*(1-R_airtowat[direct])
+
+        if not np.all(direct):
+            # if the beam does not directly illuminate the point on the floor, 
+            # it may still reach the floor after multiple reflections betwen the 
+            # hole walls. The following function calculates the number of reflections
+            # between the hole walls before and after entering the water and prior 
+            # to the beam striking the hole floor
+
+            n_air_reflections, n_wat_reflections, total_reflections, SurfStrike_d,\
+            beamHitsWall = specFuncs.test_multiple_reflections(
+                theta, t_theta, hole_d, hole_w, hole_water_d, nAir, nWat, verbose=False)
+
+            # Use calculated # reflections to remove energy from the beam
+            # add one to account for the specular reflection occurring when beam 
+            # hits water surface (not in air_reflections or wat_reflections)
+            reflected = ~direct
+            dir_energy_at_hole_floor[reflected] = dir_energy_at_hole_floor[reflected]\
+                *R_airtowat[reflected]**(int(n_air_reflections)+1)*R_wattoice[reflected]**n_wat_reflections[reflected]
+
         # 3) calculate absorptive losses due to transport through water
         # First calculate path length in water, then calculate loss
-        # using path length and absorption coefficient
-        PathLengthInWat = specFuncs.CalculatePathLength(hole_water_d, hole_w, beamHitsWall, t_theta[i],\
-        SurfStrike_d, n_wat_reflections, ang_crit)        
-        dir_energy_at_hole_floor = specFuncs.AttenuateBeam(PathLengthInWat, kWat, dir_energy_at_hole_floor, WL)
+        # using path length and absorption coefficient. The path length is
+        # calculated for the geometry at the longest wavelength.
+        if direct[-1]:
+            beamHitsWall = False
+            SurfStrike_d = hole_w/2
+            n_wat_last = 0
+
+        else:
+            n_wat_last = n_wat_reflections[-1]
+
+        PathLengthInWat = specFuncs.CalculatePathLength(hole_water_d, hole_w, beamHitsWall, t_theta[-1],\
+        SurfStrike_d, n_wat_last, ang_crit)        
+        dir_energy_at_hole_floor = specFuncs.AttenuateBeam(PathLengthInWat, kWat, dir_energy_at_hole_floor, WL, abs_coeff)
+
+        return dir_energy_at_hole_floor, R_airtowat
+
+
+    def DirectFraction(hole_d, hole_w, hole_water_d, theta, nAir, nWat):
+
+        """
+        Returns the fraction of the hole floor (0 - 1) that the direct beam reaches at each wavelength.
+
+        The critical angle increases monotonically from the sunward wall (point = 0) to the far wall,
+        so the beam reaches every point closer to the sunward wall than the breakpoint where the
+        critical angle equals the refracted elevation angle t_theta, i.e. hole_w - hole_d/tan(t_theta),
+        and no point beyond it. The number of wall reflections does not depend on the point, so these
+        breakpoints are the only places where the result of CalculateFluxes changes across the floor.
+
+        """
+
+        import numpy as np
+        from SpecReflFuncs import specFuncs
+
+        # same refracted angle as DirectBeam
+        if hole_water_d == 0:
+            t_theta = np.ones(len(nWat))*theta
+
+        else:
+            t_theta = specFuncs.trans_angle(theta, nAir, nWat)
+
+        breakpoint = hole_w - hole_d/np.tan(t_theta*(np.pi/180))
+
+        return np.clip(breakpoint/hole_w, 0, 1)
+
+
+    def FloorMean(hole_d, hole_w, hole_water_d, cryoconite_albedo, WL, params, n_internal_reflections, column=None,\
+        atlas=None, incoming=None):
+
+        """
+        Returns the mean of the CalculateFluxes outputs over the whole hole floor (0 <= point <= hole_w),
+        integrated exactly rather than sampled at fixed steps.
+
+        The floor is split at the breakpoints from DirectFraction. Between breakpoints the result at
+        each wavelength depends only on whether that wavelength is direct and whether the longest
+        wavelength (which sets the path length in water) is direct. The segments therefore fall into
+        at most four groups, and the mean is the sum of one evaluation per group weighted by the
+        fraction of the floor in the group at each wavelength. No refinement is needed because the
+        result is constant within each segment. The column is solved once (or interpolated from
+        atlas, see CalculateFluxes) and shared by every evaluation.
+
+        """
+
+        from TwoStreamFuncs import TwoStreamFuncs
+        from AtlasFuncs import AtlasFuncs
+
+        if column is None:
+            column = TwoStreamFuncs.call_snicar(params) if atlas is None else AtlasFuncs.column(atlas, params)
+
+        evaluations = [(weight, ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, None, cryoconite_albedo,\
+            WL, params, n_internal_reflections, column, direct, incoming=incoming)) for weight, direct in ControlFuncs._floor_groups(hole_d, hole_w,\
+            hole_water_d, WL, params)]
+
+        return ControlFuncs._weighted_mean(evaluations, WL)
+
+
+    def _floor_groups(hole_d, hole_w, hole_water_d, WL, params):
+
+        # the groups of floor segments for FloorMean: (floor fraction at each wavelength, direct flag
+        # for each wavelength) for each combination of (this wavelength direct, longest wavelength direct)
+
+        import numpy as np
+        from SpectralGrid import SpectralGrid
+
+        theta = 90-params.solzen
+        nAir, kAir, nWat, kWat, nIce, kIce = SpectralGrid.default().refractive_indices()
+
+        fraction = ControlFuncs.DirectFraction(hole_d, hole_w, hole_water_d, theta, nAir, nWat)
+        last = fraction[-1]
+
+        # floor fraction at each wavelength for (this wavelength direct, longest wavelength direct)
+        weights = {(True, True): np.minimum(fraction, last), (True, False): np.maximum(fraction-last, 0),\
+            (False, True): np.maximum(last-fraction, 0), (False, False): 1-np.maximum(fraction, last)}
+
+        groups = []
+
+        for (this, longest), weight in weights.items():
+
+            if not np.any(weight > 0):
+                continue
+
+            direct = np.full(len(WL), this)
+            direct[-1] = longest
+
+            groups.append((weight, direct))
+
+        return groups
+
+
+    def _weighted_mean(evaluations, WL):
+
+        # the mean of the outputs of several evaluations, each with a weight at every wavelength.
+        # Spectral outputs (last axis of length len(WL)) are weighted, the others do not depend on the point
+
+        import numpy as np
+
+        mean = []
+
+        for i, value in enumerate(evaluations[0][1]):
+
+            if np.ndim(value) >= 1 and np.shape(value)[-1] == len(WL):
+                value = sum(weight*np.asarray(result[i]) for weight, result in evaluations)
+
+            mean.append(value)
+
+        return tuple(mean)
+
+
+    def CalculateFluxes(hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL, params, n_internal_reflections, column=None,\
+        direct=None, geometry='slot', atlas=None, incoming=None):
+
+        # atlas (an AtlasFuncs atlas or the path of one) replaces the column solve by interpolation
+        # in precomputed columns; check the atlas errors before using it. incoming is the irradiance
+        # for params (TwoStreamFuncs.generate_incoming_irradiance), for callers that already have it
+
+        # results for one point are cached on disk if params has a cache_dir (see CacheFuncs)
+        cache_dir = getattr(params, 'cache_dir', None)
+
+        if cache_dir is not None:
+
+            from CacheFuncs import CacheFuncs
+            from AtlasFuncs import AtlasFuncs
+
+            key = CacheFuncs.key('hole', hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL,\
+                CacheFuncs.column_inputs(params), n_internal_reflections, column, direct, geometry,\
+                None if atlas is None else AtlasFuncs.get(atlas).key, data_dirs=CacheFuncs.data_dirs(params))
+            cached = CacheFuncs.get(cache_dir, key)
+
+            if cached is not None:
+                return cached
+
+        floor = ControlFuncs.FloorIrradiance(hole_d, hole_w, hole_water_d, point, WL, params, column, direct, geometry, atlas,\
+            incoming)
+
+        result = ControlFuncs.AlbedoFluxes(floor, cryoconite_albedo, WL, hole_water_d, n_internal_reflections)
+
+        if cache_dir is not None:
+            CacheFuncs.put(cache_dir, key, result, params.cache_size)
+
+        return result
+
+
+    def FloorIrradiance(hole_d, hole_w, hole_water_d, point, WL, params, column=None, direct=None, geometry='slot', atlas=None,\
+        incoming=None):
+
+        """
+        Returns the parts of CalculateFluxes that do not depend on the cryoconite albedo, as a named
+        tuple: the direct and diffuse energy reaching the hole floor at point, the total incoming
+        energy, the upward flux at the top of the ice column (F_top_pls) and the energy reflected
+        from the water surface. Arguments are as for CalculateFluxes.
+
+        """
+
+        import collections
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+        from AtlasFuncs import AtlasFuncs
+        from SpectralGrid import SpectralGrid
+
+        theta = 90-params.solzen # calculated from SZA
+        grid = SpectralGrid.default()
+        nAir, kAir, nWat, kWat, nIce, kIce = grid.refractive_indices()
+
+        if incoming is None:
+            incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+
+        ####################################
+        # CALCULATE TRANSPORT OF DIRECT BEAM
+        ####################################
+
+        # a cylindrical hole is averaged over its whole floor, so point is not used
+        if geometry == 'cylinder':
+            from CylinderFuncs import CylinderFuncs
+            dir_energy_at_hole_floor, R_airtowat = CylinderFuncs.DirectBeam(hole_d, hole_w, hole_water_d, theta,\
+                incoming, WL, nAir, kAir, nWat, kWat, nIce, kIce, grid.water_abs_coeff())
+
+        elif geometry == 'slot':
+            dir_energy_at_hole_floor, R_airtowat = ControlFuncs.DirectBeam(hole_d, hole_w, hole_water_d, point, theta,\
+                incoming, WL, nAir, kAir, nWat, kWat, nIce, kIce, grid.water_abs_coeff(), direct)
+
+        else:
+            raise ValueError(f"ERROR: unknown hole geometry '{geometry}', use 'slot' or 'cylinder'")
+
+        #calculate radiance reflected from water surface
+        reflected_from_water_surface = incoming*R_airtowat[-1]
 
 
         ####################################################
         ## CALCULATE DIFFUSE ENERGY FLUX REACHING HOLE FLOOR
         ####################################################
 
-        albedo, BBA, F_btm_net, F_top_pls = TwoStreamFuncs.call_snicar(params)
-        albedo = albedo[10:]
-        F_btm_net = F_btm_net[10:]
-        
+        # the column solve only depends on params, so callers evaluating many points, water depths
+        # or albedo spectra for one hole can pass in its result
+        if column is None:
+            column = TwoStreamFuncs.call_snicar(params) if atlas is None else AtlasFuncs.column(atlas, params)
+
+        albedo, BBA, F_btm_net, F_top_pls = column
+        F_btm_net = grid.to_model(F_btm_net)
+
+        floor = collections.namedtuple("floor", "dir_energy_at_hole_floor, diffuse_energy_at_hole_floor,"\
+            " total_incoming_energy, F_top_pls, reflected_from_water_surface")
+
+        return floor(dir_energy_at_hole_floor, F_btm_net, np.sum(incoming), F_top_pls, reflected_from_water_surface)
+
+
+    def AlbedoFluxes(floor, cryoconite_albedo, WL, hole_water_d, n_internal_reflections):
+
+        """
+        Returns the outputs of CalculateFluxes for the floor irradiance floor (see FloorIrradiance)
+        and cryoconite_albedo, which is one spectrum or an array of spectra (spectra x wavelengths).
+        For an array, the energy escaping and absorbed by the cryoconite have one row per spectrum
+        and the other outputs are shared by all spectra.
+
+        """
+
+        from SpecReflFuncs import specFuncs
+        from SpectralGrid import SpectralGrid
+
+        nAir, kAir, nWat, kWat, nIce, kIce = SpectralGrid.default().refractive_indices()
+
         ###############################################
         # CALCULATE ENERGY ABSORBED AT CRYOCONITE LAYER
         ###############################################
 
-        dir_energy_absorbed_by_cryoconite = dir_energy_at_hole_floor * (1-cryoconite_albedo)
-        diffuse_energy_at_hole_floor = F_btm_net
-
-        diffuse_energy_absorbed_by_cryoconite = diffuse_energy_at_hole_floor * (1-cryoconite_albedo)
-
-        total_incoming_energy = np.sum(incoming)
+        dir_energy_absorbed_by_cryoconite = floor.dir_energy_at_hole_floor * (1-cryoconite_albedo)
+        diffuse_energy_absorbed_by_cryoconite = floor.diffuse_energy_at_hole_floor * (1-cryoconite_albedo)
 
 
         ####################################
         ## ACCOUNT FOR INTERNAL REFLECTIONS
         ####################################
 
-        energy_escaping_internal_reflections = []
-        energy_lost_internal_reflections = []
-        
-        # loop through wavelengths
-        for i in range(len(WL)):
+        # every wavelength of every spectrum at once
+        energy_escaping_internal_reflections, energy_lost_internal_reflections, cryoconite_abs =\
+            specFuncs.internal_reflection_spectra(hole_water_d, cryoconite_albedo, WL, nAir, kAir, nWat, kWat,\
+            n_internal_reflections, floor.dir_energy_at_hole_floor, floor.diffuse_energy_at_hole_floor)
 
-            escaped, loss, cryoconite_abs = specFuncs.internal_reflection(hole_water_d, cryoconite_albedo[i], WL[i], nAir[i], kAir[i], nWat[i], kWat[i], n_internal_reflections,\
-                dir_energy_at_hole_floor[i], diffuse_energy_at_hole_floor[i])
+        # the absorption after internal reflection at the last wavelength is added at every
+        # wavelength, as in the original wavelength loop
+        diffuse_energy_absorbed_by_cryoconite = diffuse_energy_absorbed_by_cryoconite + cryoconite_abs[...,-1:]
 
-            energy_escaping_internal_reflections.append(escaped)
-            energy_lost_internal_reflections.append(loss)
-        
-        energy_escaping_internal_reflections= np.array(energy_escaping_internal_reflections)
-        # import matplotlib.pyplot as plt
-        # plt.plot(energy_escaping_internal_reflections)
+        return (energy_escaping_internal_reflections, dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite,\
+            floor.total_incoming_energy, floor.dir_energy_at_hole_floor, floor.diffuse_energy_at_hole_floor, floor.F_top_pls,\
+            floor.reflected_from_water_surface)
 
-        diffuse_energy_absorbed_by_cryoconite = diffuse_energy_absorbed_by_cryoconite + cryoconite_abs
-        
-        return energy_escaping_internal_reflections, dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite, total_incoming_energy,\
-        dir_energy_at_hole_floor, diffuse_energy_at_hole_floor, F_top_pls, reflected_from_water_surface
+
+    def ScreenAlbedos(hole_d, hole_w, hole_water_d, point, albedos, WL, params, n_internal_reflections, column=None,\
+        geometry='slot', block=1024, incoming=None, atlas=None):
+
+        """
+        Returns the outputs of CalculateFluxes for every cryoconite albedo spectrum in albedos
+        (spectra x wavelengths, on the model grid WL) in one hole, as a named tuple with the names of
+        the CalculateFluxes outputs. The energy escaping and absorbed by the cryoconite have one row per
+        spectrum; the other outputs do not depend on the albedo and are returned once.
+
+        The floor irradiance and the ice column only depend on the hole and illumination, so they are
+        calculated once and the spectra are evaluated together as array operations (block spectra at a
+        time, to limit memory). Each row equals CalculateFluxes for that spectrum. If point is None the
+        outputs are averaged over the whole floor, as FloorMean (cylindrical holes are always averaged).
+        atlas interpolates the column instead of solving it (see CalculateFluxes).
+
+        """
+
+        import collections
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+        from AtlasFuncs import AtlasFuncs
+
+        albedos = np.asarray(albedos, dtype=float)
+
+        if albedos.ndim != 2 or albedos.shape[1] != len(WL):
+            raise ValueError("ERROR: albedos must be an array of spectra x wavelengths ({} wavelengths), got shape {}"\
+                .format(len(WL), albedos.shape))
+
+        if column is None:
+            column = TwoStreamFuncs.call_snicar(params) if atlas is None else AtlasFuncs.column(atlas, params)
+
+        if point is None and geometry == 'slot':
+            groups = ControlFuncs._floor_groups(hole_d, hole_w, hole_water_d, WL, params)
+        else:
+            groups = [(None, None)]
+
+        floors = [(weight, ControlFuncs.FloorIrradiance(hole_d, hole_w, hole_water_d, point, WL, params, column, direct,\
+            geometry, incoming=incoming)) for weight, direct in groups]
+
+        blocks = []
+
+        for start in range(0, max(len(albedos), 1), block):
+
+            evaluations = [(weight, ControlFuncs.AlbedoFluxes(floor, albedos[start:start+block], WL, hole_water_d,\
+                n_internal_reflections)) for weight, floor in floors]
+
+            blocks.append(evaluations[0][1] if groups[0][0] is None else ControlFuncs._weighted_mean(evaluations, WL))
+
+        outputs = list(blocks[0])
+
+        for i in range(3):
+            outputs[i] = np.concatenate([result[i] for result in blocks])
+
+        fluxes = collections.namedtuple("fluxes", "energy_escaping_internal_reflections, dir_energy_absorbed_by_cryoconite,"\
+            " diffuse_energy_absorbed_by_cryoconite, total_incoming_energy, dir_energy_at_hole_floor,"\
+            " diffuse_energy_at_hole_floor, F_top_pls, reflected_from_water_surface")
+
+        return fluxes(*outputs)
@@ -0,0 +1,180 @@
+"""
+Class CylinderFuncs contains the direct beam calculations for cylindrical holes (a circular aperture
+above a circular floor of the same diameter hole_w) as an alternative to the 2-D slot used by
+ControlFuncs.DirectBeam.
+
+Specular reflection from a vertical wall does not change the elevation of the beam, so the beam always
+travels hole_d/tan(elevation) horizontally before reaching the floor, whatever the number of wall
+reflections, and its path length in water is always hole_water_d/sin(t_theta). In plan view a beam
+entering the aperture travels along a chord of the circle, and after each wall reflection along
+another chord of the same length, so the number of reflections only depends on the chord (i.e. the
+distance b of the beam from the centre of the hole, which accounts for the azimuth of every point on
+the floor relative to the sun) and on where along the chord the beam enters. For entry points spread
+uniformly along a chord the number of reflections takes only two values, with probabilities set by
+the fractional part of (horizontal distance / chord length), so the distribution is calculated
+exactly along each chord and integrated over b with a fixed set of chords.
+
+The chords and their weights (the kernel) are purely geometric, are calculated once per process and
+are shared by every hole, so a cylindrical hole costs one array operation over chords and
+wavelengths and one evaluation of the rest of CalculateFluxes.
+
+Functions in this class include:
+
+1) kernel
+    Returns the chord lengths (in hole radii) and area weights used to integrate over the aperture
+
+2) reflection_factor
+    Returns the mean transmission of the beam after reflections above and below the water surface
+
+3) DirectBeam
+    Calculates the direct beam energy averaged across the floor of a cylindrical hole
+
+"""
+
+
+class CylinderFuncs:
+
+    KERNEL_NODES = 512 # chords used to integrate over the aperture
+
+    _kernels = {}
+
+    def __init__(self):
+
+
+        return
+
+
+    def kernel(n_nodes=None):
+
+        """
+        Returns a named tuple of chord lengths (in units of the hole radius) and weights (summing to
+        one) for n_nodes chords (default KERNEL_NODES) at equal steps of the angle phi = asin(b/R).
+        The weight of a chord is the fraction of the aperture area within its strip, 4/pi*cos(phi)^2
+        dphi. Kernels are kept for the rest of the process.
+
+        """
+
+        import collections
+        import numpy as np
+
+        n_nodes = CylinderFuncs.KERNEL_NODES if n_nodes is None else int(n_nodes)
+
+        if n_nodes not in CylinderFuncs._kernels:
+
+            phi = (np.arange(n_nodes) + 0.5) * (np.pi/2)/n_nodes
+            chord = 2*np.cos(phi)
+            weight = np.cos(phi)**2
+            weight = weight/np.sum(weight)
+
+            chord.setflags(write=False)
+            weight.setflags(write=False)
+
+            CylinderFuncs._kernels[n_nodes] = collections.namedtuple("kernel", "chord, weight")(chord, weight)
+
+        return CylinderFuncs._kernels[n_nodes]
+
+
+    def _crossings(x, chord):
+
+        # number of whole chords travelled (q) and the remaining fraction of a chord (r) for horizontal
+        # distances x (in hole radii). A beam entering with fraction u of its chord left before the wall
+        # is reflected q+1 times if u <= r and q times otherwise.
+
+        import numpy as np
+
+        crossings = np.asarray(x, dtype=float)[..., None]/chord
+        q = np.floor(crossings)
+
+        return q, crossings - q
+
+
+    def reflection_factor(x_air, x_total, R_air, R_water, T_direct, n_nodes=None):
+
+        """
+        x_air: horizontal distance (in hole radii) travelled above the water surface, one value
+        x_total: horizontal distance (in hole radii) travelled before reaching the floor, one value per
+        wavelength
+        R_air, R_water: reflectance of a wall reflection above and below the water surface and
+        T_direct: transmission of a beam reaching the floor without wall reflections, per wavelength
+
+        Returns the mean transmission of the beam over the aperture. A beam reflected n_air times
+        above and n_wat times below the water surface is weighted R_air**(n_air+1)*R_water**n_wat, as
+        in ControlFuncs.DirectBeam (the extra factor is the reflection at the water surface).
+
+        """
+
+        import numpy as np
+
+        chord, weight = CylinderFuncs.kernel(n_nodes)
+
+        q_air, r_air = CylinderFuncs._crossings(x_air, chord)
+        q_tot, r_tot = CylinderFuncs._crossings(x_total, chord)
+
+        R_air = np.asarray(R_air, dtype=float)[:, None]
+        R_water = np.asarray(R_water, dtype=float)[:, None]
+        T_direct = np.asarray(T_direct, dtype=float)[:, None]
+
+        # the reflection counts are constant between the breakpoints r_air and r_tot along each chord
+        lower = np.minimum(r_air, r_tot)
+        upper = np.maximum(r_air, r_tot)
+
+        factor = 0
+
+        for start, end in ((0, lower), (lower, upper), (upper, 1)):
+
+            u = (start + end)/2
+            n_air = q_air + (u <= r_air)
+            n_tot = q_tot + (u <= r_tot)
+
+            transmission = np.where(n_tot == 0, T_direct, R_air**(n_air+1)*R_water**(n_tot-n_air))
+            factor = factor + np.sum(weight*(end - start)*transmission, axis=-1)
+
+        return factor
+
+
+    def DirectBeam(hole_d, hole_w, hole_water_d, theta, incoming, WL, nAir, kAir, nWat, kWat, nIce, kIce, abs_coeff=None):
+
+        """
+        Calculates the direct beam energy averaged across the floor of a cylindrical hole of diameter
+        hole_w, with the same losses as ControlFuncs.DirectBeam: Fresnel losses at the water surface
+        and at each wall reflection and absorption along the path through the water. All wavelengths
+        are evaluated together.
+
+        Returns the spectral direct beam energy at the hole floor and the spectral Fresnel reflectance
+        of the air/water boundary.
+
+        """
+
+        import numpy as np
+        from SpecReflFuncs import specFuncs
+
+        # same refracted angle and boundary losses as the slot
+        if hole_water_d == 0:
+            t_theta = np.ones(len(WL))*theta
+
+        else:
+            t_theta = specFuncs.trans_angle(theta, nAir, nWat)
+
+        R_airtowat = specFuncs.fresnel(nAir,nWat,kAir,kWat,theta)
+        R_wattoice = specFuncs.fresnel(nWat,nIce,kWat,kIce,t_theta)
+
+        if hole_water_d > 0:
+            T_direct = 1-R_airtowat
+
+        else:
+            T_direct = np.ones(len(WL))
+
+        # horizontal distance travelled above and below the water surface, in hole radii
+        radius = hole_w/2
+        x_air = (hole_d-hole_water_d)/np.tan(theta*(np.pi/180))/radius
+        x_total = x_air + hole_water_d/np.tan(t_theta*(np.pi/180))/radius
+
+        dir_energy_at_hole_floor = np.array(incoming, dtype=float)\
+            *CylinderFuncs.reflection_factor(x_air, x_total, R_airtowat, R_wattoice, T_direct)
+
+        # the path length in water does not depend on the reflections; as for the slot it is
+        # calculated for the longest wavelength
+        PathLengthInWat = hole_water_d/np.sin(t_theta[-1]*(np.pi/180)) if hole_water_d > 0 else 0
+        dir_energy_at_hole_floor = specFuncs.AttenuateBeam(PathLengthInWat, kWat, dir_energy_at_hole_floor, WL, abs_coeff)
+
+        return dir_energy_at_hole_floor, R_airtowat
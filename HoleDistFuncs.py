@@ -0,0 +1,200 @@
+"""
+Class HoleDistFuncs contains functions that describe a population of cryoconite holes as statistical
+distributions of hole width, hole depth and water level instead of a list of discrete hole classes.
+Each distribution is reduced to a small number of representative values (nodes) with weights, so that
+surface-mode only has to run the model for the nodes and the total number of holes becomes a scaling
+factor rather than a loop bound.
+
+Functions in this class include:
+
+1) parametric
+    Collects the name and parameters of a parametric distribution (normal, lognormal, uniform, gamma)
+
+2) empirical
+    Collects a set of measured values (e.g. hole widths from a field inventory) into a distribution
+
+3) nodes
+    Reduces one distribution to n nodes and weights using Gaussian quadrature where the distribution
+    allows it (normal, lognormal, uniform) and stratified sampling otherwise (gamma, empirical)
+
+4) hole_population
+    Combines width, depth and water level distributions into a table of representative holes
+
+5) discrete_population
+    Converts the original discrete hole classes (hole_d, hole_w, hole_water_d, n_holes) into the same
+    table so that both kinds of input are integrated identically
+
+"""
+
+
+class HoleDistFuncs:
+
+    def __init__(self):
+
+
+        return
+
+
+    def parametric(kind, **kwargs):
+
+        """
+        Defines a parametric distribution. Supported kinds and their parameters are:
+
+            normal      mean, sd
+            lognormal   median, sigma (sigma = standard deviation of log(x))
+            uniform     low, high
+            gamma       shape, scale
+
+        Values drawn from normal distributions are clipped at min_value (default 1e-6) so that holes
+        never have zero or negative dimensions.
+
+        """
+
+        import collections
+
+        required = {'normal': ('mean', 'sd'), 'lognormal': ('median', 'sigma'),
+            'uniform': ('low', 'high'), 'gamma': ('shape', 'scale')}
+
+        if kind not in required:
+            raise ValueError(f"ERROR: unknown distribution '{kind}', choose from {list(required.keys())}")
+
+        for key in required[kind]:
+            if key not in kwargs:
+                raise ValueError(f"ERROR: {kind} distribution requires parameter '{key}'")
+
+        distribution = collections.namedtuple("distribution", "kind, params, samples")
+
+        return distribution(kind, dict(kwargs), None)
+
+
+    def empirical(samples):
+
+        """
+        Defines an empirical distribution from measured values
+
+        """
+
+        import collections
+        import numpy as np
+
+        samples = np.asarray(samples, dtype=float).ravel()
+
+        if len(samples) == 0:
+            raise ValueError("ERROR: empirical distribution needs at least one sample")
+
+        distribution = collections.namedtuple("distribution", "kind, params, samples")
+
+        return distribution('empirical', {}, np.sort(samples))
+
+
+    def nodes(dist, n_nodes):
+
+        """
+        Returns n_nodes representative values and their weights (summing to 1) for distribution dist.
+
+        Normal and lognormal distributions use Gauss-Hermite quadrature and uniform distributions use
+        Gauss-Legendre quadrature, which integrate smooth responses to high order with few nodes. Gamma
+        and empirical distributions are split into n_nodes equal-probability strata and each stratum is
+        represented by its median value (stratified sampling).
+
+        A single number is also accepted and treated as a fixed value (one node with weight 1).
+
+        """
+
+        import numpy as np
+        from scipy import stats
+
+        if np.isscalar(dist):
+            return np.array([float(dist)]), np.array([1.0])
+
+        if n_nodes < 1:
+            raise ValueError("ERROR: n_nodes must be at least 1")
+
+        if dist.kind in ('normal', 'lognormal'):
+
+            x, w = np.polynomial.hermite_e.hermegauss(n_nodes) # probabilists' Hermite, weight exp(-x^2/2)
+            w = w/np.sqrt(2*np.pi)
+
+            if dist.kind == 'normal':
+                values = dist.params['mean'] + dist.params['sd']*x
+                values[values < dist.params.get('min_value', 1e-6)] = dist.params.get('min_value', 1e-6)
+
+            else:
+                values = dist.params['median'] * np.exp(dist.params['sigma']*x)
+
+        elif dist.kind == 'uniform':
+
+            x, w = np.polynomial.legendre.leggauss(n_nodes)
+            low = dist.params['low']
+            high = dist.params['high']
+            values = low + (x+1)*(high-low)/2
+            w = w/2
+
+        else:
+
+            # stratified sampling: median of each equal-probability stratum
+            q = (np.arange(n_nodes)+0.5)/n_nodes
+            w = np.ones(n_nodes)/n_nodes
+
+            if dist.kind == 'gamma':
+                values = stats.gamma.ppf(q, dist.params['shape'], scale=dist.params['scale'])
+
+            else:
+                values = np.quantile(dist.samples, q)
+
+        return np.asarray(values, dtype=float), np.asarray(w, dtype=float)
+
+
+    def hole_population(width, depth, water_fraction, n_nodes=5):
+
+        """
+        Combines distributions of hole width, hole depth and water level into a table of representative
+        holes. Water level is expressed as a fraction of hole depth (0 = dry, 1 = full) so that the water
+        can never be deeper than the hole. Each argument may be a distribution or a fixed value. The
+        three variables are treated as independent and the table is their tensor product.
+
+        n_nodes can be a single integer or a list of three integers (width, depth, water_fraction).
+
+        Returns a named tuple with arrays hole_w, hole_d, hole_water_d and weight (summing to 1)
+
+        """
+
+        import collections
+        import numpy as np
+
+        if np.isscalar(n_nodes):
+            n_nodes = [n_nodes]*3
+
+        w_vals, w_wts = HoleDistFuncs.nodes(width, n_nodes[0])
+        d_vals, d_wts = HoleDistFuncs.nodes(depth, n_nodes[1])
+        f_vals, f_wts = HoleDistFuncs.nodes(water_fraction, n_nodes[2])
+        f_vals = np.clip(f_vals, 0, 1)
+
+        W, D, F = np.meshgrid(w_vals, d_vals, f_vals, indexing='ij')
+        wW, wD, wF = np.meshgrid(w_wts, d_wts, f_wts, indexing='ij')
+
+        population = collections.namedtuple("population", "hole_w, hole_d, hole_water_d, weight")
+
+        return population(W.ravel(), D.ravel(), (D*F).ravel(), (wW*wD*wF).ravel())
+
+
+    def discrete_population(hole_d, hole_w, hole_water_d, n_holes):
+
+        """
+        Converts discrete hole classes into a population table, weighting each class by its share of
+        the total hole count. Returns the population and the total number of holes.
+
+        """
+
+        import collections
+        import numpy as np
+
+        n_holes = np.asarray(n_holes, dtype=float)
+
+        if np.sum(n_holes) <= 0:
+            raise ValueError("ERROR: n_holes must contain at least one hole")
+
+        population = collections.namedtuple("population", "hole_w, hole_d, hole_water_d, weight")
+
+        return population(np.asarray(hole_w, dtype=float), np.asarray(hole_d, dtype=float),\
+            np.asarray(hole_water_d, dtype=float), n_holes/np.sum(n_holes)), np.sum(n_holes)
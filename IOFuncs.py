@@ -0,0 +1,462 @@
+"""
+Class IOFuncs contains the functions used to read the netCDF optical property and irradiance files.
+A SNICAR run reads one file per layer, per impurity and per solar zenith angle; these reads are
+independent, so they are made concurrently by a shared thread pool instead of one after another.
+On networked filesystems the time to open a file, rather than the amount of data, dominates short
+runs.
+
+Batch runs can also prefetch: the reads for the next scenario are started in the background while
+the current scenario is solving. Reads are kept for the MAX_READS most recently used files, so a
+prefetched file, or a file shared by consecutive scenarios (e.g. the impurity files), is only read
+once. Only the variables a run needs are loaded, as numpy arrays, and the files are closed straight
+away. The files are assumed not to change while the model is running; call clear otherwise.
+
+The data files can also be packed into one archive (build_archive). The archive is a short header,
+a JSON index of every file and variable, and the arrays themselves, each aligned to 64 bytes. It
+is memory-mapped when opened, so a lookup is a read-only view into the file rather than a file
+open and decode, and processes on one machine share the pages through the operating system's
+cache. The archive ARCHIVE_FILE in the CryoconiteRTM data folder (SpectralGrid.DATA_DIR) is
+opened automatically on first use if it exists; files that are not in an open archive are read
+from disk as before. Rebuild the archive after changing the data.
+
+Functions in this class include:
+
+1) read
+    Reads named variables from one netCDF file (or its entry in an open archive)
+
+2) read_csv
+    Reads a csv table (or its entry in an open archive)
+
+3) read_many
+    Reads several files concurrently, reusing reads that are already running or finished
+
+4) prefetch
+    Starts reading files in the background for a later call to read_many
+
+5) clear
+    Discards all kept reads
+
+6) build_archive
+    Packs every netCDF and csv file under a list of directories into one archive
+
+7) open_archive
+    Memory-maps an archive so that reads of the files it contains come from it
+
+8) close_archives
+    Stops reading from all open archives
+
+9) list_files
+    Lists the files in a directory and in open archives
+
+"""
+
+
+class IOFuncs:
+
+    MAX_WORKERS = 8 # threads used for reading files
+    MAX_READS = 256 # number of recently used reads kept (least recently used are discarded first)
+
+    # archive of the data files in the CryoconiteRTM data folder, opened on first use if it exists (see build_archive)
+    ARCHIVE_FILE = 'optical_archive.bin'
+    ARCHIVE_MAGIC = b'CRTMARC1'
+    ALIGN = 64 # bytes
+
+    _pool = None
+    _reads = {}
+    _lock = None
+    _archives = []
+    _archive_checked = False
+
+    def __init__(self):
+
+
+        return
+
+
+    def _executor():
+
+        # returns the shared thread pool and lock, created on first use
+
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        if IOFuncs._pool is None:
+            IOFuncs._lock = threading.Lock()
+            IOFuncs._pool = ThreadPoolExecutor(max_workers=IOFuncs.MAX_WORKERS, thread_name_prefix='IOFuncs')
+
+        return IOFuncs._pool, IOFuncs._lock
+
+
+    def _submit(requests):
+
+        # returns a future for every read in requests, starting the reads that are not already kept
+
+        pool, lock = IOFuncs._executor()
+        futures = {}
+
+        with lock:
+
+            for path, names in requests.values():
+
+                read_key = (path, tuple(names))
+
+                if read_key in IOFuncs._reads:
+                    futures[read_key] = IOFuncs._reads.pop(read_key) # re-inserted below as most recently used
+                else:
+                    futures[read_key] = pool.submit(IOFuncs.read, path, names)
+
+                IOFuncs._reads[read_key] = futures[read_key]
+
+            while len(IOFuncs._reads) > IOFuncs.MAX_READS:
+                IOFuncs._reads.pop(next(iter(IOFuncs._reads)))
+
+        return futures
+
+
+    def read(path, names):
+
+        """
+        Returns a dictionary of the variables in names (as read-only numpy arrays) from the netCDF
+        file at path, taken from an open archive if the archive contains them
+
+        """
+
+        import xarray as xr
+
+        variables = IOFuncs._from_archive(path, names)
+
+        if variables is None:
+
+            with xr.open_dataset(path) as f:
+                variables = {name: f[name].values for name in names}
+
+            for value in variables.values():
+                value.setflags(write=False)
+
+        return variables
+
+
+    def read_csv(path):
+
+        """
+        Returns the comma separated table at path as a read-only numpy array, taken from an open
+        archive if the archive contains it
+
+        """
+
+        import numpy as np
+
+        variables = IOFuncs._from_archive(path, ['values'])
+
+        if variables is None:
+            variables = {'values': np.genfromtxt(path, delimiter=",")}
+            variables['values'].setflags(write=False)
+
+        return variables['values']
+
+
+    def read_many(requests):
+
+        """
+        requests: dictionary of key -> (path, variable names)
+
+        Reads every file concurrently and returns a dictionary of key -> dictionary of variables.
+        Reads that are kept (finished, or started by prefetch) are not repeated, so the arrays are
+        shared and read-only: copy them before modifying them. Errors (e.g. a missing file) are
+        raised here and the failed read is not kept.
+
+        """
+
+        futures = IOFuncs._submit(requests)
+        data = {}
+
+        for key, (path, names) in requests.items():
+
+            read_key = (path, tuple(names))
+
+            try:
+                variables = futures[read_key].result()
+
+            except BaseException:
+                pool, lock = IOFuncs._executor()
+                with lock:
+                    if IOFuncs._reads.get(read_key) is futures[read_key]:
+                        del IOFuncs._reads[read_key]
+                raise
+
+            data[key] = variables
+
+        return data
+
+
+    def prefetch(requests):
+
+        """
+        Starts reading the files in requests (as for read_many) in the background and returns
+        straight away. Errors are raised by the read_many call that uses the result.
+
+        """
+
+        IOFuncs._submit(requests)
+
+        return
+
+
+    def clear():
+
+        """
+        Discards all kept reads, e.g. after the data files have changed
+
+        """
+
+        pool, lock = IOFuncs._executor()
+
+        with lock:
+            IOFuncs._reads.clear()
+
+        return
+
+
+    def build_archive(archive_path=None, roots=None, verbose=True):
+
+        """
+        Packs every variable of every netCDF (.nc) file and every csv table under the directories in
+        roots (default the BioSNICAR and CryoconiteRTM data folders) into one archive at archive_path
+        (default ARCHIVE_FILE in the CryoconiteRTM data folder). Tables that cannot be read as numbers
+        are skipped. The archive is written to a temporary file and renamed into place, so processes
+        using an old archive are not affected.
+
+        """
+
+        import json
+        import os
+        import tempfile
+        import numpy as np
+        import xarray as xr
+
+        archive_path = IOFuncs._default_archive() if archive_path is None else archive_path
+        roots = [os.path.abspath(root) for root in (IOFuncs._default_roots() if roots is None else roots)]
+
+        index = {'roots': roots, 'files': {}}
+        arrays = []
+        offset = 0
+
+        for i, root in enumerate(roots):
+
+            paths = sorted(os.path.join(folder, f) for folder, dirs, names in os.walk(root) for f in names\
+                if f.endswith('.nc') or f.endswith('.csv'))
+
+            for path in paths:
+
+                try:
+                    if path.endswith('.nc'):
+                        with xr.open_dataset(path) as f:
+                            variables = {name: f[name].values for name in f.variables}
+                    else:
+                        variables = {'values': np.genfromtxt(path, delimiter=",")}
+
+                except (OSError, ValueError) as error:
+                    if verbose:
+                        print("skipping {}: {}".format(path, error))
+                    continue
+
+                entry = {}
+
+                for name, value in variables.items():
+
+                    value = np.ascontiguousarray(value)
+
+                    if value.dtype.kind not in 'biuf':
+                        continue
+
+                    entry[name] = [offset, value.dtype.str, list(value.shape)]
+                    arrays.append((offset, value))
+                    offset += -(-value.nbytes//IOFuncs.ALIGN)*IOFuncs.ALIGN
+
+                index['files']['{}/{}'.format(i, os.path.relpath(path, root))] = entry
+
+        header = json.dumps(index).encode()
+        start = -(-(len(IOFuncs.ARCHIVE_MAGIC) + 8 + len(header))//IOFuncs.ALIGN)*IOFuncs.ALIGN
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(archive_path)), suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(IOFuncs.ARCHIVE_MAGIC + np.uint64(len(header)).tobytes() + header)
+                for position, value in arrays:
+                    f.seek(start + position)
+                    f.write(value.tobytes())
+                f.truncate(start + offset)
+            os.replace(tmp, archive_path)
+
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        if verbose:
+            print("archived {} files ({:.1f} MB) in {}".format(len(index['files']), (start + offset)/1024**2, archive_path))
+
+        return
+
+
+    def open_archive(archive_path=None, roots=None):
+
+        """
+        Memory-maps the archive at archive_path (default ARCHIVE_FILE in the CryoconiteRTM data folder)
+        so that reads of the files in it come from the archive. roots replaces the directories the
+        archive was built from, e.g. if the data has moved. Archives opened later take precedence.
+
+        """
+
+        import json
+        import os
+        import numpy as np
+
+        archive_path = IOFuncs._default_archive() if archive_path is None else archive_path
+
+        with open(archive_path, 'rb') as f:
+
+            magic = f.read(len(IOFuncs.ARCHIVE_MAGIC))
+
+            if magic != IOFuncs.ARCHIVE_MAGIC:
+                raise ValueError("ERROR: {} is not an optical property archive".format(archive_path))
+
+            length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            index = json.loads(f.read(length).decode())
+
+        start = -(-(len(IOFuncs.ARCHIVE_MAGIC) + 8 + length)//IOFuncs.ALIGN)*IOFuncs.ALIGN
+        data = np.memmap(archive_path, dtype=np.uint8, mode='r')
+
+        roots = [os.path.abspath(root) for root in (index['roots'] if roots is None else roots)]
+
+        IOFuncs._executor()
+
+        with IOFuncs._lock:
+            IOFuncs._archive_checked = True
+            IOFuncs._archives.insert(0, (roots, index['files'], data, start))
+            IOFuncs._reads.clear()
+
+        return
+
+
+    def close_archives(auto_open=False):
+
+        """
+        Stops reading from all open archives (including the one opened automatically). With
+        auto_open the default archive is opened again on the next read, if it exists.
+
+        """
+
+        IOFuncs._executor()
+
+        with IOFuncs._lock:
+            IOFuncs._archive_checked = not auto_open
+            IOFuncs._archives.clear()
+            IOFuncs._reads.clear()
+
+        return
+
+
+    def _open_default():
+
+        # opens the default archive the first time any file is read, if it exists
+
+        import os
+
+        if not IOFuncs._archive_checked:
+
+            IOFuncs._executor()
+            path = IOFuncs._default_archive()
+
+            with IOFuncs._lock:
+                auto_open = not IOFuncs._archive_checked and os.path.exists(path)
+                IOFuncs._archive_checked = True
+
+            if auto_open:
+                IOFuncs.open_archive(path)
+
+        return
+
+
+    def _default_archive():
+
+        # ARCHIVE_FILE in the CryoconiteRTM data folder
+
+        from SpectralGrid import SpectralGrid
+
+        return SpectralGrid.DATA_DIR + IOFuncs.ARCHIVE_FILE
+
+
+    def _default_roots():
+
+        # the BioSNICAR and CryoconiteRTM data folders
+
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SpectralGrid import SpectralGrid
+
+        return [TwoStreamFuncs.DIR_BASE + 'Data/', SpectralGrid.DATA_DIR]
+
+
+    def _from_archive(path, names):
+
+        # returns views of the variables in names for the file at path from the first open archive
+        # that has all of them, or None
+
+        import os
+        import numpy as np
+
+        IOFuncs._open_default()
+
+        path = os.path.abspath(path)
+
+        for roots, files, data, start in list(IOFuncs._archives):
+
+            for i, root in enumerate(roots):
+
+                if not path.startswith(root + os.sep):
+                    continue
+
+                entry = files.get('{}/{}'.format(i, os.path.relpath(path, root)))
+
+                if entry is None or any(name not in entry for name in names):
+                    continue
+
+                variables = {}
+
+                for name in names:
+                    offset, dtype, shape = entry[name]
+                    dtype = np.dtype(dtype)
+                    nbytes = dtype.itemsize*int(np.prod(shape))
+                    variables[name] = data[start + offset:start + offset + nbytes].view(dtype).reshape(shape)
+
+                return variables
+
+        return None
+
+
+    def list_files(directory, prefix='', suffix=''):
+
+        """
+        Returns the sorted names of the files in directory (not in subdirectories) that start with
+        prefix and end with suffix, including files that are only in an open archive
+
+        """
+
+        import os
+
+        directory = os.path.abspath(directory)
+        names = set()
+
+        IOFuncs._open_default()
+
+        if os.path.isdir(directory):
+            names.update(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)))
+
+        for roots, files, data, start in list(IOFuncs._archives):
+            for i, root in enumerate(roots):
+                if directory == root or directory.startswith(root + os.sep):
+                    folder = '{}/{}/'.format(i, os.path.relpath(directory, root)).replace('/./', '/')
+                    names.update(key[len(folder):] for key in files if key.startswith(folder) and '/' not in key[len(folder):])
+
+        return sorted(f for f in names if f.startswith(prefix) and f.endswith(suffix))
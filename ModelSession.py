@@ -0,0 +1,293 @@
+"""
+Class ModelSession holds the model set up for repeated calculations in one process. The functions
+in ControlFuncs, SurfaceFuncs and TwoStreamFuncs are stateless: every call builds params, finds the
+data files, reads the irradiance and solves the SNICAR column again. A session is created once with
+the location of the data and a configuration (the ice column, illumination, cryoconite albedo and
+hole geometry) and keeps what does not change between calls:
+
+    the spectral grid and refractive indices (SpectralGrid)
+    the incoming irradiance for each illumination
+    the solved columns, for the MAX_COLUMNS most recently used column inputs
+
+The irradiance and columns are passed down to the calculations, so a session call reads no files
+once they are kept. The optical property tables and data files are kept by OpticsTables and IOFuncs
+for the whole process and are shared by all sessions. Solves use the SolverWorkspace of the calling
+thread (see TwoStreamFuncs.call_snicar), so a session can be used from several threads. Any
+configuration value can be changed for one call by passing it to that call, e.g.
+session.hole(20, 10, 5, solzen=60), without creating a new session.
+
+Functions in this class include:
+
+1) params
+    Returns params for the session configuration with layer thicknesses dz
+
+2) incoming
+    Returns the incoming irradiance on the model grid
+
+3) solve
+    Returns the solved SNICAR column for params, reusing columns already solved by the session
+
+4) column
+    Solves the column with layer thicknesses dz
+
+5) hole
+    Hole-mode: the CalculateFluxes outputs at a point, or averaged over the floor, of one hole (cm)
+
+6) hole_fluxes
+    Surface-mode: the floor-averaged fluxes of one hole (m), as SurfaceFuncs.hole_fluxes
+
+7) surface
+    Surface-mode: the albedo of a patch of ice containing a population of holes, as SurfaceFuncs.patch_albedo
+
+8) screen
+    Hole-mode: the hole outputs for a matrix of cryoconite albedo spectra at once, as ControlFuncs.ScreenAlbedos
+
+"""
+
+
+class ModelSession:
+
+    MAX_COLUMNS = 256 # columns kept by a session (least recently used are discarded first)
+
+    CONFIG = {'density': [850], 'grain_rds': [850], 'layer_type': [1], 'algae': 0, 'solzen': 45, 'incoming_i': 4,\
+        'DIRECT': True, 'cryoconite_albedo': 0.2, 'tolerance': 1e-10, 'geometry': 'slot', 'atlas': None}
+
+    def __init__(self, data_root=None, model_data=None, cache_dir=None, cache_size=2e9, max_columns=None, **config):
+
+        """
+        data_root: location of the BioSNICAR_GO_PY folder (default TwoStreamFuncs.DIR_BASE)
+        model_data: location of the CryoconiteRTM data folder with the refractive indices, archive
+        and atlas (default SpectralGrid.DATA_DIR). It is set for the whole process (see
+        SpectralGrid.use_data_dir), so all sessions in one process share it.
+        cache_dir, cache_size: optional disk cache of columns and holes (see CacheFuncs)
+        max_columns: number of solved columns kept in memory (default MAX_COLUMNS)
+        config: any key of CONFIG, the rest take the default values. cryoconite_albedo may be one
+        value or a spectrum on the model grid. atlas (an AtlasFuncs atlas or the path of one)
+        interpolates the hole columns instead of solving them (see ControlFuncs.CalculateFluxes).
+
+        The grid and refractive indices are loaded here, so that the first calculation does not pay
+        for them.
+
+        """
+
+        import threading
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SpectralGrid import SpectralGrid
+
+        self.data_root = TwoStreamFuncs.DIR_BASE if data_root is None else data_root
+
+        if model_data is not None:
+            SpectralGrid.use_data_dir(model_data)
+
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.max_columns = ModelSession.MAX_COLUMNS if max_columns is None else int(max_columns)
+        self.config = ModelSession._config(ModelSession.CONFIG, config)
+
+        self.grid = SpectralGrid.default()
+        self.WL = self.grid.WL
+        self.indices = self.grid.refractive_indices()
+
+        self._incoming = {}
+        self._columns = {}
+        self._lock = threading.Lock()
+        self.counts = {'solved': 0, 'reused': 0}
+
+        return
+
+
+    def _config(config, changes):
+
+        # returns config with changes applied, checking their keys
+
+        unknown = set(changes) - set(ModelSession.CONFIG)
+
+        if unknown:
+            raise ValueError(f"ERROR: unknown session configuration keys {sorted(unknown)}")
+
+        return dict(config, **changes)
+
+
+    def params(self, dz, **changes):
+
+        """
+        Returns params (see TwoStreamFuncs.generate_ice_physical_params) for the session
+        configuration, with changes applied, and layer thicknesses dz (m)
+
+        """
+
+        from TwoStreamFuncs import TwoStreamFuncs
+
+        c = ModelSession._config(self.config, changes)
+
+        return TwoStreamFuncs.generate_ice_physical_params(list(c['density']), list(c['grain_rds']), list(c['layer_type']),\
+            list(dz), c['algae'], c['solzen'], c['incoming_i'], c['DIRECT'], self.cache_dir, self.cache_size, self.data_root)
+
+
+    def incoming(self, **changes):
+
+        """
+        Returns the incoming irradiance on the model grid for the session illumination (solzen,
+        incoming_i and DIRECT), with changes applied. The array is kept and is read-only.
+
+        """
+
+        from TwoStreamFuncs import TwoStreamFuncs
+
+        c = ModelSession._config(self.config, changes)
+        key = (c['solzen'], c['incoming_i'], c['DIRECT'])
+
+        if key not in self._incoming:
+            incoming = TwoStreamFuncs.generate_incoming_irradiance(self.params([1], **changes))
+            incoming.setflags(write=False)
+            self._incoming[key] = incoming
+
+        return self._incoming[key]
+
+
+    def solve(self, params):
+
+        """
+        Returns the output of TwoStreamFuncs.call_snicar for params (albedo, BBA, F_btm_net, F_top_pls).
+        Columns are kept by the session, so a column with the same inputs (see
+        CacheFuncs.column_inputs) is only solved once. Can be passed as solve_column to the
+        SurfaceFuncs functions.
+
+        """
+
+        from TwoStreamFuncs import TwoStreamFuncs
+        from CacheFuncs import CacheFuncs
+
+        key = tuple(sorted(CacheFuncs.column_inputs(params).items()))
+
+        with self._lock:
+            column = self._columns.pop(key, None) # re-inserted below as most recently used
+
+        solved = column is None
+
+        if solved:
+            column = TwoStreamFuncs.call_snicar(params)
+
+        with self._lock:
+            self.counts['solved' if solved else 'reused'] += 1
+            self._columns[key] = column
+            while len(self._columns) > self.max_columns:
+                self._columns.pop(next(iter(self._columns)))
+
+        return column
+
+
+    def column(self, dz, **changes):
+
+        """
+        Returns the solved SNICAR column (albedo, BBA, F_btm_net, F_top_pls) for the session
+        configuration, with changes applied, and layer thicknesses dz (m)
+
+        """
+
+        return self.solve(self.params(dz, **changes))
+
+
+    def _hole_column(self, params, c):
+
+        # the column around a hole for configuration c: interpolated from the atlas if there is one,
+        # otherwise solved (and kept) by the session
+
+        from AtlasFuncs import AtlasFuncs
+
+        return self.solve(params) if c['atlas'] is None else AtlasFuncs.column(c['atlas'], params)
+
+
+    def _albedo(self, c):
+
+        # the cryoconite albedo of configuration c on the model grid
+
+        import numpy as np
+
+        return np.broadcast_to(np.asarray(c['cryoconite_albedo'], dtype=float), self.WL.shape)
+
+
+    def hole(self, hole_d, hole_w, hole_water_d, point=None, dz_scale=0.01, **changes):
+
+        """
+        Hole-mode calculation for one hole with dimensions in cm (as in driver.py). The column
+        around the hole is one layer of thickness hole_d*dz_scale (m). Returns the outputs of
+        ControlFuncs.CalculateFluxes at point (cm from the sunward wall) or, if point is None,
+        averaged over the whole floor (ControlFuncs.FloorMean). Cylindrical holes are always
+        averaged over the whole floor.
+
+        """
+
+        from ControlFuncs import ControlFuncs
+
+        c = ModelSession._config(self.config, changes)
+
+        ControlFuncs.Validate_Input_Data(hole_d, hole_w, hole_water_d, c['solzen'])
+
+        params = self.params([hole_d*dz_scale], **changes)
+        column = self._hole_column(params, c)
+
+        if c['geometry'] == 'cylinder' or point is not None:
+            return ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, point, self._albedo(c), self.WL, params,\
+                c['tolerance'], column, geometry=c['geometry'], incoming=self.incoming(**changes))
+
+        return ControlFuncs.FloorMean(hole_d, hole_w, hole_water_d, self._albedo(c), self.WL, params, c['tolerance'], column,\
+            incoming=self.incoming(**changes))
+
+
+    def hole_fluxes(self, hole_d, hole_w, hole_water_d, point_spacing=None, keep_points=False, **changes):
+
+        """
+        Surface-mode calculation for one hole with dimensions in m: returns the floor-averaged
+        spectral energy absorbed, escaping and reflected from the water surface (see
+        SurfaceFuncs.hole_fluxes)
+
+        """
+
+        from SurfaceFuncs import SurfaceFuncs
+
+        c = ModelSession._config(self.config, changes)
+
+        return SurfaceFuncs.hole_fluxes(hole_d, hole_w, hole_water_d, self._albedo(c), self.WL, self.params([hole_d], **changes),\
+            c['tolerance'], point_spacing, c['geometry'], solve_column=self.solve, keep_points=keep_points,\
+            incoming=self.incoming(**changes), atlas=c['atlas'])
+
+
+    def surface(self, population, n_holes, study_area, dz, point_spacing=None, **changes):
+
+        """
+        Surface-mode calculation for a patch of ice of area study_area (m2) containing n_holes holes
+        drawn from population (see SurfaceFuncs.patch_albedo). The ice between the holes has layer
+        thicknesses dz (m). Columns are shared with the other calls of the session.
+
+        """
+
+        from SurfaceFuncs import SurfaceFuncs
+
+        c = ModelSession._config(self.config, changes)
+
+        return SurfaceFuncs.patch_albedo(population, n_holes, study_area, self._albedo(c), self.WL,\
+            self.params(dz, **changes), c['tolerance'], point_spacing, c['geometry'], solve_column=self.solve,\
+            incoming=self.incoming(**changes), atlas=c['atlas'])
+
+
+    def screen(self, hole_d, hole_w, hole_water_d, albedos, point=None, dz_scale=0.01, **changes):
+
+        """
+        Hole-mode calculation (cm, see hole) for every cryoconite albedo spectrum in albedos
+        (spectra x wavelengths on the model grid). Returns the named tuple of
+        ControlFuncs.ScreenAlbedos, in which the energy escaping and absorbed by the cryoconite have
+        one row per spectrum. The cryoconite_albedo of the configuration is not used.
+
+        """
+
+        from ControlFuncs import ControlFuncs
+
+        c = ModelSession._config(self.config, changes)
+
+        ControlFuncs.Validate_Input_Data(hole_d, hole_w, hole_water_d, c['solzen'])
+
+        params = self.params([hole_d*dz_scale], **changes)
+
+        return ControlFuncs.ScreenAlbedos(hole_d, hole_w, hole_water_d, point, albedos, self.WL, params, c['tolerance'],\
+            self._hole_column(params, c), c['geometry'], incoming=self.incoming(**changes))
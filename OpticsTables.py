@@ -0,0 +1,158 @@
+"""
+Class OpticsTables provides the optical properties of ice grains and bubbly ice for any grain or
+bubble radius. The precomputed files (one per radius, e.g. ice_Pic16_0500.nc or bbl_0500.nc) are
+treated as the rows of a table: the available radii are listed once, the two rows either side of
+the requested radius are read (once per process, see IOFuncs) and the spectra are interpolated in
+log radius. Radii on the table grid return the file values exactly.
+
+Extinction and scattering coefficients scale approximately as a power of radius (1/r for grains
+and bubbles much larger than the wavelength), so they are interpolated in log-log space; single
+scattering co-albedo (1 - SSA) is interpolated in log-log space for the same reason, and the
+asymmetry parameter linearly in log radius. Density does not need a table: for grains it only
+scales the layer mass and for bubbly ice the volume fraction of air is calculated from density
+in snicar_feeder.
+
+Functions in this class include:
+
+1) table
+    Returns the radii available for a set of files and a function that reads a row
+
+2) interpolate
+    Interpolates table rows to any radius within the table
+
+3) mie_ice
+    Returns SSA, MAC and g for spherical ice grains of any radius
+
+4) bubbly_ice
+    Returns the scattering coefficient and g for bubbly ice with bubbles of any radius
+
+"""
+
+
+class OpticsTables:
+
+    _tables = {}
+
+    def __init__(self):
+
+
+        return
+
+
+    def table(directory, prefix, names):
+
+        """
+        Returns the sorted radii of the files directory/prefix<radius>.nc (radius written as an
+        integer, e.g. 0500) and a function that returns the variables in names for one radius.
+        The directory is only listed once per process.
+
+        """
+
+        import collections
+        import numpy as np
+        from IOFuncs import IOFuncs
+
+        key = (directory, prefix, tuple(names))
+
+        if key not in OpticsTables._tables:
+
+            files = {}
+
+            for f in IOFuncs.list_files(directory, prefix, '.nc'):
+                stem = f[len(prefix):-len('.nc')]
+                if stem.isdigit():
+                    files[int(stem)] = f
+
+            if len(files) == 0:
+                raise ValueError("ERROR: no optical property files {}*.nc in {}".format(prefix, directory))
+
+            radii = np.array(sorted(files), dtype=float)
+            radii.setflags(write=False)
+
+            def row(radius):
+                return IOFuncs.read_many({0: (directory + files[int(radius)], list(names))})[0]
+
+            OpticsTables._tables[key] = collections.namedtuple("table", "radii, row")(radii, row)
+
+        return OpticsTables._tables[key]
+
+
+    def interpolate(table, radius, loglog=(), coalbedo=()):
+
+        """
+        Returns a dictionary of the table variables at radius. Variables in loglog are interpolated
+        in log-log space, variables in coalbedo have 1 - value interpolated in log-log space and all
+        others are interpolated linearly in log radius. Radii outside the table raise a ValueError.
+
+        """
+
+        import numpy as np
+
+        radius = float(radius)
+        radii = table.radii
+
+        if radius < radii[0] or radius > radii[-1]:
+            raise ValueError("ERROR: radius {} is outside the optical property table ({:g} - {:g} um)".format(\
+                radius, radii[0], radii[-1]))
+
+        i = int(np.searchsorted(radii, radius))
+
+        if radii[i] == radius:
+            return {name: np.array(value) for name, value in table.row(radii[i]).items()}
+
+        lower = table.row(radii[i-1])
+        upper = table.row(radii[i])
+        w = (np.log(radius) - np.log(radii[i-1]))/(np.log(radii[i]) - np.log(radii[i-1]))
+
+        values = {}
+
+        for name in lower:
+
+            y0 = np.asarray(lower[name], dtype=float)
+            y1 = np.asarray(upper[name], dtype=float)
+
+            if name in coalbedo:
+                y0, y1 = 1 - y0, 1 - y1
+
+            linear = (1-w)*y0 + w*y1
+
+            if name in loglog or name in coalbedo:
+                positive = (y0 > 0) & (y1 > 0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    logarithmic = np.exp((1-w)*np.log(y0) + w*np.log(y1))
+                linear = np.where(positive, logarithmic, linear)
+
+            values[name] = 1 - linear if name in coalbedo else linear
+
+        return values
+
+
+    def mie_ice(dir_base, rf_ice, radius):
+
+        """
+        Returns a dictionary of ss_alb, ext_cff_mss and asm_prm (480 bands) for spherical ice grains
+        with radius (um), using the Mie files for refractive index rf_ice (0 = Warren 1984,
+        1 = Warren 2008, 2 = Picard 2016)
+
+        """
+
+        from SNICAR_feeder import REFIDX_NAMES
+
+        directory = str(dir_base + 'Data/Mie_files/480band/ice_{0}/'.format(REFIDX_NAMES[rf_ice]))
+        table = OpticsTables.table(directory, 'ice_{}_'.format(REFIDX_NAMES[rf_ice]), ['ss_alb', 'ext_cff_mss', 'asm_prm'])
+
+        return OpticsTables.interpolate(table, radius, loglog=('ext_cff_mss',), coalbedo=('ss_alb',))
+
+
+    def bubbly_ice(dir_base, radius):
+
+        """
+        Returns a dictionary of sca_cff_vlm (scattering cross section per unit volume of bubble) and
+        asm_prm (480 bands) for bubbly ice with bubble radius (um)
+
+        """
+
+        directory = str(dir_base + 'Data/bubbly_ice_files/')
+        table = OpticsTables.table(directory, 'bbl_', ['sca_cff_vlm', 'asm_prm'])
+
+        return OpticsTables.interpolate(table, radius, loglog=('sca_cff_vlm',))
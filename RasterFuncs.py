@@ -0,0 +1,194 @@
+"""
+Class RasterFuncs contains functions for running surface-mode over gridded maps, e.g. cryoconite hole
+coverage and hole size derived from UAV imagery. Each pixel is treated as a patch of ice with its own
+hole statistics and (optionally) ice properties.
+
+The maps are processed one tile at a time using dask, so neither the inputs nor the spectral outputs
+need to fit in memory. The model is only run once for each unique hole geometry and each unique ice
+column: pixel values are rounded to a set number of significant digits, the unique combinations in a
+tile are solved (or taken from the solutions already found for earlier tiles) and the results are mapped back
+onto the pixels. Because surface-mode is linear in hole coverage, coverage is not part of the key.
+
+Functions in this class include:
+
+1) surface_maps
+    Takes per-pixel hole coverage, width, depth and water level (plus optional density and grain
+    radius) as xarray DataArrays and returns lazy maps of spectral albedo, broadband albedo, spectral
+    energy absorbed by cryoconite and broadband energy absorbed by cryoconite
+
+"""
+
+
+class RasterFuncs:
+
+    def __init__(self):
+
+
+        return
+
+
+    def surface_maps(hole_fraction, hole_w, hole_d, water_fraction, params, cryoconite_albedo, WL, tolerance,\
+        density=None, grain_rds=None, tile_size=256, digits=3, point_spacing=None):
+
+        """
+        hole_fraction: fraction of each pixel covered by cryoconite holes (0-1)
+        hole_w, hole_d: representative hole width and depth in each pixel (m)
+        water_fraction: water depth in each pixel's holes as a fraction of hole depth (0-1)
+        density, grain_rds: optional maps of ice density and bubble/grain radius. If None the values
+        in params are used everywhere.
+
+        All maps must be 2D xarray DataArrays with the same dims and shape. They are split into tiles of
+        tile_size x tile_size pixels. Hole width, depth and water fraction are rounded to digits
+        significant digits (so small holes keep their relative precision) and density and grain radius
+        to integers before unique solutions are looked up. Pixels whose hole width or depth is zero or
+        negative have no holes, i.e. they are treated as bare ice.
+
+        Returns an xarray Dataset whose variables are dask arrays (call .compute() or .to_netcdf() to
+        evaluate them tile by tile):
+
+            albedo          spectral albedo (y, x, wavelength)
+            BBA             broadband albedo (y, x)
+            absorbed        spectral energy absorbed by cryoconite (W m-2 of pixel)
+            total_absorbed  broadband energy absorbed by cryoconite (W m-2 of pixel)
+
+        """
+
+        import threading
+        import numpy as np
+        from concurrent.futures import Future
+        import xarray as xr
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SurfaceFuncs import SurfaceFuncs
+        from SpectralGrid import SpectralGrid
+
+        dims = hole_fraction.dims
+
+        if density is None:
+            density = xr.full_like(hole_fraction, params.rho_layers[0], dtype=float)
+
+        if grain_rds is None:
+            grain_rds = xr.full_like(hole_fraction, params.grain_rds[0], dtype=float)
+
+        maps = [hole_fraction, hole_w, hole_d, water_fraction, density, grain_rds]
+        maps = [m.astype(float).chunk({dim: tile_size for dim in dims}) for m in maps]
+
+        grid = SpectralGrid.default()
+        incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+        n_wvl = len(WL)
+
+        # solutions shared between tiles (and between dask worker threads), as futures so that a key
+        # asked for by several threads at once is only solved by the first of them
+        ice_solutions = {}
+        hole_solutions = {}
+        lock = threading.Lock()
+
+        def solve_once(solutions, key, solve):
+
+            with lock:
+                future = solutions.get(key)
+                owner = future is None
+                if owner:
+                    future = solutions[key] = Future()
+
+            if owner:
+                try:
+                    future.set_result(solve(key))
+                except BaseException as error:
+                    future.set_exception(error)
+                    with lock:
+                        solutions.pop(key, None) # a later tile tries again
+
+            return future.result()
+
+        def column_params(rho, rds, dz):
+
+            return TwoStreamFuncs.generate_ice_physical_params([rho]*len(params.rho_layers), [int(rds)]*len(params.grain_rds),\
+                params.layer_type, dz, params.mss_cnc_glacier_algae, params.solzen, params.incoming_i, params.DIRECT,\
+                params.cache_dir, params.cache_size, params.dir_base)
+
+        def ice_up(key):
+
+            albedo, BBA, F_btm_net, F_top_pls = TwoStreamFuncs.call_snicar(column_params(key[0], key[1], params.dz))
+
+            return np.array(grid.to_model(F_top_pls))
+
+        def hole_up_absorbed(key):
+
+            hole_w_, hole_d_, water_fraction_, rho, rds = key
+            hole = SurfaceFuncs.hole_fluxes(hole_d_, hole_w_, hole_d_*water_fraction_, cryoconite_albedo, WL,\
+                column_params(rho, rds, [hole_d_]), tolerance, point_spacing, incoming=incoming)
+
+            return (hole.reflected_from_water_surface + hole.escaping, hole.absorbed)
+
+        def solve_ice(key):
+
+            return solve_once(ice_solutions, key, ice_up)
+
+        def solve_hole(key):
+
+            return solve_once(hole_solutions, key, hole_up_absorbed)
+
+        def round_relative(x):
+
+            # rounds to digits significant digits; zeros stay zero
+            magnitude = np.floor(np.log10(np.abs(np.where(x == 0, 1, x))))
+            scale = 10.0**(digits - 1 - magnitude)
+
+            return np.round(x*scale)/scale
+
+        def tile(hf, w, d, wf, rho, rds):
+
+            # returns the spectral upwelling flux and absorbed energy for one tile, each of shape
+            # (y, x, wavelength)
+
+            up_out = np.full(hf.shape + (n_wvl,), np.nan)
+            absorbed_out = np.full(hf.shape + (n_wvl,), np.nan)
+            valid = np.isfinite(hf) & np.isfinite(w) & np.isfinite(d) & np.isfinite(wf) & np.isfinite(rho) & np.isfinite(rds)
+
+            if not np.any(valid):
+                return up_out, absorbed_out
+
+            w, d = round_relative(w[valid]), round_relative(d[valid])
+            hf = np.where((w > 0) & (d > 0), np.clip(hf[valid], 0, 1), 0) # no holes without a hole geometry
+            ice_keys = np.stack([np.round(rho[valid]), np.round(rds[valid])], axis=1)
+            hole_keys = np.stack([w, d, np.clip(round_relative(wf[valid]), 0, 1), ice_keys[:,0], ice_keys[:,1]], axis=1)
+
+            up = np.zeros((len(hf), n_wvl))
+            absorbed = np.zeros((len(hf), n_wvl))
+
+            unique_ice, ice_idx = np.unique(ice_keys, axis=0, return_inverse=True)
+            ice_up = []
+            for n, k in enumerate(unique_ice):
+                if n + 1 < len(unique_ice): # read the next column's files while this one solves
+                    TwoStreamFuncs.call_snicar(column_params(unique_ice[n+1][0], unique_ice[n+1][1], params.dz), prefetch=True)
+                ice_up.append(solve_ice(tuple(k)))
+            ice_up = np.array(ice_up)
+            up += (1-hf)[:,None] * ice_up[ice_idx.ravel()]
+
+            has_holes = hf > 0
+
+            if np.any(has_holes):
+                unique_holes, hole_idx = np.unique(hole_keys[has_holes], axis=0, return_inverse=True)
+                holes = [solve_hole(tuple(k)) for k in unique_holes]
+                weight = hf[has_holes][:,None]
+                up[has_holes] += weight * np.array([hole[0] for hole in holes])[hole_idx.ravel()]
+                absorbed[has_holes] += weight * np.array([hole[1] for hole in holes])[hole_idx.ravel()]
+
+            up_out[valid] = up
+            absorbed_out[valid] = absorbed
+
+            return up_out, absorbed_out
+
+        incoming_da = xr.DataArray(incoming, dims=['wavelength'])
+
+        # both spectral outputs come from one pass over the tiles
+        up, absorbed = xr.apply_ufunc(tile, *maps, output_core_dims=[['wavelength'], ['wavelength']], dask='parallelized',\
+            output_dtypes=[float, float], dask_gufunc_kwargs={'output_sizes': {'wavelength': n_wvl}})
+        albedo = up/incoming_da
+        albedo = albedo.where((albedo >= 0) | albedo.isnull(), 0.0001)
+
+        out = xr.Dataset({'albedo': albedo, 'BBA': up.sum('wavelength', skipna=False)/incoming_da.sum(),\
+            'absorbed': absorbed, 'total_absorbed': absorbed.sum('wavelength', skipna=False)})
+        out = out.assign_coords(wavelength=WL)
+
+        return out
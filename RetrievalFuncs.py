@@ -0,0 +1,175 @@
+"""
+Class RetrievalFuncs contains functions for the inverse problem: estimating the water depth (or the
+effective depth) of a cryoconite hole from the measured ratio of hole floor to ice surface irradiance.
+
+The forward model is the same as in ControlFuncs.CalculateFluxes, but only the quantities needed for
+the floor irradiance are evaluated. The incoming irradiance and refractive indices are loaded once,
+the direct beam is calculated for all wavelengths at once and the SNICAR column solve (which depends
+only on the column depth) is cached, so each evaluation of the forward model is cheap. A short scan
+across the allowed range brackets the best match and a bounded optimizer then refines it.
+
+Functions in this class include:
+
+1) forward_model
+    Returns a cached function giving the modelled floor/surface irradiance ratio for a hole geometry
+
+2) retrieve
+    Retrieves water depth or effective hole depth for one hole from a measured ratio
+
+3) retrieve_field_measurements
+    Runs retrieve for every hole in a field measurement csv (e.g. TestData/FieldMeasurements.csv)
+
+"""
+
+
+class RetrievalFuncs:
+
+    def __init__(self):
+
+
+        return
+
+
+    def forward_model(params, WL, dz_scale=0.01, band=slice(0,40), depth_decimals=1, columns=None):
+
+        """
+        Returns a function ratio(hole_d, hole_w, hole_water_d, point) giving the ratio of the total
+        (direct + diffuse) irradiance at "point" on the hole floor, summed over band, to the total
+        incoming irradiance. This is the ratio used in ValidationTests.py.
+
+        Hole dimensions are in the units used by CalculateFluxes and are converted to a column
+        thickness in metres by dz_scale (default cm to m). Column solves are cached by hole depth
+        rounded to depth_decimals; the number of column solves made so far is available as
+        ratio.n_columns. Columns that are already solved (e.g. in parallel, see ValidationFuncs) can
+        be passed in as a dictionary of rounded hole depth -> F_btm_net on WL.
+
+        """
+
+        import numpy as np
+        from ControlFuncs import ControlFuncs
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SpectralGrid import SpectralGrid
+
+        incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+        grid = SpectralGrid.default()
+        nAir, kAir, nWat, kWat, nIce, kIce = grid.refractive_indices()
+        theta = 90-params.solzen
+        total_incoming = np.sum(incoming)
+        columns = {} if columns is None else dict(columns)
+
+        def diffuse_at_floor(hole_d):
+
+            key = round(float(hole_d), depth_decimals)
+
+            if key not in columns:
+                column_params = TwoStreamFuncs.generate_ice_physical_params(params.rho_layers, params.grain_rds,\
+                    params.layer_type, [key*dz_scale], params.mss_cnc_glacier_algae, params.solzen,\
+                    params.incoming_i, params.DIRECT, params.cache_dir, params.cache_size, params.dir_base)
+                albedo, BBA, F_btm_net, F_top_pls = TwoStreamFuncs.call_snicar(column_params)
+                columns[key] = np.array(grid.to_model(F_btm_net))
+
+            return columns[key]
+
+        def ratio(hole_d, hole_w, hole_water_d, point):
+
+            dir_energy_at_hole_floor, R_airtowat = ControlFuncs.DirectBeam(hole_d, hole_w, hole_water_d, point,\
+                theta, incoming, WL, nAir, kAir, nWat, kWat, nIce, kIce, grid.water_abs_coeff())
+
+            total_energy_at_hole_floor = dir_energy_at_hole_floor + diffuse_at_floor(hole_d)
+            ratio.n_columns = len(columns)
+
+            return np.sum(total_energy_at_hole_floor[band])/total_incoming
+
+        ratio.n_columns = len(columns)
+
+        return ratio
+
+
+    def retrieve(measured_ratio, hole_d, hole_w, model, parameter='water_depth', bounds=None,\
+        water_fraction=0.7, n_scan=12, xtol=1e-3):
+
+        """
+        Retrieves one parameter of a hole from measured_ratio using forward model "model" (from
+        forward_model). The floor irradiance is evaluated at the centre of the hole floor.
+
+        parameter = 'water_depth': hole depth and width are fixed and the water depth is retrieved
+            within bounds (default 0 to hole_d). Only one column solve is needed.
+        parameter = 'depth': width is fixed, water depth is water_fraction * depth, and the effective
+            hole depth is retrieved within bounds (default 0.5 to 1.5 * hole_d).
+
+        The ratio is a piecewise smooth function of the parameter (it jumps where the number of wall
+        reflections changes), so n_scan evenly spaced evaluations first bracket the best match and a
+        bounded Brent search then refines it within the bracket.
+
+        Returns a named tuple with the retrieved value, the modelled ratio at that value, the residual
+        (modelled - measured) and the number of forward model evaluations.
+
+        """
+
+        import collections
+        import numpy as np
+        from scipy.optimize import minimize_scalar
+
+        if parameter == 'water_depth':
+
+            lo, hi = (0, hole_d) if bounds is None else bounds
+            forward = lambda x: model(hole_d, hole_w, x, hole_w/2)
+
+        elif parameter == 'depth':
+
+            lo, hi = (0.5*hole_d, 1.5*hole_d) if bounds is None else bounds
+            forward = lambda x: model(x, hole_w, x*water_fraction, hole_w/2)
+
+        else:
+            raise ValueError("ERROR: parameter must be 'water_depth' or 'depth'")
+
+        cost = lambda x: (forward(x) - measured_ratio)**2
+
+        xs = np.linspace(lo, hi, n_scan)
+        costs = np.array([cost(x) for x in xs])
+        best = int(np.argmin(costs))
+
+        result = minimize_scalar(cost, bounds=(xs[max(best-1, 0)], xs[min(best+1, n_scan-1)]),\
+            method='bounded', options={'xatol': xtol})
+
+        if result.fun <= costs[best]:
+            value = result.x
+        else:
+            value = xs[best]
+
+        model_ratio = forward(value)
+
+        retrieval = collections.namedtuple("retrieval", "value, model_ratio, residual, n_evaluations")
+
+        return retrieval(value, model_ratio, model_ratio - measured_ratio, n_scan + result.nfev + 1)
+
+
+    def retrieve_field_measurements(csv_path, params, WL, parameter='water_depth', sensor_height=5, **kwargs):
+
+        """
+        Retrieves water depth (or effective depth) for every hole in a field measurement csv with
+        columns HoleDepth(mm), HoleWidth(mm) and Ratio. As in ValidationTests.py, dimensions are
+        converted to cm and the sensor height (cm) is subtracted from the hole depth. Extra keyword
+        arguments are passed to retrieve.
+
+        Returns a pandas DataFrame with one row per hole.
+
+        """
+
+        import pandas as pd
+
+        FieldDF = pd.read_csv(csv_path)
+        depths = FieldDF['HoleDepth(mm)']/10 - sensor_height
+        widths = FieldDF['HoleWidth(mm)']/10
+
+        model = RetrievalFuncs.forward_model(params, WL)
+        rows = []
+
+        for hole_d, hole_w, measured in zip(depths, widths, FieldDF['Ratio']):
+
+            result = RetrievalFuncs.retrieve(measured, hole_d, hole_w, model, parameter, **kwargs)
+
+            rows.append({'hole_d': hole_d, 'hole_w': hole_w, 'measured_ratio': measured, parameter: result.value,\
+                'model_ratio': result.model_ratio, 'residual': result.residual, 'n_evaluations': result.n_evaluations})
+
+        return pd.DataFrame(rows)
@@ -0,0 +1,91 @@
+"""
+Class RunningMean reduces a stream of spectra (e.g. one per point on a hole floor) to their mean and
+sum as they are produced, instead of collecting every spectrum and reducing the stack at the end.
+Only the running mean and total weight are kept, so memory does not grow with the number of points
+(one array of wavelengths rather than points x wavelengths). Optionally every spectrum is kept as
+well, for plots of the variation across the floor.
+
+The mean is updated with Welford's method, mean += w/W*(x - mean), which does not form a large
+running sum and so keeps full precision for long streams or spectra spanning many orders of
+magnitude.
+
+Functions in this class include:
+
+1) add
+    Adds one spectrum (optionally weighted) to the running mean
+
+2) sum
+    Returns the weighted sum of the spectra added so far
+
+3) stack
+    Returns every spectrum added (points x wavelengths), if they were kept
+
+"""
+
+
+class RunningMean:
+
+    def __init__(self, keep=False):
+
+        """
+        keep: also keep every spectrum added (see stack)
+
+        """
+
+        self.n = 0
+        self.weight = 0.0
+        self.mean = None
+        self.points = [] if keep else None
+
+        return
+
+
+    def add(self, x, weight=1):
+
+        """
+        Adds spectrum x with weight (default 1) to the running mean. Zero weights are ignored.
+
+        """
+
+        import numpy as np
+
+        if weight == 0:
+            return
+
+        x = np.asarray(x, dtype=float)
+
+        self.n += 1
+        self.weight += weight
+
+        if self.mean is None:
+            self.mean = np.array(x, dtype=float)
+        else:
+            self.mean += (x - self.mean)*(weight/self.weight)
+
+        if self.points is not None:
+            self.points.append(np.array(x))
+
+        return
+
+
+    def sum(self):
+
+        """
+        Returns the weighted sum of the spectra added so far (mean * total weight)
+
+        """
+
+        return self.mean*self.weight
+
+
+    def stack(self):
+
+        """
+        Returns an array (points x wavelengths) of every spectrum added, or None if the spectra
+        were not kept
+
+        """
+
+        import numpy as np
+
+        return None if self.points is None else np.array(self.points)
@@ -1,3 +1,10 @@
+# names of the ice refractive index datasets for each value of rf_ice
+REFIDX_NAMES = {0: 'Wrn84', 1: 'Wrn08', 2: 'Pic16'}
+
+# radiative transfer solvers (see select_solver)
+SOLVERS = ('toon', 'adding_doubling')
+
+
 def snicar_feeder(dir_base, rf_ice, incoming_i, DIRECT, layer_type,\
     APRX_TYP, DELTA, solzen, TOON, ADD_DOUBLE, R_sfc, dz, rho_layers, grain_rds,\
     side_length, depth, rwater, nbr_lyr, nbr_aer, grain_shp, shp_fctr, grain_ar,\
@@ -12,7 +19,8 @@ def snicar_feeder(dir_base, rf_ice, incoming_i, DIRECT, layer_type,\
     FILE_ash1, FILE_ash2, FILE_ash3, FILE_ash4, FILE_ash5, FILE_ash_st_helens, FILE_Skiles_dust1, FILE_Skiles_dust2,\
     FILE_Skiles_dust3, FILE_Skiles_dust4, FILE_Skiles_dust5, FILE_GreenlandCentral1,\
     FILE_GreenlandCentral2, FILE_GreenlandCentral3, FILE_GreenlandCentral4, FILE_GreenlandCentral5,\
-    FILE_Cook_Greenland_dust_L, FILE_Cook_Greenland_dust_C, FILE_Cook_Greenland_dust_H, FILE_snw_alg, FILE_glacier_algae):
+    FILE_Cook_Greenland_dust_L, FILE_Cook_Greenland_dust_C, FILE_Cook_Greenland_dust_H, FILE_snw_alg, FILE_glacier_algae,\
+    TRANSFER=False, PREFETCH=False, WORKSPACE=None, OUTPUTS=None, DZ_SWEEP=None):
 
 
     """
@@ -29,26 +37,61 @@ def snicar_feeder(dir_base, rf_ice, incoming_i, DIRECT, layer_type,\
     using the method of He et al. (2016).
 
     The script calls out to one of two radiative transfer solver scripts: adding_doubling_solver.py
-    or two_stream_solver.py.
+    or two_stream_solver.py. If TOON and ADD_DOUBLE are both None the faster solver that is valid
+    for the column is used (see select_solver). Setting TOON alone for a column with solid ice
+    layers raises a ValueError, as the Toon solver has no Fresnel layers.
+
+    If TRANSFER is True the solver returns unit-illumination transfer functions instead of fluxes
+    for the incoming irradiance, and this function returns wvl and the transfer named tuple.
+
+    The irradiance, ice, bubbly ice and impurity files are independent of each other and are read
+    concurrently (see IOFuncs) before any calculation starts. If PREFETCH is True the reads are only
+    started in the background, for a later run with the same files, and this function returns None.
+
+    Intermediate arrays are held in WORKSPACE (a SolverWorkspace, by default the one of the current
+    thread), which is also passed to the solver.
+
+    OUTPUTS can name the outputs that are needed (albedo, BBA, BBAVIS, BBANIR, abs_slr, heat_rt,
+    F_btm_net, F_top_pls); the solver skips the others and they are returned as None. By default
+    every output is calculated.
+
+    DZ_SWEEP can be a list of layer thicknesses (each with one value per layer, in place of dz) to
+    solve the same column for every set of thicknesses, e.g. the ice around holes of different
+    depths. The files are read once and the columns are solved together, side by side along the
+    wavelength axis of one solver call, with the same result as solving them one by one. albedo,
+    F_btm_net and F_top_pls then gain a leading axis of one row per set of thicknesses and BBA has
+    one value per set; the other outputs are not calculated (None) and TRANSFER is not supported.
 
     """
 
 
     import numpy as np
-    import xarray as xr
     import matplotlib.pyplot as plt
     from Toon_RT_solver import toon_solver
     from adding_doubling_solver import adding_doubling_solver
-    import random
-    import os
-    
-    # working directories 
-    dir_mie_ice_files = str(dir_base + 'Data/Mie_files/480band/') # directory with folders ice_Pic16, ice_Wrn08 and ice_Wrn84 with optical properties calculated with Mie theory
-    dir_go_ice_files = str(dir_base + 'Data/GO_files/480band/') # idem for ice OPs calculated with Geometric optics
-    dir_mie_lap_files = str(dir_base + 'Data/Mie_files/480band/lap/') # directory with folders ice_Pic16, ice_Wrn08 and ice_Wrn84 with optical properties calculated with Mie theory
-    dir_bubbly_ice = str(dir_base + 'Data/bubbly_ice_files/')
-    dir_fsds = str(dir_base + 'Data/Mie_files/480band/fsds/')
-    dir_RI_ice = str(dir_base + 'Data/') 
+    from SpectralGrid import SpectralGrid
+    from IOFuncs import IOFuncs
+    from SolverWorkspace import SolverWorkspace
+
+    work = SolverWorkspace.local() if WORKSPACE is None else WORKSPACE
+
+    if TOON is None and ADD_DOUBLE is None:
+        TOON = select_solver(layer_type) == 'toon'
+        ADD_DOUBLE = not TOON
+
+    elif TOON and not ADD_DOUBLE and select_solver(layer_type) != 'toon':
+        raise ValueError("ERROR: THE TOON SOLVER CANNOT INCLUDE SOLID ICE LAYERS (layer_type 1), USE ADD_DOUBLE")
+
+    if DZ_SWEEP is not None:
+
+        if TRANSFER:
+            raise ValueError("ERROR: DZ_SWEEP CANNOT BE COMBINED WITH TRANSFER")
+
+        if any(len(dz_k) != nbr_lyr for dz_k in DZ_SWEEP):
+            raise ValueError("ERROR: EVERY SET OF THICKNESSES IN DZ_SWEEP NEEDS ONE VALUE PER LAYER")
+
+        if OUTPUTS is not None and not set(OUTPUTS) <= {'albedo', 'BBA', 'F_btm_net', 'F_top_pls'}:
+            raise ValueError("ERROR: DZ_SWEEP ONLY PROVIDES albedo, BBA, F_btm_net AND F_top_pls")
     
     # load impurity files and mass concentrations
     files = [FILE_soot1,\
@@ -67,305 +110,56 @@ def snicar_feeder(dir_base, rf_ice, incoming_i, DIRECT, layer_type,\
     mss_cnc_GreenlandCentral5, mss_cnc_Cook_Greenland_dust_L, mss_cnc_Cook_Greenland_dust_C,\
     mss_cnc_Cook_Greenland_dust_H, mss_cnc_snw_alg, mss_cnc_glacier_algae]
 
-    # retrieve wavelength from random choice of netcdf file
-    temp = xr.open_dataset(str(dir_mie_lap_files+random.choice(os.listdir(dir_mie_lap_files))))
-    wvl = np.array(temp['wvl'].values)
-    wvl = wvl*1e6
-    nbr_wvl = len(wvl)
+    # SNICAR wavelength grid (um), shared with the rest of the model
+    grid = SpectralGrid.default()
+    wvl = np.array(grid.snicar_wvl)
+    nbr_wvl = grid.n_snicar
 
     # set reflectance of underlying surface
     R_sfc = [R_sfc for _ in range(nbr_wvl)]
     R_sfc = np.array(R_sfc)
 
+    # calc cosine of solar zenith (radians). solzen can be a single angle or a list of angles, in
+    # which case all angles are solved together and every output gains a leading angle axis
+    multi_angle = np.ndim(solzen) > 0
+    solzens = list(np.atleast_1d(solzen))
+    mu_not = np.round((np.cos(np.array(solzens) * (np.pi / 180))),2) # convert radians if required
+
+    # read every input file concurrently
+    requests = snicar_files(dir_base, rf_ice, incoming_i, DIRECT, layer_type, solzens, grain_rds, grain_shp,\
+        side_length, depth, files, FILE_soot2, FILE_brwnC2, verbose=not PREFETCH)
+
+    if PREFETCH:
+        IOFuncs.prefetch(requests)
+        return None
+
+    data = IOFuncs.read_many(requests)
+
     # load incoming irradiance
-    # calc cosine of solar zenith (radians)
-    mu_not = np.round((np.cos(solzen * (np.pi / 180))),2) # convert radians if required
-    
-    print("\ncosine of solar zenith = ", mu_not)
-    
-    flx_slr = []
+    print("\ncosine of solar zenith = ", mu_not if multi_angle else mu_not[0])
     
     if DIRECT:
-        
-        
-        coszen = str('SZA'+str(solzen).rjust(2,'0'))
-
-        if incoming_i == 0:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mlw_clr_"+coszen+".nc")) 
-            print("atmospheric profile = mid-lat winter")
-        elif incoming_i == 1:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mls_clr_"+coszen+".nc"))
-            print("atmospheric profile = mid-lat summer")
-        elif incoming_i == 2:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_saw_clr_"+coszen+".nc"))
-            print("atmospheric profile = sub-Arctic winter")
-        elif incoming_i == 3:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_sas_clr_"+coszen+".nc"))
-            print("atmospheric profile = sub-Arctic summer")
-        elif incoming_i == 4:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_smm_clr_"+coszen+".nc"))
-            print("atmospheric profile = Summit Station")
-        elif incoming_i == 5:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_hmn_clr_"+coszen+".nc"))
-            print("atmospheric profile = High Mountain")  
-        elif incoming_i == 6:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_toa_clr.nc"))
-            print("atmospheric profile = top-of-atmosphere")
 
-        else:
-            raise ValueError ("Invalid choice of atmospheric profile")
-        
-        flx_slr = Incoming_file['flx_dwn_sfc'].values #flx_dwn_sfc is the spectral irradiance in W m-2 and is pre-calculated (flx_frc_sfc*flx_bb_sfc in original code)
+        flx_slr = np.array([data[('flx', k)]['flx_dwn_sfc'] for k in range(len(solzens))]) #flx_dwn_sfc is the spectral irradiance in W m-2 and is pre-calculated (flx_frc_sfc*flx_bb_sfc in original code)
         flx_slr[flx_slr<=0]=1e-30
-        Fs = flx_slr / (mu_not * np.pi)
-        Fd = np.zeros(nbr_wvl)
+        Fs = flx_slr / (mu_not[:,None] * np.pi)
+        Fd = np.zeros([len(solzens), nbr_wvl])
 
     else:
 
-        if incoming_i == 0:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mlw_cld.nc"))
-        elif incoming_i == 1:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mls_cld.nc"))
-        elif incoming_i == 2:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_saw_cld.nc"))
-        elif incoming_i == 3:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_sas_cld.nc"))
-        elif incoming_i == 4:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_smm_cld.nc"))
-        elif incoming_i == 5:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_hmn_cld.nc"))   
-        elif incoming_i == 6:
-            Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_toa_cld.nc"))
-
-        else:
-            raise ValueError ("Invalid choice of atmospheric profile")     
-
-        flx_slr = Incoming_file['flx_dwn_sfc'].values
+        flx_slr = np.array(data['flx']['flx_dwn_sfc'])
         
         flx_slr[flx_slr<=0]=1e-30
 
-        Fd = [flx_slr[i]/mu_not*np.pi for i in range(nbr_wvl)]
-        Fs = np.zeros(nbr_wvl)
-
-
-    ###################################################
-    # Read in ice optical properties
-    ###################################################
-
-    # set up empty arrays
-    SSA_snw = np.empty([nbr_lyr, nbr_wvl])
-    MAC_snw = np.empty([nbr_lyr, nbr_wvl])
-    g_snw = np.empty([nbr_lyr, nbr_wvl])
-    abs_cff_mss_ice = np.empty([nbr_wvl])
-
-    for i in np.arange(0,nbr_lyr,1):
-
-        if layer_type[i] == 0: # (granular layer)
-
-            if grain_rds[i] == 0:
-
-                raise ValueError("ERROR: ICE GRAIN RADIUS SET TO ZERO")
-
-            else:
-                
-                if grain_shp[i] == 4: # if large hexaginal prisms (geometric optics calcs)
-                    print("Using hexagonal column with side length = {}, length = {}".format(str(side_length[i]).rjust(4,'0'),str(depth[i])))
-                  
-                    if rf_ice ==0:
-                        dir_OP = str(dir_go_ice_files+'ice_Wrn84/ice_Wrn84_')
-                        print("Using Warren 84 refractive index")
-                    elif rf_ice == 1:
-                        dir_OP = str(dir_go_ice_files+'ice_Wrn08/ice_Wrn08_')
-                        print("Using Warren 08 refractive index")
-                    elif rf_ice == 2:
-                        dir_OP = str(dir_go_ice_files+'ice_Pic16/ice_Pic16_')
-                        print("Using Picard 16 refractive index")           
-
-                    FILE_ice = str(dir_OP + '{}_{}.nc'.format(str(side_length[i]).rjust(4,'0'), str(depth[i])))
-                    print("\nLayer: {}".format(i))
-
-                elif grain_shp[i] < 4:
-
-                    if rf_ice == 0:
-                        dir_OP = 'ice_Wrn84/ice_Wrn84'
-                        print("Using Warren 84 refractive index")
-                    elif rf_ice == 1:
-                        dir_OP = 'ice_Wrn08/ice_Wrn08'
-                        print("Using Warren 08 refractive index")
-                    elif rf_ice == 2:
-                        dir_OP = 'ice_Pic16/ice_Pic16'
-                        print("Using Picard 16 refractive index")
-
-                    FILE_ice = str(dir_mie_ice_files + dir_OP + '_{}.nc'.format(str(grain_rds[i]).rjust(4,'0')))
-                    print("\nLayer: {}".format(i))
-                    print("Using Mie mode: spheres with radius = {}".format(str(grain_rds[i]).rjust(4,'0')))
-
-            # read in single scattering albedo, MAC and g for ice crystals in each layer,
-
-            with xr.open_dataset(FILE_ice) as temp:
-                
-                SSA = temp['ss_alb'].values
-                SSA_snw[i,:] = SSA
+        # diffuse flux is the same for every angle, but is scaled by 1/mu_not as in the single angle case
+        flx_slr = np.tile(flx_slr, (len(solzens), 1))
+        Fd = flx_slr/mu_not[:,None]*np.pi
+        Fs = np.zeros([len(solzens), nbr_wvl])
 
-                ext_cff_mss = temp['ext_cff_mss'].values
-                MAC_snw[i,:] = ext_cff_mss
+    if not multi_angle:
+        mu_not, flx_slr, Fs, Fd = mu_not[0], flx_slr[0], Fs[0], Fd[0]
 
-                asm_prm = temp['asm_prm'].values
-                g_snw[i,:] = asm_prm
-    
-
-            ###############################################################
-            ## NEW GRAIN SHAPE ROUTINE
-            ################################################################
-
-            # Constants for aspherical ice particles
-            # g_snw asymmetry factor parameterization coefficients (6 bands) from
-            # Table 3 & Eqs. 6-7 in He et al. (2017)
-            # assume same values for 4-5 um band, which leads to very small biases (<3%)
-            
-            g_wvl = np.array([0.25,0.70,1.41,1.90,2.50,3.50,4.00,5.00]) # wavelength (um) division point
-            g_wvl_center = np.array(g_wvl[1:8])/2 + np.array(g_wvl[0:7])/2  # center point for wavelength band
-            g_b0 = np.array([9.76029E-01,9.67798E-01,1.00111E+00,1.00224E+00,9.64295E-01,9.97475E-01,9.97475E-01])
-            g_b1 = np.array([5.21042E-01,4.96181E-01,1.83711E-01,1.37082E-01,5.50598E-02,8.48743E-02,8.48743E-02])
-            g_b2 = np.array([-2.66792E-04,1.14088E-03,2.37011E-04,-2.35905E-04,8.40449E-04,-4.71484E-04,-4.71484E-04])
-            
-            # Tables 1 & 2 and Eqs. 3.1-3.4 from Fu, 2007
-            g_F07_c2 = np.array([1.349959e-1,1.115697e-1,9.853958e-2,5.557793e-2,-1.233493e-1,0.0,0.0])
-            g_F07_c1 = np.array([-3.987320e-1,-3.723287e-1,-3.924784e-1,-3.259404e-1,4.429054e-2,-1.726586e-1,-1.726586e-1])
-            g_F07_c0 = np.array([7.938904e-1,8.030084e-1,8.513932e-1,8.692241e-1,7.085850e-1,6.412701e-1,6.412701e-1])
-            g_F07_p2 = np.array([3.165543e-3,2.014810e-3,1.780838e-3,6.987734e-4,-1.882932e-2,-2.277872e-2,-2.277872e-2])
-            g_F07_p1 = np.array([1.140557e-1,1.143152e-1,1.143814e-1,1.071238e-1,1.353873e-1,1.914431e-1,1.914431e-1])
-            g_F07_p0 = np.array([5.292852e-1,5.425909e-1,5.601598e-1,6.023407e-1,6.473899e-1,4.634944e-1,4.634944e-1])
-            fs_hex = 0.788 # shape factor for hexagonal plate (reference)
-            
-
-            for i in np.arange(0,nbr_lyr,1):
-                
-                if layer_type[i] == 0:
-                    
-                    if grain_shp[i] == 0: # snow
-
-                        pass # if layer type is for spheres, no changes required
-
-                    
-                    elif grain_shp[i] == 1: # 1 = spheroid, He et al. (2017) parameterization
-                        
-                        diam_ice = 2.0 * grain_rds[i] # effective snow grain diameter
-                        
-                        if shp_fctr[i] == 0:
-
-                            fs_sphd = 0.929 # default shape factor for spheroid; He et al. (2017), Table 1
-                        
-                        else:
-                            
-                            fs_sphd = shp_fctr[i] # if shp_factor not 0, then use user-defined value
-                        
-                        
-                        if grain_ar[i] == 0:
-
-                            AR_tmp = 0.5 # default aspect ratio for spheroid; He et al. (2017), Table 1
-                        
-                        else:
-
-                            AR_tmp = grain_ar[i]
-                        
-                        g_snw_Cg_tmp = g_b0 * (fs_sphd/fs_hex)**g_b1 * diam_ice**g_b2 # Eq.7, He et al. (2017)
-                        gg_snw_F07_tmp = g_F07_c0 + g_F07_c1 * AR_tmp + g_F07_c2 * AR_tmp**2 # Eqn. 3.1 in Fu (2007)
-
-
-                    elif grain_shp[i] == 2: # 3=hexagonal plate, He et al. 2017 parameterization
-
-                        diam_ice = 2.0 * grain_rds[i] # effective snow grain diameter
-                        
-                        if shp_fctr[i] == 0:
-                            
-                            fs_hex0 = 0.788 # default shape factor for hexagonal plates; He et al. (2017), Table 1
-                        
-                        else:
-
-                            fs_hex0 = shp_fctr[i]
-                        
-
-                        if grain_ar[i] == 0:
-
-                            AR_tmp = 2.5 # default aspect ratio for hexagonal plate; He et al. (2017), Table 1
-                        
-                        else:
-                        
-                            AR_tmp = grain_ar[i]
-                                
-                        g_snw_Cg_tmp = g_b0 * (fs_hex0/fs_hex)**g_b1 * diam_ice**g_b2 # Eq.7, He et al. (2017)
-                        gg_snw_F07_tmp = g_F07_p0 + g_F07_p1 * np.log(AR_tmp) + g_F07_p2 * (np.log(AR_tmp))**2   # Eqn. 3.3 in Fu (2007)
-                        
-
-                    elif grain_shp[i] == 3: # 4=koch snowflake, He et al. (2017) parameterization
-
-                        diam_ice = 2.0 * grain_rds[i] / 0.544 # effective snow grain diameter
-                        
-                        if shp_fctr[i] == 0:
-                        
-                            fs_koch = 0.712 # default shape factor for koch snowflake; He et al. (2017), Table 1
-                        
-                        else:
-                            
-                            fs_koch = shp_fctr[i]
-                        
-
-                        if grain_ar[i] == 0:
-
-                            AR_tmp = 2.5 # default aspect ratio for koch snowflake; He et al. (2017), Table 1
-                        
-                        else:
-
-                            AR_tmp = grain_ar[i]
-                        
-                        g_snw_Cg_tmp = g_b0 * (fs_koch/fs_hex)**g_b1 * diam_ice**g_b2 # Eq.7, He et al. (2017)
-                        gg_snw_F07_tmp = g_F07_p0 + g_F07_p1 * np.log(AR_tmp) + g_F07_p2 * (np.log(AR_tmp))**2  # Eqn. 3.3 in Fu (2007)
-                        
-                    
-                    if (grain_shp[i] > 0)& (grain_shp[i] < 4):
-
-                        from scipy.interpolate import pchip
-                        # 6 wavelength bands for g_snw to be interpolated into 480-bands of SNICAR
-                        # shape-preserving piecewise interpolation into 480-bands
-                        g_Cg_intp = pchip(g_wvl_center,g_snw_Cg_tmp)(wvl)
-                        gg_F07_intp = pchip(g_wvl_center,gg_snw_F07_tmp)(wvl)
-                        g_snw_F07 = gg_F07_intp + (1.0 - gg_F07_intp) / SSA_snw[i,:] / 2 # Eq.2.2 in Fu (2007)
-                        g_snw[i,:] = g_snw_F07 * g_Cg_intp # Eq.6, He et al. (2017)
-                        g_snw[i,371:470] = g_snw[i,370] # assume same values for 4-5 um band, with very small biases (<3%)
-                    
-                    g_snw[g_snw < 0] = 0.01
-                    g_snw[g_snw > 0.99] = 0.99 # avoid unreasonable values (so far only occur in large-size spheroid cases)
-
-
-        else: # else correspondng to if layer_type == 1
-            
-            rd = "{}".format(grain_rds[i])
-            rd = rd.rjust(4,"0")
-            refidx_file = xr.open_dataset(dir_RI_ice+'rfidx_ice.nc')
-           
-            if rf_ice == 0:
-                refidx_re = refidx_file['re_Wrn84'].values
-                refidx_im = refidx_file['im_Wrn84'].values 
-
-            elif rf_ice == 1:
-                refidx_re = refidx_file['re_Wrn08'].values
-                refidx_im = refidx_file['im_Wrn08'].values 
-
-            elif rf_ice == 2:
-                refidx_re = refidx_file['re_Pic16'].values
-                refidx_im = refidx_file['im_Pic16'].values 
-
-            FILE_ice = str(dir_bubbly_ice + 'bbl_{}.nc').format(rd)
-            file = xr.open_dataset(FILE_ice)
-            sca_cff_vlm = file['sca_cff_vlm'].values # scattering cross section unit per volume of bubble
-            g_snw[i,:] = file['asm_prm'].values
-            abs_cff_mss_ice[:] = ((4 * np.pi * refidx_im) / (wvl * 1e-6))/917
-            vlm_frac_air = (917 - rho_layers[i]) / 917
-            MAC_snw[i,:] = ((sca_cff_vlm * vlm_frac_air) /917) + abs_cff_mss_ice
-            SSA_snw[i,:] = ((sca_cff_vlm * vlm_frac_air) /917) / MAC_snw[i,:]
 
-    
     ###################################################
     # Read in impurity optical properties
     ###################################################
@@ -373,22 +167,19 @@ def snicar_feeder(dir_base, rf_ice, incoming_i, DIRECT, layer_type,\
     # Load optical properties SSA, MAC and g (one row per impurity, one column per wvalengths)
     # Load mass concentrations MSS per layer (one row per layer, one column per umpurity)
 
-    SSAaer = np.zeros([nbr_aer,nbr_wvl])
-    MACaer = np.zeros([nbr_aer, nbr_wvl])
-    Gaer = np.zeros([nbr_aer,nbr_wvl])
-    MSSaer = np.zeros([nbr_lyr, nbr_aer])
+    SSAaer = work.zeros('SSAaer', [nbr_aer,nbr_wvl])
+    MACaer = work.zeros('MACaer', [nbr_aer, nbr_wvl])
+    Gaer = work.zeros('Gaer', [nbr_aer,nbr_wvl])
+    MSSaer = work.zeros('MSSaer', [nbr_lyr, nbr_aer])
     
     for aer in range(nbr_aer):
-        impurity_properties = xr.open_dataset(str(dir_mie_lap_files + files[aer]))
-        Gaer[aer,:] = impurity_properties['asm_prm'].values
-        SSAaer[aer,:] = impurity_properties['ss_alb'].values
+        impurity_properties = data[('aer', aer)]
+        Gaer[aer,:] = impurity_properties['asm_prm']
+        SSAaer[aer,:] = impurity_properties['ss_alb']
         MSSaer[0:nbr_lyr,aer] = mass_concentrations[aer]
-        if files[aer] == FILE_brwnC2 or files[aer] == FILE_soot2: #coated particles: use ext_cff_mss_ncl 
-            MACaer[aer,:] = impurity_properties['ext_cff_mss_ncl'].values
-        else:
-            MACaer[aer,:] = impurity_properties['ext_cff_mss'].values
+        MACaer[aer,:] = impurity_properties['ext_cff_mss_ncl' if files[aer] in (FILE_brwnC2, FILE_soot2) else 'ext_cff_mss'] #coated particles: use ext_cff_mss_ncl 
         
-    MSSaer = MSSaer*1e-9 # mass concentrations converted to kg/kg unit
+    MSSaer *= 1e-9 # mass concentrations converted to kg/kg unit
 
 
     #####################################
@@ -405,69 +196,378 @@ def snicar_feeder(dir_base, rf_ice, incoming_i, DIRECT, layer_type,\
     
     """
 
-    # initialize arrays
-    g_sum = np.zeros([nbr_lyr, nbr_wvl])
-    SSA_sum = np.zeros([nbr_lyr, nbr_aer, nbr_wvl])
-    tau = np.zeros([nbr_lyr, nbr_wvl])
-    SSA = np.zeros([nbr_lyr, nbr_wvl])
-    g = np.zeros([nbr_lyr, nbr_wvl])
-    L_aer = np.zeros([nbr_lyr, nbr_aer, nbr_wvl])
-    tau_aer = np.zeros([nbr_lyr, nbr_aer, nbr_wvl])
-    tau_sum = np.zeros([nbr_lyr, nbr_wvl])
-    SSA_sum = np.zeros([nbr_lyr, nbr_wvl])
-    L_snw = np.zeros(nbr_lyr)
-    tau_snw = np.zeros([nbr_lyr,nbr_wvl])
-
-
-    # for each layer, the layer mass (L) is density * layer thickness
-    # for each layer the optical depth is the layer mass * the mass extinction coefficient
-    # first for the ice in each layer
-    
-    for i in range(nbr_lyr):
-
-        L_snw[i] = rho_layers[i] * dz[i]
-        tau_snw[i, :] = L_snw[i] * MAC_snw[i, :]
-
-    # then for the LAPs in each layer
-    for i in range(nbr_lyr):
-        for j in range(nbr_aer):
-
-            L_aer[i, j, :] = L_snw[i] * MSSaer[i, j]
-            tau_aer[i, j, :] = L_aer[i, j, :] * MACaer[j, :]
-
-            tau_sum = tau_sum + tau_aer[i, j, :]
-            SSA_sum = SSA_sum + (tau_aer[i, j, :] * SSAaer[j, :])
-            g_sum = g_sum + (tau_aer[i, j, :] * SSAaer[j, :] * Gaer[j, :])
-
-
-    # finally, for each layer calculate the effective SSA, tau and g for the snow+LAP
-    for i in range(nbr_lyr):
-        
-        tau[i,:] = tau_sum[i,:] + tau_snw[i,:]
-        SSA[i,:] = (1 / tau[i,:]) * (SSA_sum[i,:] + SSA_snw[i,:] * tau_snw[i,:])
-        g[i, :] = (1 / (tau[i, :] * (SSA[i, :]))) * (g_sum[i,:] + (g_snw[i, :] * SSA_snw[i, :] * tau_snw[i, :]))
+    if DZ_SWEEP is not None:
+        return solve_sweep(dir_base, rf_ice, data, layer_type, grain_shp, grain_rds, shp_fctr, grain_ar, rho_layers,\
+            DZ_SWEEP, wvl, MSSaer, MACaer, SSAaer, Gaer, APRX_TYP, DELTA, TOON, mu_not, nbr_lyr, nbr_wvl, R_sfc,\
+            Fs, Fd, flx_slr, DIRECT, work, OUTPUTS)
 
-    # just in case any unrealistic values arise (none detected so far)
-    SSA[SSA<=0]=0.00000001
-    SSA[SSA>=1]=0.99999999
-    g[g<=0]=0.00001
-    g[g>=1]=0.99999
+    tau, SSA, g, L_snw = build_column(dir_base, rf_ice, data, layer_type, grain_shp, grain_rds, shp_fctr, grain_ar,\
+        rho_layers, dz, wvl, MSSaer, MACaer, SSAaer, Gaer)
 
     # CALL RT SOLVER (TOON  = TOON ET AL, TRIDIAGONAL MATRIX METHOD; 
     # ADD_DOUBLE = ADDING-DOUBLING METHOD)
    
+    if TRANSFER:
+
+        if ADD_DOUBLE:
+            return adding_doubling_solver(rf_ice, APRX_TYP, DELTA, layer_type, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, wvl, Fs, Fd,\
+                L_snw, flx_slr, DIRECT, dir_base, transfer=True, workspace=work)
+
+        return toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, wvl, Fs, Fd,\
+            L_snw, flx_slr, transfer=True, workspace=work)
+
     if TOON: 
 
         wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, abs_vis_tot, heat_rt, F_btm_net, F_top_pls = \
             toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, wvl, Fs, Fd,\
-            L_snw, flx_slr)
+            L_snw, flx_slr, workspace=work, outputs=OUTPUTS)
 
 
     if ADD_DOUBLE:
 
         wvl, flx_dwn_spc, albedo, BBA, BBAVIS, BBANIR, abs_slr, heat_rt, F_btm_net, F_top_pls = \
             adding_doubling_solver(rf_ice, APRX_TYP, DELTA, layer_type, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, wvl, Fs, Fd,\
-            L_snw, flx_slr, DIRECT, dir_base)
+            L_snw, flx_slr, DIRECT, dir_base, workspace=work, outputs=OUTPUTS)
+
+
+    return wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, heat_rt, F_btm_net, F_top_pls
+
+
+def solve_sweep(dir_base, rf_ice, data, layer_type, grain_shp, grain_rds, shp_fctr, grain_ar, rho_layers, DZ_SWEEP,\
+    wvl, MSSaer, MACaer, SSAaer, Gaer, APRX_TYP, DELTA, TOON, mu_not, nbr_lyr, nbr_wvl, R_sfc, Fs, Fd, flx_slr, DIRECT,\
+    work, OUTPUTS):
+
+    """
+    Solves the column of snicar_feeder for every set of layer thicknesses in DZ_SWEEP (see
+    snicar_feeder) and returns its outputs, with one row of albedo, F_btm_net and F_top_pls and
+    one value of BBA per set.
+
+    The optical properties of each column are built as for a single column, then the columns are
+    placed one after another along the wavelength axis (tau, SSA and g of shape [nbr_lyr,
+    n_columns*nbr_wvl], the irradiance and surface reflectance repeated for each column) and solved
+    in one solver call. The solvers treat every wavelength independently, so each column's result is
+    the same as from its own solve, while the per-call costs (reading the data, setting up the
+    solver and its loops over layers and angles) are paid once for the whole sweep.
+
+    """
+
+    import numpy as np
+    from Toon_RT_solver import toon_solver
+    from adding_doubling_solver import adding_doubling_solver
+
+    nbr_col = len(DZ_SWEEP)
+    columns = [build_column(dir_base, rf_ice, data, layer_type, grain_shp, grain_rds, shp_fctr, grain_ar,\
+        rho_layers, dz_k, wvl, MSSaer, MACaer, SSAaer, Gaer) for dz_k in DZ_SWEEP]
+
+    tau, SSA, g = (np.concatenate([column[i] for column in columns], axis=1) for i in range(3))
+    L_snw = columns[0][3] # layer mass, only used for the heating rates
+    R_sfc, wvl_sweep, Fs, Fd, flx_sweep = (np.tile(x, nbr_col) for x in (R_sfc, wvl, Fs, Fd, flx_slr))
+    solved = ('albedo', 'F_btm_net', 'F_top_pls')
+
+    if TOON:
+        _, albedo, _, _, _, _, _, _, F_btm_net, F_top_pls = toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr,\
+            nbr_col*nbr_wvl, R_sfc, wvl_sweep, Fs, Fd, L_snw, flx_sweep, workspace=work, outputs=solved)
+
+    else:
+        _, _, albedo, _, _, _, _, _, F_btm_net, F_top_pls = adding_doubling_solver(rf_ice, APRX_TYP, DELTA, layer_type,\
+            tau, g, SSA, mu_not, nbr_lyr, nbr_col*nbr_wvl, R_sfc, wvl_sweep, Fs, Fd, L_snw, flx_sweep, DIRECT, dir_base,\
+            workspace=work, outputs=solved, columns=nbr_col)
+
+    # split the wavelength axis into [column, wavelength] and move the columns to the front
+    shape = np.shape(albedo)[:-1] + (nbr_col, nbr_wvl)
+    albedo, F_btm_net, F_top_pls = (np.ascontiguousarray(np.moveaxis(np.reshape(x, shape), -2, 0))\
+        for x in (albedo, F_btm_net, F_top_pls))
+
+    BBA = None
+
+    if OUTPUTS is None or 'BBA' in OUTPUTS:
+        BBA = np.sum(flx_slr * albedo,axis=-1) / np.sum(flx_slr,axis=-1)
+
+    return wvl, albedo, BBA, None, None, None, None, F_btm_net, F_top_pls
+
+
+def select_solver(layer_type):
+
+    """
+    Returns the radiative transfer solver for a column with layer_type: 'toon' (Toon et al. 1989),
+    which is faster (see BenchmarkFuncs.compare_solvers), if every layer is granular (layer_type 0), otherwise
+    'adding_doubling', which is needed for the Fresnel reflection and refraction at solid ice layers
+    (layer_type 1). Both solvers provide every output of snicar_feeder, including the transfer
+    functions, so the outputs requested do not restrict the choice.
 
+    """
+
+    return 'adding_doubling' if any(int(t) != 0 for t in layer_type) else 'toon'
+
+
+def snicar_files(dir_base, rf_ice, incoming_i, DIRECT, layer_type, solzens, grain_rds, grain_shp, side_length, depth,\
+    files, FILE_soot2, FILE_brwnC2, verbose=True):
+
+    """
+    Returns the files and variables read by snicar_feeder as a dictionary of key -> (path, variable
+    names) for IOFuncs. Keys are ('flx', k) for the direct irradiance at the k-th solar zenith angle
+    (or 'flx' for diffuse irradiance), ('ice', i) for hexagonal prisms (geometric optics) in layer i,
+    'refidx' for the ice refractive index and ('aer', j) for the j-th impurity in files. Spherical
+    grains and bubbly ice come from the interpolated tables in OpticsTables, which accept any radius.
+
+    """
+
+    # working directories 
+    dir_go_ice_files = str(dir_base + 'Data/GO_files/480band/') # idem for ice OPs calculated with Geometric optics
+    dir_mie_lap_files = str(dir_base + 'Data/Mie_files/480band/lap/') # directory with folders ice_Pic16, ice_Wrn08 and ice_Wrn84 with optical properties calculated with Mie theory
+    dir_fsds = str(dir_base + 'Data/Mie_files/480band/fsds/')
+    dir_RI_ice = str(dir_base + 'Data/') 
+
+    log = print if verbose else (lambda *args: None)
+    refidx_labels = {0: 'Warren 84', 1: 'Warren 08', 2: 'Picard 16'}
+
+    requests = {}
+
+    # incoming irradiance
+    profiles = {0: ("mlw", "mid-lat winter"), 1: ("mls", "mid-lat summer"), 2: ("saw", "sub-Arctic winter"),\
+        3: ("sas", "sub-Arctic summer"), 4: ("smm", "Summit Station"), 5: ("hmn", "High Mountain"), 6: ("toa", "top-of-atmosphere")}
+
+    if incoming_i not in profiles:
+        raise ValueError ("Invalid choice of atmospheric profile")
+
+    if DIRECT:
+
+        log("atmospheric profile = {}".format(profiles[incoming_i][1]))
+
+        for k, zen in enumerate(solzens):
+
+            coszen = str('SZA'+str(zen).rjust(2,'0'))
+
+            if incoming_i == 6:
+                requests[('flx', k)] = (str(dir_fsds + "swnb_480bnd_toa_clr.nc"), ['flx_dwn_sfc'])
+            else:
+                requests[('flx', k)] = (str(dir_fsds + "swnb_480bnd_"+profiles[incoming_i][0]+"_clr_"+coszen+".nc"), ['flx_dwn_sfc'])
+
+    else:
+
+        requests['flx'] = (str(dir_fsds + "swnb_480bnd_"+profiles[incoming_i][0]+"_cld.nc"), ['flx_dwn_sfc'])
+
+    # ice optical properties
+    for i in range(len(layer_type)):
+
+        if layer_type[i] == 0: # (granular layer)
+
+            if grain_rds[i] == 0:
+
+                raise ValueError("ERROR: ICE GRAIN RADIUS SET TO ZERO")
+
+            if grain_shp[i] == 4: # if large hexaginal prisms (geometric optics calcs)
+                log("Using hexagonal column with side length = {}, length = {}".format(str(side_length[i]).rjust(4,'0'),str(depth[i])))
+                log("Using {} refractive index".format(refidx_labels[rf_ice]))
+
+                dir_OP = str(dir_go_ice_files+'ice_{0}/ice_{0}_'.format(REFIDX_NAMES[rf_ice]))
+                FILE_ice = str(dir_OP + '{}_{}.nc'.format(str(side_length[i]).rjust(4,'0'), str(depth[i])))
+                log("\nLayer: {}".format(i))
+
+                requests[('ice', i)] = (FILE_ice, ['ss_alb', 'ext_cff_mss', 'asm_prm'])
+
+            else: # spheres: interpolated from the Mie table by build_column (see OpticsTables)
+
+                log("Using {} refractive index".format(refidx_labels[rf_ice]))
+                log("\nLayer: {}".format(i))
+                log("Using Mie mode: spheres with radius = {}".format(str(grain_rds[i]).rjust(4,'0')))
+
+        else: # bubbly ice: bubble properties are interpolated from the bubbly ice table by build_column
+
+            requests['refidx'] = (dir_RI_ice+'rfidx_ice.nc', ['re_' + REFIDX_NAMES[rf_ice], 'im_' + REFIDX_NAMES[rf_ice]])
+
+    # impurity optical properties
+    for j, FILE in enumerate(files):
+
+        #coated particles: use ext_cff_mss_ncl 
+        MAC_name = 'ext_cff_mss_ncl' if FILE == FILE_brwnC2 or FILE == FILE_soot2 else 'ext_cff_mss'
+        requests[('aer', j)] = (str(dir_mie_lap_files + FILE), ['asm_prm', 'ss_alb', MAC_name])
+
+    return requests
+
+
+# He et al. (2017) and Fu (2007) grain shape corrections already calculated, keyed by grain shape,
+# radius, shape factor and aspect ratio (see shape_correction)
+SHAPE_CORRECTIONS = {}
+
+
+def shape_correction(grain_shp, grain_rds, shp_fctr, grain_ar, wvl):
+
+    """
+    Returns the grain shape corrections for the asymmetry parameter of non-spherical grains
+    (grain_shp 1 = spheroid, 2 = hexagonal plate, 3 = Koch snowflake) on the SNICAR grid wvl: the
+    He et al. (2017) ratio g_Cg (Eq. 7) and the Fu (2007) g of the geometric-optics part gg_F07
+    (Eqs. 3.1 and 3.3), so that g = (gg_F07 + (1 - gg_F07)/SSA/2) * g_Cg. Both are interpolated from
+    6 bands to the SNICAR grid with a shape-preserving (pchip) interpolant. Corrections are kept per
+    process, so layers and runs with the same grains share them.
+
+    """
+
+    import numpy as np
+    from scipy.interpolate import pchip
+
+    key = (int(grain_shp), float(grain_rds), float(shp_fctr), float(grain_ar), len(wvl))
+
+    if key not in SHAPE_CORRECTIONS:
+
+        # Constants for aspherical ice particles
+        # g_snw asymmetry factor parameterization coefficients (6 bands) from
+        # Table 3 & Eqs. 6-7 in He et al. (2017)
+        # assume same values for 4-5 um band, which leads to very small biases (<3%)
+        
+        g_wvl = np.array([0.25,0.70,1.41,1.90,2.50,3.50,4.00,5.00]) # wavelength (um) division point
+        g_wvl_center = np.array(g_wvl[1:8])/2 + np.array(g_wvl[0:7])/2  # center point for wavelength band
+        g_b0 = np.array([9.76029E-01,9.67798E-01,1.00111E+00,1.00224E+00,9.64295E-01,9.97475E-01,9.97475E-01])
+        g_b1 = np.array([5.21042E-01,4.96181E-01,1.83711E-01,1.37082E-01,5.50598E-02,8.48743E-02,8.48743E-02])
+        g_b2 = np.array([-2.66792E-04,1.14088E-03,2.37011E-04,-2.35905E-04,8.40449E-04,-4.71484E-04,-4.71484E-04])
+        
+        # Tables 1 & 2 and Eqs. 3.1-3.4 from Fu, 2007
+        g_F07_c2 = np.array([1.349959e-1,1.115697e-1,9.853958e-2,5.557793e-2,-1.233493e-1,0.0,0.0])
+        g_F07_c1 = np.array([-3.987320e-1,-3.723287e-1,-3.924784e-1,-3.259404e-1,4.429054e-2,-1.726586e-1,-1.726586e-1])
+        g_F07_c0 = np.array([7.938904e-1,8.030084e-1,8.513932e-1,8.692241e-1,7.085850e-1,6.412701e-1,6.412701e-1])
+        g_F07_p2 = np.array([3.165543e-3,2.014810e-3,1.780838e-3,6.987734e-4,-1.882932e-2,-2.277872e-2,-2.277872e-2])
+        g_F07_p1 = np.array([1.140557e-1,1.143152e-1,1.143814e-1,1.071238e-1,1.353873e-1,1.914431e-1,1.914431e-1])
+        g_F07_p0 = np.array([5.292852e-1,5.425909e-1,5.601598e-1,6.023407e-1,6.473899e-1,4.634944e-1,4.634944e-1])
+        fs_hex = 0.788 # shape factor for hexagonal plate (reference)
+
+        # default shape factors and aspect ratios; He et al. (2017), Table 1
+        if grain_shp == 1: # spheroid
+            diam_ice = 2.0 * grain_rds # effective snow grain diameter
+            fs = 0.929 if shp_fctr == 0 else shp_fctr
+            AR_tmp = 0.5 if grain_ar == 0 else grain_ar
+
+        elif grain_shp == 2: # hexagonal plate
+            diam_ice = 2.0 * grain_rds
+            fs = 0.788 if shp_fctr == 0 else shp_fctr
+            AR_tmp = 2.5 if grain_ar == 0 else grain_ar
+
+        elif grain_shp == 3: # koch snowflake
+            diam_ice = 2.0 * grain_rds / 0.544
+            fs = 0.712 if shp_fctr == 0 else shp_fctr
+            AR_tmp = 2.5 if grain_ar == 0 else grain_ar
+
+        else:
+            raise ValueError("ERROR: no shape correction for grain shape {}".format(grain_shp))
+
+        g_snw_Cg_tmp = g_b0 * (fs/fs_hex)**g_b1 * diam_ice**g_b2 # Eq.7, He et al. (2017)
+
+        if grain_shp == 1:
+            gg_snw_F07_tmp = g_F07_c0 + g_F07_c1 * AR_tmp + g_F07_c2 * AR_tmp**2 # Eqn. 3.1 in Fu (2007)
+        else:
+            gg_snw_F07_tmp = g_F07_p0 + g_F07_p1 * np.log(AR_tmp) + g_F07_p2 * (np.log(AR_tmp))**2 # Eqn. 3.3 in Fu (2007)
+
+        # 6 wavelength bands for g_snw to be interpolated into 480-bands of SNICAR
+        # shape-preserving piecewise interpolation into 480-bands
+        g_Cg_intp = pchip(g_wvl_center,g_snw_Cg_tmp)(wvl)
+        gg_F07_intp = pchip(g_wvl_center,gg_snw_F07_tmp)(wvl)
+
+        g_Cg_intp.setflags(write=False)
+        gg_F07_intp.setflags(write=False)
+        SHAPE_CORRECTIONS[key] = (g_Cg_intp, gg_F07_intp)
+
+    return SHAPE_CORRECTIONS[key]
+
+
+def build_column(dir_base, rf_ice, data, layer_type, grain_shp, grain_rds, shp_fctr, grain_ar, rho_layers, dz, wvl,\
+    MSSaer, MACaer, SSAaer, Gaer):
+
+    """
+    Builds the optical properties of the column for the RT solvers: tau, SSA and g for each layer of
+    ice + impurities (shape [nbr_lyr, nbr_wvl]) and the layer mass L_snw (kg m-2).
+
+    The ice properties are only calculated once for each distinct layer (layer type, grain shape,
+    radius, shape factor and aspect ratio); density only scales the bubble volume fraction and the
+    layer mass, so it is applied to all layers at once. The impurity and mixing calculations are
+    array operations over layers, so the cost grows slowly with the number of layers and columns
+    of 100+ layers are practical. data holds the files read by snicar_feeder (see snicar_files).
+
+    """
+
+    import numpy as np
+    from OpticsTables import OpticsTables
+    from SpectralGrid import SpectralGrid
+
+    grid = SpectralGrid.default()
+    nbr_lyr = len(dz)
+    nbr_wvl = len(wvl)
+
+    layer_type = np.asarray(layer_type)
+    rho_layers = np.asarray(rho_layers, dtype=float)
+    dz = np.asarray(dz, dtype=float)
+
+    SSA_snw = np.empty([nbr_lyr, nbr_wvl])
+    MAC_snw = np.empty([nbr_lyr, nbr_wvl])
+    g_snw = np.empty([nbr_lyr, nbr_wvl])
+
+    # group layers with the same ice
+    layers = {}
+
+    for i in range(nbr_lyr):
+        key = (int(layer_type[i]), float(grain_rds[i])) if layer_type[i] == 1 else\
+            (int(layer_type[i]), float(grain_rds[i]), int(grain_shp[i]), float(shp_fctr[i]), float(grain_ar[i]),\
+            i if grain_shp[i] == 4 else -1) # hexagonal prisms are read per layer
+        layers.setdefault(key, []).append(i)
+
+    for key, idx in layers.items():
+
+        i = idx[0]
+
+        if key[0] == 0: # (granular layer)
+
+            # read in single scattering albedo, MAC and g for ice crystals in each layer,
+            # spheres of any radius are interpolated from the Mie table, prisms are read from their file
+            ice = data[('ice', i)] if grain_shp[i] == 4 else OpticsTables.mie_ice(dir_base, rf_ice, grain_rds[i])
+
+            SSA_snw[idx,:] = ice['ss_alb']
+            MAC_snw[idx,:] = ice['ext_cff_mss']
+
+            if 0 < grain_shp[i] < 4:
+                # non-spherical grains: He et al. (2017) / Fu (2007) correction of g
+                g_Cg_intp, gg_F07_intp = shape_correction(grain_shp[i], grain_rds[i], shp_fctr[i], grain_ar[i], wvl)
+                g_snw_F07 = gg_F07_intp + (1.0 - gg_F07_intp) / SSA_snw[i,:] / 2 # Eq.2.2 in Fu (2007)
+                g_snw[idx,:] = g_snw_F07 * g_Cg_intp # Eq.6, He et al. (2017)
+                g_snw[idx,371:470] = g_snw[i,370] # assume same values for 4-5 um band, with very small biases (<3%)
+            else:
+                g_snw[idx,:] = ice['asm_prm']
+
+            g_lyr = g_snw[idx,:]
+            g_lyr[g_lyr < 0] = 0.01
+            g_lyr[g_lyr > 0.99] = 0.99 # avoid unreasonable values (so far only occur in large-size spheroid cases)
+            g_snw[idx,:] = g_lyr
+
+        else: # bubbly ice, with the volume fraction of air set by each layer's density
+
+            refidx_im = data['refidx']['im_' + REFIDX_NAMES[rf_ice]]
+            bubbles = OpticsTables.bubbly_ice(dir_base, grain_rds[i]) # interpolated to any bubble radius
+            sca_cff_vlm = bubbles['sca_cff_vlm'] # scattering cross section unit per volume of bubble
+            abs_cff_mss_ice = (refidx_im * grid.snicar_abs_factor)/917
+            vlm_frac_air = (917 - rho_layers[idx]) / 917
+            g_snw[idx,:] = bubbles['asm_prm']
+            MAC_snw[idx,:] = ((sca_cff_vlm * vlm_frac_air[:,None]) /917) + abs_cff_mss_ice
+            SSA_snw[idx,:] = ((sca_cff_vlm * vlm_frac_air[:,None]) /917) / MAC_snw[idx,:]
+
+    # for each layer, the layer mass (L) is density * layer thickness
+    # for each layer the optical depth is the layer mass * the mass extinction coefficient
+    # first for the ice in each layer
+    L_snw = rho_layers * dz
+    tau_snw = L_snw[:,None] * MAC_snw
+
+    # then for the LAPs in each layer: the mass of each impurity in each layer times its optical
+    # properties, summed over impurities
+    L_aer = L_snw[:,None] * MSSaer
+    tau_sum = L_aer @ MACaer
+    SSA_sum = L_aer @ (MACaer * SSAaer)
+    g_sum = L_aer @ (MACaer * SSAaer * Gaer)
+
+    # finally, for each layer calculate the effective SSA, tau and g for the snow+LAP
+    tau = tau_sum + tau_snw
+    SSA = (1 / tau) * (SSA_sum + SSA_snw * tau_snw)
+    g = (1 / (tau * SSA)) * (g_sum + (g_snw * SSA_snw * tau_snw))
+
+    # just in case any unrealistic values arise (none detected so far)
+    SSA[SSA<=0]=0.00000001
+    SSA[SSA>=1]=0.99999999
+    g[g<=0]=0.00001
+    g[g>=1]=0.99999
 
-    return wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, heat_rt, F_btm_net, F_top_pls
\ No newline at end of file
+    return tau, SSA, g, L_snw
@@ -0,0 +1,339 @@
+"""
+Class ServiceFuncs runs the model as a long-lived local HTTP service, so that programs that ask for
+hole fluxes many times (e.g. a melt model coupling or a dashboard) do not pay for starting Python,
+importing the model and reading the optical property files on every query.
+
+The service keeps a pool of worker processes. Each worker loads the spectral grid, refractive indices
+and data archive once when it starts, and keeps the files it has read (IOFuncs) and the columns it
+has solved for the rest of its life, so a new hole only costs the hole calculation. The service keeps
+the results of the last MAX_RESULTS scenarios, so repeated scenarios are answered without any model
+calculation. A request contains a batch of scenarios; scenarios that share an ice column are sent to
+the same worker and share one column solve, and different columns run in parallel on different
+workers.
+
+Requests are JSON, POSTed to /hole_fluxes:
+
+    {"scenarios": [{"hole_d": 0.2, "hole_w": 0.1, "hole_water_d": 0.1, "solzen": 45}, ...], "format": "json"}
+
+Each scenario may set any key of DEFAULT_SCENARIO (hole dimensions in metres, as in surface-mode) and
+the rest take the default values. The response contains the floor-averaged spectral energy absorbed
+by the cryoconite, escaping the hole and reflected from the water surface (SurfaceFuncs.hole_fluxes)
+for every scenario, either as JSON or, with "format": "npz", as a numpy .npz file of arrays with one
+row per scenario (much smaller and faster to decode). Requests larger than MAX_REQUEST bytes are
+refused with 413. GET /health returns the state of the service.
+Only connections from the local machine are expected; the service has no authentication.
+
+Functions in this class include:
+
+1) scenario
+    Fills in the defaults of a scenario and checks its keys
+
+2) evaluate
+    Calculates the hole fluxes for a batch of scenarios in the current process
+
+3) serve
+    Starts the service and handles requests until interrupted
+
+4) query
+    Sends a batch of scenarios to a running service and returns the results
+
+"""
+
+
+class ServiceFuncs:
+
+    HOST = '127.0.0.1'
+    PORT = 8765
+    MAX_COLUMNS = 64 # columns kept by each worker (least recently used are discarded first)
+    MAX_RESULTS = 1024 # scenario results kept by the service
+    MAX_REQUEST = 64*1024**2 # largest request body accepted (bytes); larger requests get 413
+
+    DEFAULT_SCENARIO = {'hole_d': 0.2, 'hole_w': 0.2, 'hole_water_d': 0.1, 'cryoconite_albedo': 0.2, 'solzen': 45,\
+        'density': [850], 'grain_rds': [850], 'layer_type': [1], 'algae': 0, 'incoming_i': 4, 'DIRECT': True,\
+        'tolerance': 1e-10, 'point_spacing': None, 'geometry': 'slot'}
+
+    _columns = {}
+    _cache_dir = None
+
+    def __init__(self):
+
+
+        return
+
+
+    def scenario(values):
+
+        """
+        Returns a dictionary of the scenario in values with the missing keys taken from
+        DEFAULT_SCENARIO. Unknown keys raise a ValueError. cryoconite_albedo may be one value or a
+        spectrum on the model grid.
+
+        """
+
+        unknown = set(values) - set(ServiceFuncs.DEFAULT_SCENARIO)
+
+        if unknown:
+            raise ValueError(f"ERROR: unknown scenario keys {sorted(unknown)}")
+
+        return dict(ServiceFuncs.DEFAULT_SCENARIO, **values)
+
+
+    def _warm(cache_dir):
+
+        # runs once in each worker process: imports the model and loads the grid, refractive indices
+        # and the files read by the default scenario
+
+        ServiceFuncs._cache_dir = cache_dir
+        ServiceFuncs.evaluate([{}])
+
+        return
+
+
+    def _column_key(s):
+
+        # the scenario values that determine the column around the hole
+
+        return (s['hole_d'], tuple(s['density']), tuple(s['grain_rds']), tuple(s['layer_type']), str(s['algae']),\
+            s['solzen'], s['incoming_i'], s['DIRECT'])
+
+
+    def evaluate(scenarios):
+
+        """
+        Calculates SurfaceFuncs.hole_fluxes for every scenario (see scenario) and returns a dictionary
+        of arrays with one row per scenario: absorbed, escaping and reflected_from_water_surface (model
+        grid) and total_absorbed. Columns are kept between calls (MAX_COLUMNS per process).
+
+        """
+
+        import numpy as np
+        from SurfaceFuncs import SurfaceFuncs
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SpectralGrid import SpectralGrid
+
+        WL = SpectralGrid.default().WL
+        results = {'absorbed': [], 'escaping': [], 'reflected_from_water_surface': []}
+
+        for values in scenarios:
+
+            s = ServiceFuncs.scenario(values)
+
+            params = TwoStreamFuncs.generate_ice_physical_params(s['density'], s['grain_rds'], s['layer_type'], [s['hole_d']],\
+                s['algae'], s['solzen'], s['incoming_i'], s['DIRECT'], ServiceFuncs._cache_dir)
+
+            key = ServiceFuncs._column_key(s)
+
+            if key in ServiceFuncs._columns:
+                column = ServiceFuncs._columns.pop(key) # re-inserted below as most recently used
+            else:
+                column = TwoStreamFuncs.call_snicar(params)
+
+            ServiceFuncs._columns[key] = column
+
+            while len(ServiceFuncs._columns) > ServiceFuncs.MAX_COLUMNS:
+                ServiceFuncs._columns.pop(next(iter(ServiceFuncs._columns)))
+
+            cryoconite_albedo = np.broadcast_to(np.asarray(s['cryoconite_albedo'], dtype=float), WL.shape)
+
+            hole = SurfaceFuncs.hole_fluxes(s['hole_d'], s['hole_w'], s['hole_water_d'], cryoconite_albedo, WL, params,\
+                s['tolerance'], s['point_spacing'], s['geometry'], column)
+
+            for name in results:
+                results[name].append(np.asarray(getattr(hole, name), dtype=float))
+
+        results = {name: np.array(value).reshape(len(scenarios), len(WL)) for name, value in results.items()}
+        results['total_absorbed'] = np.sum(results['absorbed'], axis=1)
+
+        return results
+
+
+    def serve(host=None, port=None, n_workers=None, cache_dir=None, verbose=True):
+
+        """
+        Starts the service on host:port (default HOST and PORT) with n_workers worker processes
+        (default one per CPU) and handles requests until interrupted (Ctrl-C). If cache_dir is set,
+        columns and hole results are also cached on disk there (see CacheFuncs) and survive restarts.
+
+        """
+
+        import io
+        import json
+        import os
+        import time
+        import multiprocessing
+        import threading
+        import numpy as np
+        from concurrent.futures import ProcessPoolExecutor
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from SpectralGrid import SpectralGrid
+
+        host = ServiceFuncs.HOST if host is None else host
+        port = ServiceFuncs.PORT if port is None else port
+        n_workers = (os.cpu_count() or 1) if n_workers is None else int(n_workers)
+
+        WL = SpectralGrid.default().WL
+        started = time.time()
+        counts = {'requests': 0, 'scenarios': 0, 'repeated': 0}
+
+        pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),\
+            initializer=ServiceFuncs._warm, initargs=(cache_dir,))
+
+        # start every worker now, so that the first queries do not pay for the imports
+        for future in [pool.submit(ServiceFuncs.scenario, {}) for _ in range(n_workers)]:
+            future.result()
+
+        results = {}
+        lock = threading.Lock()
+
+        def run(scenarios):
+
+            # repeated scenarios are answered from memory; the others are grouped so that scenarios
+            # sharing a column go to the same worker. Results are returned in request order.
+            keys = [json.dumps(ServiceFuncs.scenario(values), sort_keys=True) for values in scenarios]
+
+            with lock:
+                known = {key: results[key] for key in keys if key in results}
+                counts['repeated'] += sum(key in known for key in keys)
+
+            groups = {}
+
+            for key in dict.fromkeys(keys):
+                if key not in known:
+                    groups.setdefault(ServiceFuncs._column_key(json.loads(key)), []).append(key)
+
+            futures = [(group, pool.submit(ServiceFuncs.evaluate, [json.loads(key) for key in group]))\
+                for group in groups.values()]
+
+            for group, future in futures:
+                evaluated = future.result()
+                for i, key in enumerate(group):
+                    known[key] = {name: value[i] for name, value in evaluated.items()}
+
+            with lock:
+                for key in known:
+                    results.pop(key, None) # re-inserted as most recently used
+                    results[key] = known[key]
+                while len(results) > ServiceFuncs.MAX_RESULTS:
+                    results.pop(next(iter(results)))
+
+            return {name: np.array([known[key][name] for key in keys]) for name in known[keys[0]]}
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def reply(self, status, body, content_type='application/json'):
+
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+
+                if self.path != '/health':
+                    return self.reply(404, json.dumps({'error': f"ERROR: unknown path {self.path}"}).encode())
+
+                with lock:
+                    state = dict(counts)
+
+                self.reply(200, json.dumps(dict(state, status='ok', workers=n_workers, uptime=time.time()-started)).encode())
+
+            def do_POST(self):
+
+                if self.path != '/hole_fluxes':
+                    return self.reply(404, json.dumps({'error': f"ERROR: unknown path {self.path}"}).encode())
+
+                start = time.perf_counter()
+
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    return self.reply(400, json.dumps({'error': "ERROR: invalid Content-Length"}).encode())
+
+                if length < 0 or length > ServiceFuncs.MAX_REQUEST:
+                    self.close_connection = True # the body is not read
+                    return self.reply(413, json.dumps({'error': f"ERROR: request of {length} bytes, the limit is"\
+                        f" {ServiceFuncs.MAX_REQUEST} bytes"}).encode())
+
+                try:
+                    request = json.loads(self.rfile.read(length))
+                    scenarios = request['scenarios']
+                    results = run(scenarios) if len(scenarios) > 0 else {}
+
+                except (ValueError, KeyError, TypeError) as error:
+                    return self.reply(400, json.dumps({'error': str(error)}).encode())
+
+                except Exception as error:
+                    return self.reply(500, json.dumps({'error': f"ERROR: {type(error).__name__}: {error}"}).encode())
+
+                with lock:
+                    counts['requests'] += 1
+                    counts['scenarios'] += len(scenarios)
+
+                if request.get('format', 'json') == 'npz':
+                    buffer = io.BytesIO()
+                    np.savez(buffer, WL=WL, **results)
+                    self.reply(200, buffer.getvalue(), 'application/octet-stream')
+
+                else:
+                    self.reply(200, json.dumps({'WL': WL.tolist(), 'wall_time': time.perf_counter() - start,\
+                        'results': {name: value.tolist() for name, value in results.items()}}).encode())
+
+            def log_message(self, format, *args):
+
+                if verbose:
+                    BaseHTTPRequestHandler.log_message(self, format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+
+        if verbose:
+            print(f"serving hole fluxes on http://{host}:{port}/hole_fluxes with {n_workers} workers")
+
+        try:
+            server.serve_forever()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            server.server_close()
+            pool.shutdown()
+
+        return
+
+
+    def query(scenarios, url=None, format='npz', timeout=600):
+
+        """
+        Sends scenarios (a list of dictionaries, see scenario) to the service at url (default
+        http://HOST:PORT/hole_fluxes) and returns a dictionary of numpy arrays with one row per
+        scenario (see evaluate) and the wavelengths WL. Errors reported by the service are raised
+        as a ValueError.
+
+        """
+
+        import io
+        import json
+        import urllib.error
+        import urllib.request
+        import numpy as np
+
+        url = f"http://{ServiceFuncs.HOST}:{ServiceFuncs.PORT}/hole_fluxes" if url is None else url
+
+        request = urllib.request.Request(url, data=json.dumps({'scenarios': scenarios, 'format': format}).encode(),\
+            headers={'Content-Type': 'application/json'})
+
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = response.read()
+
+        except urllib.error.HTTPError as error:
+            raise ValueError(json.loads(error.read()).get('error', str(error)))
+
+        if format == 'npz':
+            with np.load(io.BytesIO(body)) as f:
+                return {name: f[name] for name in f.files}
+
+        reply = json.loads(body)
+
+        return dict({name: np.array(value) for name, value in reply['results'].items()}, WL=np.array(reply['WL']))
@@ -0,0 +1,116 @@
+"""
+Class SolverWorkspace holds the intermediate arrays of the radiative transfer solvers between calls.
+A solve allocates a few dozen arrays of shape [angles, wavelengths, layers] (transmissivities,
+reflectivities, interface fluxes, the tridiagonal matrix) and discards them at the end; in time
+series and services that make many small solves, allocating and freeing them is a measurable share
+of the run time. A workspace keeps one buffer per array name and hands it back on the next solve,
+growing it only when a larger column or batch of angles is solved.
+
+Buffers are only used within a solve: the solver outputs are separate arrays (or the caller's own
+output buffers), so they are not changed by later solves. A workspace must not be shared by
+solves running at the same time; SolverWorkspace.local() returns one workspace per thread, which
+the solvers use when they are not given one.
+
+Functions in this class include:
+
+1) local
+    Returns the workspace of the current thread (created on first use)
+
+2) zeros
+    Returns a buffer of the given shape filled with zeros
+
+3) empty
+    Returns a buffer of the given shape without initialising it
+
+4) nbytes
+    Returns the memory held by the workspace
+
+5) clear
+    Releases all buffers
+
+"""
+
+
+class SolverWorkspace:
+
+    _local = None
+
+    def __init__(self):
+
+        self._buffers = {}
+
+        return
+
+
+    def local():
+
+        """
+        Returns the workspace of the current thread, creating it on first use
+
+        """
+
+        import threading
+
+        if SolverWorkspace._local is None:
+            SolverWorkspace._local = threading.local()
+
+        if not hasattr(SolverWorkspace._local, 'workspace'):
+            SolverWorkspace._local.workspace = SolverWorkspace()
+
+        return SolverWorkspace._local.workspace
+
+
+    def empty(self, name, shape):
+
+        """
+        Returns the buffer name with shape (float64), reusing the memory of the previous buffer of
+        that name if it is large enough. The values are left from earlier solves.
+
+        """
+
+        import math
+        import numpy as np
+
+        size = math.prod(shape)
+        buffer = self._buffers.get(name)
+
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size)
+            self._buffers[name] = buffer
+
+        return buffer[:size].reshape(shape)
+
+
+    def zeros(self, name, shape):
+
+        """
+        Returns the buffer name with shape (see empty), filled with zeros
+
+        """
+
+        buffer = self.empty(name, shape)
+        buffer.fill(0)
+
+        return buffer
+
+
+    def nbytes(self):
+
+        """
+        Returns the number of bytes held by the workspace
+
+        """
+
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+
+    def clear(self):
+
+        """
+        Releases all buffers, e.g. after solving an unusually large column
+
+        """
+
+        self._buffers.clear()
+
+        return
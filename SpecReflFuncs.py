@@ -27,6 +27,9 @@ Functions in this class include:
 4) fresnel
     Calculates the magnitude of energy losses expected at each material boundary (air/water, water/ice)
 
+5) internal_reflection_spectra
+    Calculates the internal reflection losses for all wavelengths of many cryoconite albedo spectra at once
+
 AUTHOR: JOSEPH COOK, April 2020
 www.tothepoles.co.uk
 ww.github.com/jmcook1186
@@ -91,14 +94,11 @@ class specFuncs:
         # equal to 90 - out_ang.
 
         theta_rad = theta * (np.pi/180)
-                
-        t_theta = np.zeros(len(nAir))
-
-        for i in range(len(nAir)):
 
-            t_theta_temp = math.asin((nAir[i] * math.sin(theta_rad))/nWat[i])
+        # evaluated for all wavelengths at once
+        t_theta = np.arcsin((np.asarray(nAir) * math.sin(theta_rad))/np.asarray(nWat))
 
-            t_theta[i] = t_theta_temp * 180/np.pi
+        t_theta = t_theta * 180/np.pi
 
         return  t_theta
 
@@ -206,69 +206,39 @@ class specFuncs:
 
         
         def ReflectionsInWater(hole_water_d, SZA, theta, t_theta, hole_w, SurfStrike_d, nAir, nWat, REVERSE):
-           
-            base = hole_water_d / math.tan(t_theta*(np.pi/180))
-            n_wat_reflections = 0
-            reflect = False
-
-            if REVERSE:
 
-                if base <= SurfStrike_d:
-
-                    n_wat_reflections = 0
-                    beam_d_wat = 0
-
-                    reflect = False
-                    
-                else:
-
-                    reflect = True
-                    # depth gained by first subsurface beam
-                    beam_d_wat = math.tan(t_theta*(np.pi/180)) * SurfStrike_d
-                    
-                    while reflect == True:
-
-                        ang_top = 90-t_theta
+            """
+            t_theta can be a single angle or an array (one per wavelength). The beam descends by
+            beam_d_wat before its first subsurface wall strike and by depth_gained for each subsequent
+            crossing of the hole, so the number of reflections before the beam descends past the water
+            depth is found directly rather than by stepping the beam down one reflection at a time.
 
-                        depth_gained = hole_w / math.tan(ang_top * np.pi/180) 
+            """
 
-                        beam_d_wat += depth_gained
+            t_theta = np.asarray(t_theta, dtype=float)
 
-                        if beam_d_wat >= hole_water_d:
-                            
-                            reflect = False
+            # horizontal distance to the first wall strike after entering the water
+            if REVERSE:
+                first_d = SurfStrike_d
 
-                        n_wat_reflections += 1
-                               
-            
             else:
+                first_d = hole_w - SurfStrike_d
 
-                reflect = True
+            base = hole_water_d / np.tan(t_theta*(np.pi/180))
+            reflect = base > first_d
 
-                if base <= hole_w - SurfStrike_d:
+            # depth gained by first subsurface beam, then by each full crossing of the hole
+            beam_d_wat = np.tan(t_theta*(np.pi/180)) * first_d
+            ang_top = 90-t_theta
+            depth_gained = hole_w / np.tan(ang_top * (np.pi/180))
 
-                    n_wat_reflections = 0
-                    beam_d_wat = 0
-                    reflect = False
+            n_wat_reflections = np.maximum(1, np.ceil((hole_water_d - beam_d_wat)/depth_gained))
+            n_wat_reflections = np.where(reflect, n_wat_reflections, 0)
+            beam_d_wat = np.where(reflect, beam_d_wat + n_wat_reflections*depth_gained, 0)
 
-
-                else:
-
-                    beam_d_wat = math.tan(t_theta*(np.pi/180)) * (hole_w - SurfStrike_d)
-                    
-                    while reflect == True:
-
-                        ang_top = 90-t_theta
-                        depth_gained = hole_w / math.tan(ang_top * (np.pi/180)) 
-                        beam_d_wat += depth_gained
-                       
-
-                        if beam_d_wat >= hole_water_d:
-                            
-                            reflect = False
-
-                        n_wat_reflections += 1
-            
+            if n_wat_reflections.ndim == 0:
+                n_wat_reflections = int(n_wat_reflections)
+                beam_d_wat = float(beam_d_wat)
 
             return n_wat_reflections, beam_d_wat
 
@@ -372,22 +342,20 @@ class specFuncs:
         return PathLengthInWat
 
 
-    def AttenuateBeam(PathLengthInWat, kWat, dir_energy_at_hole_floor, WL):
+    def AttenuateBeam(PathLengthInWat, kWat, dir_energy_at_hole_floor, WL, abs_coeff=None):
         """
         Function uses imaginary refractive index to calculate absorption coefficient (1/m). The
         product of absorption coefficient and path length (m) is dimensionless attenuation factor used
-        to attenuate the beam due to absorption by water
+        to attenuate the beam due to absorption by water. A precomputed absorption coefficient
+        (e.g. SpectralGrid.water_abs_coeff) can be passed in as abs_coeff.
 
         """
         import numpy as np
 
-        abs_coeff = np.zeros(len(WL))
-        
         if PathLengthInWat != 0:
 
-            for i in range(len(WL)):
-
-                abs_coeff[i] = 4*np.pi*kWat[i] / WL[i]
+            if abs_coeff is None:
+                abs_coeff = 4*np.pi*np.asarray(kWat) / np.asarray(WL)
 
             norm_abs_coeff = abs_coeff * (PathLengthInWat) # multiply abs coeff (/m) by path length in m
             
@@ -415,21 +383,26 @@ class specFuncs:
 
         """
         
-        import math
         import numpy as np
 
-        if theta == 90:
+        # n1, n2, k1, k2 and theta can be single values or arrays (e.g. one value per wavelength)
+        theta_deg = np.asarray(theta, dtype=float)
+
+        if np.any(theta_deg == 90):
             print("\nIncident angle is 90 degrees")
-            Rf = (((n1-1)**2)+k1**2) / (((n2-1)**2)+k2**2)
-        
-        else:
 
-            theta = math.radians(theta)
-            theta_2 = math.asin(1/n2*(math.sin(theta)))
-            
+        theta = np.radians(theta_deg)
+        theta_2 = np.arcsin(1/np.asarray(n2)*(np.sin(theta)))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
             Rf = 0.5*(
-                ((math.sin(theta-theta_2)/math.sin(theta+theta_2))**2) +
-                ((math.tan(theta-theta_2)/math.tan(theta+theta_2))**2))
+                ((np.sin(theta-theta_2)/np.sin(theta+theta_2))**2) +
+                ((np.tan(theta-theta_2)/np.tan(theta+theta_2))**2))
+
+        Rf = np.where(theta_deg == 90, (((n1-1)**2)+k1**2) / (((n2-1)**2)+k2**2), Rf)
+
+        if Rf.ndim == 0:
+            Rf = float(Rf)
 
         return Rf
 
@@ -461,20 +434,17 @@ class specFuncs:
 
         # calculate reflected portion of upwelling energy using Fresnel equation
         # loop through angles then average for diffuse flux
-        # suppress /0 warning for this calculation (this is expected, and later corrected) 
-        np.seterr(divide='ignore', invalid='ignore')
+        # suppress /0 warning for this calculation only (this is expected, and later corrected)
+        with np.errstate(divide='ignore', invalid='ignore'):
 
-        for theta in np.arange(1,89,1): 
-            theta_rad = np.radians(theta)
-            Rf.append(((nWat * np.sqrt( 1- (((nWat/nAir)*np.sin(theta_rad))**2)) - nAir*np.cos(theta_rad))/ (nWat * np.sqrt( 1- (((nWat/nAir)*np.sin(theta_rad))**2)) * nAir*np.cos(theta_rad)))**2)
+            for theta in np.arange(1,89,1): 
+                theta_rad = np.radians(theta)
+                Rf.append(((nWat * np.sqrt( 1- (((nWat/nAir)*np.sin(theta_rad))**2)) - nAir*np.cos(theta_rad))/ (nWat * np.sqrt( 1- (((nWat/nAir)*np.sin(theta_rad))**2)) * nAir*np.cos(theta_rad)))**2)
         
         Rf = np.array(Rf)
         Rf[np.isnan(Rf)] = 0.9999999999   # nans are angles > Brewster's angle == total internal reflection
         Rf[Rf>1] = 0.99999   # correct for any invalid values
         diffuse_Rf = np.mean(Rf) # diffuse Fresnel reflection
-        
-        # turn warnings back on
-        np.seterr(divide='warn', invalid='warn')
 
         # energy upwelling after absorption by cryoconite layer
         upwelling_energy = energy_arriving_at_floor * (1-cryoconite_albedo)
@@ -513,3 +483,81 @@ class specFuncs:
         escaped = energy_arriving_at_floor - loss
 
         return escaped, loss, cryoconite_abs
+
+
+    def internal_reflection_spectra(hole_water_d, cryoconite_albedo, WL, nAir, kAir, nWat, kWat, tolerance,\
+        dir_energy_at_hole_floor, diffuse_energy_at_hole_floor):
+
+        """
+        internal_reflection for every wavelength, and for many cryoconite albedo spectra, at once.
+        WL, the refractive indices and the energy at the hole floor are spectra (one value per
+        wavelength); cryoconite_albedo is a spectrum or an array of spectra (spectra x wavelengths).
+        Returns escaped, loss and cryoconite_abs with the shape of cryoconite_albedo.
+
+        Each wavelength of each spectrum is iterated until its upwelling energy falls below
+        tolerance, exactly as internal_reflection does for one wavelength, so the results are the
+        same; only the values that have not yet converged are updated at each iteration.
+
+        """
+
+        import numpy as np
+
+        energy_arriving_at_floor = dir_energy_at_hole_floor + diffuse_energy_at_hole_floor
+        path_length = hole_water_d
+
+        # diffuse Fresnel reflection at each wavelength, averaged over angles (see internal_reflection)
+        theta_rad = np.radians(np.arange(1,89,1))[None,:]
+        nAir, kAir, nWat, kWat, WL = [np.asarray(x, dtype=float)[:,None] for x in (nAir, kAir, nWat, kWat, WL)]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Rf = ((nWat * np.sqrt( 1- (((nWat/nAir)*np.sin(theta_rad))**2)) - nAir*np.cos(theta_rad))/ (nWat * np.sqrt( 1- (((nWat/nAir)*np.sin(theta_rad))**2)) * nAir*np.cos(theta_rad)))**2
+
+        Rf[np.isnan(Rf)] = 0.9999999999
+        Rf[Rf>1] = 0.99999
+        diffuse_Rf = np.mean(Rf, axis=1)
+
+        norm_abs_coeff = (4*np.pi*kWat[:,0] / WL[:,0]) * (path_length)
+
+        cryoconite_albedo = np.asarray(cryoconite_albedo, dtype=float)
+        shape = np.broadcast_shapes(cryoconite_albedo.shape, np.shape(energy_arriving_at_floor))
+
+        # flattened values for every wavelength of every spectrum
+        albedo, rf, coeff = [np.broadcast_to(x, shape).ravel() for x in (cryoconite_albedo, diffuse_Rf, norm_abs_coeff)]
+        upwelling_energy = np.broadcast_to(energy_arriving_at_floor * (1-cryoconite_albedo), shape).ravel()
+
+        loss = np.zeros(upwelling_energy.size)
+        cryoconite_abs = np.zeros(upwelling_energy.size)
+
+        # values that have not converged, compacted; they are written to loss and cryoconite_abs
+        # when they converge
+        active = np.flatnonzero(upwelling_energy > tolerance)
+        u, a, c, r = [x[active] for x in (upwelling_energy, coeff, albedo, rf)]
+        total_loss = np.zeros(active.size)
+        total_abs = np.zeros(active.size)
+
+        while active.size > 0:
+
+            loss_upwards = u*a
+            loss_at_boundary = (u - loss_upwards) * (1-r)
+            down_flux = u - loss_upwards - loss_at_boundary
+            loss_downwards = down_flux * a
+            loss_at_cryoconite = (down_flux-loss_downwards) * (1-c)
+
+            total_iteration_loss = loss_upwards + loss_at_boundary + loss_downwards + loss_at_cryoconite
+
+            total_loss += total_iteration_loss
+            total_abs += loss_at_cryoconite
+            u = u - total_iteration_loss
+
+            keep = u > tolerance
+
+            if not keep.all():
+                done = ~keep
+                loss[active[done]] = total_loss[done]
+                cryoconite_abs[active[done]] = total_abs[done]
+                active, u, a, c, r, total_loss, total_abs = [x[keep] for x in (active, u, a, c, r, total_loss, total_abs)]
+
+        loss = loss.reshape(shape)
+        escaped = energy_arriving_at_floor - loss
+
+        return escaped, loss, cryoconite_abs.reshape(shape)
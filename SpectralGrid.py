@@ -0,0 +1,185 @@
+"""
+Class SpectralGrid owns the wavelength axes used by the model and the constants derived from them.
+
+SNICAR works on 480 bands (0.205 - 4.995 um). The direct beam and hole calculations work on the 470
+bands from 0.3 um (WL), which are the SNICAR bands with the first 10 removed. The refractive index of
+water is tabulated at 10 times the model resolution and is decimated onto WL. These relationships,
+the visible/near-infrared split and the constants that only depend on the grid (refractive indices of
+air, water and ice, the absorption coefficient of water 4*pi*k/lambda and the 4*pi/lambda factor
+used for ice absorption in SNICAR) are computed once per process and shared by every module through
+SpectralGrid.default(). The arrays are read-only, so they can be shared without copying. The
+CryoconiteRTM data folder (DATA_DIR) can be moved for the whole process with use_data_dir.
+
+Functions in this class include:
+
+1) default
+    Returns the grid shared by all modules (created on first use)
+
+2) use_data_dir
+    Sets the CryoconiteRTM data folder used by the default grid, archive, atlas and cache
+
+3) to_model
+    Resamples SNICAR-band arrays onto the model grid WL (a view, not a copy)
+
+4) decimate
+    Resamples arrays tabulated at the fine (10x) resolution onto the model grid
+
+5) refractive_indices
+    Returns the real and imaginary refractive indices of air, water and ice on WL
+
+"""
+
+
+class SpectralGrid:
+
+    DATA_DIR = '/home/joe/Code/CryoconiteRTM/Data/' # location of the CryoconiteRTM data folder, unless set by use_data_dir
+
+    _default = None
+
+    def __init__(self, data_dir=None, n_snicar=480, snicar_start=0.205,\
+        step=0.01, trim=10, fine_factor=10, vis_max=0.7):
+
+        import numpy as np
+
+        self.data_dir = SpectralGrid.DATA_DIR if data_dir is None else data_dir
+
+        # SNICAR band centres (um)
+        self.snicar_wvl = SpectralGrid._read_only(np.round(snicar_start + step*np.arange(n_snicar), 6))
+        self.n_snicar = n_snicar
+
+        # model grid (um), the SNICAR bands from index trim onwards
+        self.trim = slice(trim, None)
+        self.WL = SpectralGrid._read_only(np.arange(0.3,5,0.01))
+        self.n_model = len(self.WL)
+
+        if self.n_model != n_snicar - trim:
+            raise ValueError("ERROR: the model grid does not match the trimmed SNICAR grid")
+
+        # fine resolution tables (e.g. water k) are decimated by this factor
+        self.fine = slice(0, -1, fine_factor)
+
+        # visible/near infrared split on the SNICAR grid
+        self.vis_max_idx = int(np.searchsorted(self.snicar_wvl, vis_max))
+        self.nir_max_idx = n_snicar
+
+        # 4*pi/lambda (1/m) on the SNICAR grid, used for absorption by ice
+        self.snicar_abs_factor = SpectralGrid._read_only(4*np.pi/(self.snicar_wvl*1e-6))
+
+        self._indices = None
+        self._water_abs_coeff = None
+
+        return
+
+
+    def default():
+
+        """
+        Returns the grid shared by all modules, creating it on first use
+
+        """
+
+        if SpectralGrid._default is None:
+            SpectralGrid._default = SpectralGrid()
+
+        return SpectralGrid._default
+
+
+    def use_data_dir(data_dir):
+
+        """
+        Makes data_dir the CryoconiteRTM data folder for the whole process. The default grid and its
+        refractive indices, the default archive (IOFuncs) and atlas (AtlasFuncs) and the data version
+        of the cache (CacheFuncs) all follow it. Open archives are closed and the archive in data_dir,
+        if there is one, is opened on the next read.
+
+        """
+
+        import os
+        from IOFuncs import IOFuncs
+
+        data_dir = os.path.join(data_dir, '')
+
+        if data_dir != SpectralGrid.DATA_DIR:
+            SpectralGrid.DATA_DIR = data_dir
+            SpectralGrid._default = None
+            IOFuncs.close_archives(auto_open=True)
+
+        return
+
+
+    def _read_only(arr):
+
+        arr.setflags(write=False)
+
+        return arr
+
+
+    def to_model(self, x):
+
+        """
+        Returns the part of SNICAR-band array x (wavelength on the last axis) on the model grid WL
+
+        """
+
+        import numpy as np
+
+        return np.asarray(x)[...,self.trim]
+
+
+    def decimate(self, x):
+
+        """
+        Returns fine resolution array x (wavelength on the last axis) on the model grid WL
+
+        """
+
+        import numpy as np
+
+        return np.asarray(x)[...,self.fine]
+
+
+    def refractive_indices(self):
+
+        """
+        Returns nAir, kAir, nWat, kWat, nIce, kIce on the model grid WL. The files are read on the
+        first call only (from the optical property archive if one is open, see IOFuncs).
+
+        """
+
+        import numpy as np
+        from IOFuncs import IOFuncs
+
+        if self._indices is None:
+
+            nAir = np.ones(shape=(self.n_model))+0.0003 # define n and k for air (array of ones)
+            kAir = np.zeros(shape=(self.n_model))+0.00000001
+
+            # import spectral refractive index for water
+            nWat = IOFuncs.read_csv(self.data_dir + 'water_n.csv')
+            kWat = IOFuncs.read_csv(self.data_dir + 'water_k.csv')
+            kWat = np.ascontiguousarray(self.decimate(kWat)) #every 10th element to match resolution of SNICAR
+
+            nIce = np.array(IOFuncs.read_csv(self.data_dir + 'ice_n.csv'))
+            nIce[nIce<1.0] = 1.0 # prevent math domain error - this is a negligible adjustment to a few wavelengths
+            kIce = IOFuncs.read_csv(self.data_dir + 'ice_k.csv')
+
+            self._indices = tuple(SpectralGrid._read_only(x) for x in (nAir, kAir, nWat, kWat, nIce, kIce))
+
+        return self._indices
+
+
+    def water_abs_coeff(self):
+
+        """
+        Returns the absorption coefficient of water, 4*pi*k/lambda, on the model grid WL
+
+        """
+
+        import numpy as np
+
+        if self._water_abs_coeff is None:
+
+            kWat = self.refractive_indices()[3]
+            self._water_abs_coeff = SpectralGrid._read_only(4*np.pi*kWat / self.WL)
+
+        return self._water_abs_coeff
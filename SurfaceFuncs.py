@@ -0,0 +1,214 @@
+"""
+Class SurfaceFuncs contains the functions used by surface-mode to calculate the albedo of, and the
+energy absorbed within, a patch of ice populated with cryoconite holes. The holes are described by a
+population table (see HoleDistFuncs) of representative holes and weights, so the model is only run for
+the representative holes and the total number of holes only scales the result.
+
+Functions in this class include:
+
+1) hole_fluxes
+    Averages CalculateFluxes across the floor of a single hole and returns floor-averaged spectral fluxes
+
+2) integrate_population
+    Integrates hole_fluxes over a population of holes, returning the expected fluxes per hole
+
+3) patch_albedo
+    Combines the hole population with the surrounding ice to give the spectral and broadband albedo
+    of the patch and the energy absorbed by all cryoconite holes in it
+
+"""
+
+
+class SurfaceFuncs:
+
+    def __init__(self):
+
+
+        return
+
+
+    def hole_fluxes(hole_d, hole_w, hole_water_d, cryoconite_albedo, WL, params, tolerance, point_spacing=None, geometry='slot',\
+        column=None, solve_column=None, keep_points=False, incoming=None, atlas=None):
+
+        """
+        Calculates the spectral energy absorbed by the cryoconite layer, escaping the hole after internal
+        reflections and reflected from the water surface, averaged across the hole floor. By default the
+        floor is integrated exactly (ControlFuncs.FloorMean); if point_spacing is given the mean is taken
+        over points on the hole floor spaced point_spacing apart instead. The ice column around the hole
+        has the same depth as the hole, so params is copied with dz = [hole_d].
+
+        geometry is 'slot' (the 2-D hole of ControlFuncs.DirectBeam) or 'cylinder' (a circular hole of
+        diameter hole_w, see CylinderFuncs). Cylindrical holes are always averaged over the whole floor.
+
+        The column around the hole is solved once for all points; a column that is already solved
+        (the output of call_snicar for params with dz = [hole_d]) can be passed in instead, or a
+        function solve_column(params) that replaces call_snicar (e.g. ModelSession.solve, which keeps
+        the columns it has solved). With atlas (an AtlasFuncs atlas or the path of one) the column is
+        interpolated instead, so the hole depth must be inside the dz axis of the atlas. incoming is the
+        irradiance for params, if the caller already has it.
+
+        Sampled points are reduced to running means as they are calculated (see RunningMean), so memory
+        does not grow with the number of points. With keep_points the spectra absorbed and escaping at
+        every point are also returned (points x wavelengths); otherwise points is None.
+
+        """
+
+        import collections
+        import numpy as np
+        from ControlFuncs import ControlFuncs
+        from TwoStreamFuncs import TwoStreamFuncs
+        from RunningMean import RunningMean
+        from AtlasFuncs import AtlasFuncs
+
+        ControlFuncs.Validate_Input_Data(hole_d, hole_w, hole_water_d, params.solzen)
+
+        hole_params = TwoStreamFuncs.generate_ice_physical_params(params.rho_layers, params.grain_rds,\
+            params.layer_type, [hole_d], params.mss_cnc_glacier_algae, params.solzen, params.incoming_i, params.DIRECT,\
+            params.cache_dir, params.cache_size, params.dir_base)
+
+        if column is None and atlas is not None:
+            column = AtlasFuncs.column(atlas, hole_params)
+
+        if column is None:
+            column = (TwoStreamFuncs.call_snicar if solve_column is None else solve_column)(hole_params)
+
+        hole = collections.namedtuple("hole", "absorbed, escaping, reflected_from_water_surface, points")
+
+        if geometry == 'cylinder' or point_spacing is None:
+
+            if geometry == 'cylinder':
+                result = ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, None, cryoconite_albedo, WL, hole_params,\
+                    tolerance, column, geometry=geometry, incoming=incoming)
+
+            else:
+                result = ControlFuncs.FloorMean(hole_d, hole_w, hole_water_d, cryoconite_albedo, WL, hole_params, tolerance,\
+                    column, incoming=incoming)
+
+            energy_escaping_internal_reflections, dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite,\
+                total_incoming_energy, dir_energy_at_hole_floor, diffuse_energy_at_hole_floor, F_top_pls,\
+                reflected_from_water_surface = result
+
+            return hole(dir_energy_absorbed_by_cryoconite + diffuse_energy_absorbed_by_cryoconite,\
+                energy_escaping_internal_reflections, np.array(reflected_from_water_surface), None)
+
+        absorbed = RunningMean(keep_points)
+        escaping = RunningMean(keep_points)
+
+        n_points = max(1, int(round(hole_w/point_spacing)))
+
+        for point in np.arange(0, n_points, 1)*point_spacing:
+
+            energy_escaping_internal_reflections, dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite,\
+                total_incoming_energy, dir_energy_at_hole_floor, diffuse_energy_at_hole_floor, F_top_pls,\
+                reflected_from_water_surface = ControlFuncs.CalculateFluxes(\
+                hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL, hole_params, tolerance, column, incoming=incoming)
+
+            absorbed.add(dir_energy_absorbed_by_cryoconite + diffuse_energy_absorbed_by_cryoconite)
+            escaping.add(energy_escaping_internal_reflections)
+
+        points = collections.namedtuple("points", "absorbed, escaping")(absorbed.stack(), escaping.stack()) if keep_points else None
+
+        return hole(absorbed.mean, escaping.mean, np.array(reflected_from_water_surface), points)
+
+
+    def integrate_population(population, cryoconite_albedo, WL, params, tolerance, point_spacing=None, geometry='slot',\
+        solve_column=None, incoming=None, atlas=None):
+
+        """
+        Integrates hole_fluxes over a population table. Holes are assumed circular in plan view with
+        diameter hole_w. Returns the expected (weighted mean) hole area and the expected spectral power
+        (flux * area) absorbed, escaping and reflected from the water surface for a single hole drawn
+        from the population. Multiplying by the number of holes gives the totals for a patch, so the
+        cost depends only on the number of representative holes.
+
+        Representative holes that are repeated in the table (e.g. when one variable is a fixed value)
+        are only calculated once. Columns are solved by solve_column or interpolated from atlas, and
+        incoming is the irradiance for params, if known (see hole_fluxes).
+
+        """
+
+        import collections
+        import numpy as np
+
+        mean_area = 0
+        absorbed = np.zeros(len(WL))
+        escaping = np.zeros(len(WL))
+        reflected = np.zeros(len(WL))
+        solved = {}
+
+        for hole_w, hole_d, hole_water_d, weight in zip(population.hole_w, population.hole_d,\
+            population.hole_water_d, population.weight):
+
+            if weight <= 0:
+                continue
+
+            key = (float(hole_w), float(hole_d), float(hole_water_d))
+
+            if key not in solved:
+                solved[key] = SurfaceFuncs.hole_fluxes(hole_d, hole_w, hole_water_d, cryoconite_albedo,\
+                    WL, params, tolerance, point_spacing, geometry, solve_column=solve_column, incoming=incoming, atlas=atlas)
+
+            hole_area = np.pi*((hole_w/2)**2)
+            mean_area += weight * hole_area
+            absorbed += weight * hole_area * solved[key].absorbed
+            escaping += weight * hole_area * solved[key].escaping
+            reflected += weight * hole_area * solved[key].reflected_from_water_surface
+
+        expected = collections.namedtuple("expected", "area, absorbed, escaping, reflected_from_water_surface, n_solved")
+
+        return expected(mean_area, absorbed, escaping, reflected, len(solved))
+
+
+    def patch_albedo(population, n_holes, study_area, cryoconite_albedo, WL, params, tolerance, point_spacing=None,\
+        geometry='slot', solve_column=None, incoming=None, atlas=None):
+
+        """
+        Calculates the spectral and broadband albedo of a patch of ice of area study_area (m2) containing
+        n_holes cryoconite holes drawn from population. The upwelling flux from the patch is the sum of
+        the flux reflected by the ice between the holes (from SNICAR, using params), the flux reflected
+        from the water surface in the holes and the flux escaping the holes after internal reflections.
+
+        Returns a named tuple containing the spectral albedo, broadband albedo, spectral upwelling flux
+        (W m-2), spectral and total energy absorbed by all cryoconite holes in the patch (W) and the total
+        area covered by cryoconite holes (m2). Columns (holes and surrounding ice) are solved by
+        solve_column if given, and incoming is the irradiance for params if known (see hole_fluxes).
+        atlas interpolates the hole columns; the surrounding ice, which usually has several layers, is
+        still solved by solve_column.
+
+        """
+
+        import collections
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SpectralGrid import SpectralGrid
+
+        solve_column = TwoStreamFuncs.call_snicar if solve_column is None else solve_column
+
+        if incoming is None:
+            incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+
+        expected = SurfaceFuncs.integrate_population(population, cryoconite_albedo, WL, params, tolerance, point_spacing,\
+            geometry, solve_column, incoming, atlas)
+
+        total_cryoconite_area = n_holes * expected.area
+
+        if total_cryoconite_area > study_area:
+            raise ValueError(f"Cryoconite area = {total_cryoconite_area} Total study area is less than total cryoconite area")
+
+        albedo, BBA, F_btm_net, F_top_pls = solve_column(params)
+
+        up1 = SpectralGrid.default().to_model(F_top_pls)*(study_area-total_cryoconite_area)
+        up2 = expected.reflected_from_water_surface*n_holes
+        up3 = expected.escaping*n_holes
+
+        new_up = (up1+up2+up3)/study_area
+
+        albedo = new_up/incoming
+        albedo[albedo<0] = 0.0001
+        BBA = np.sum(new_up)/np.sum(incoming)
+
+        spectral_absorbed = expected.absorbed*n_holes
+
+        surface = collections.namedtuple("surface", "albedo, BBA, up, absorbed, total_absorbed, cryoconite_area")
+
+        return surface(albedo, BBA, new_up, spectral_absorbed, np.sum(spectral_absorbed), total_cryoconite_area)
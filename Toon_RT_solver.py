@@ -1,21 +1,72 @@
-def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, wvl, Fs, Fd,L_snw, flx_slr):
+def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, wvl, Fs, Fd,L_snw, flx_slr, transfer=False,\
+    workspace=None, out=None, outputs=None):
 
+    """
+    Tridiagonal matrix solver of Toon et al. (1989).
+
+    mu_not can be a single cosine of the solar zenith angle or an array of them, in which case Fs, Fd
+    and flx_slr can have one row per angle (shape [n_angles, nbr_wvl]) or be shared by all angles. The
+    coefficients of the tridiagonal matrix (A, B, D) and its forward elimination (AS, X) do not depend on
+    the solar angle, so they are calculated once; only the C-functions, the right hand side (E) and the
+    back substitution are calculated for each angle. When mu_not is an array every output gains a
+    leading axis of length n_angles.
+
+    The fluxes are linear in the incident direct and diffuse flux. If transfer is True the solver
+    returns the wavelengths and a named tuple of transfer functions instead of the usual outputs:
+    upwelling, downwelling and net (up - down) flux at every layer interface (index 0 = surface,
+    index nbr_lyr = bottom of the column) per unit incident direct flux (dir_up, dir_down, dir_net)
+    and per unit incident diffuse flux (dif_up, dif_down, dif_net), each of shape
+    [nbr_lyr+1, nbr_wvl] (with a leading angle axis if mu_not is an array). Both are found from the
+    same matrix, as two extra right hand sides per angle. Fs, Fd and flx_slr are not used.
+
+    The tridiagonal matrix and its solution are held in workspace (a SolverWorkspace, by default the
+    one of the current thread), so repeated solves do not allocate them again. The outputs are new
+    arrays, except that out can be a dictionary of arrays for albedo, F_btm_net and/or F_top_pls,
+    which are filled in place and returned.
+
+    outputs can name the outputs that are needed, out of albedo, BBA, BBAVIS, BBANIR, abs_slr,
+    abs_vis_tot, heat_rt, F_btm_net and F_top_pls; the others are not calculated and are returned as
+    None. Unless abs_slr or heat_rt is needed, the net flux is only calculated at the bottom of the
+    column. By default (None) every output is calculated.
+
+    """
+
+    import collections
     import numpy as np
+    from SpectralGrid import SpectralGrid
+    from SolverWorkspace import SolverWorkspace
+
+    work = SolverWorkspace.local() if workspace is None else workspace
+
+    single_angle = np.ndim(mu_not) == 0
+    mu_not = np.atleast_1d(np.asarray(mu_not, dtype=float))
+    nbr_ang = len(mu_not)
+
+    if transfer:
+
+        # unit direct flux (mu_not * pi * Fs = 1) for the first nbr_ang rows and unit
+        # diffuse flux for the rest
+        Fs = np.concatenate([np.ones([nbr_ang,nbr_wvl])/(mu_not[:,None]*np.pi), np.zeros([nbr_ang,nbr_wvl])])
+        Fd = np.concatenate([np.zeros([nbr_ang,nbr_wvl]), np.ones([nbr_ang,nbr_wvl])])
+        flx_slr = np.ones([2*nbr_ang,nbr_wvl])
+        mu_not = np.concatenate([mu_not, mu_not])
+        nbr_ang = 2*nbr_ang
+
+    # incident flux with one row per solar angle
+    Fs = np.broadcast_to(np.asarray(Fs, dtype=float), (nbr_ang, nbr_wvl))
+    Fd = np.broadcast_to(np.asarray(Fd, dtype=float), (nbr_ang, nbr_wvl))
+    flx_slr = np.broadcast_to(np.asarray(flx_slr, dtype=float), (nbr_ang, nbr_wvl))
+
+    # solar angle terms shaped to broadcast against [angle, layer, wavelength]
+    mu = mu_not[:,None,None]
 
-    direct = np.zeros([nbr_lyr,nbr_wvl])
-    F_net = np.zeros([nbr_lyr, nbr_wvl])
-    F_btm_net = np.zeros([1,nbr_wvl])
-    F_top_net = np.zeros([1,nbr_wvl])
-    intensity = np.zeros([nbr_lyr, nbr_wvl])
-    F_top_pls = np.zeros([1,nbr_wvl])
-    F_up = np.zeros([nbr_lyr,nbr_wvl])
-    F_down = np.zeros([nbr_lyr,nbr_wvl])
-    F_net2 = np.zeros([nbr_lyr, nbr_wvl])
-    intensity2 = np.zeros([nbr_lyr, nbr_wvl])
-    intensity2_top = np.zeros(nbr_wvl)
-    F_abs = np.zeros([nbr_lyr, nbr_wvl])
-    abs_vis = np.zeros(nbr_lyr)
-    abs_nir = np.zeros(nbr_lyr)
+    F_btm_net = np.zeros([nbr_ang,nbr_wvl])
+    F_top_net = np.zeros([nbr_ang,nbr_wvl])
+
+    # the per-layer outputs need the net flux at the base of every layer, the others only at the
+    # base of the column
+    wanted = lambda name: outputs is None or name in outputs
+    per_layer = wanted('abs_slr') or wanted('heat_rt')
 
     ############################################
     # PERFORM DELTA TRANSFORMATION IF REQUIRED
@@ -36,12 +87,12 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
 
 
     # CALCULATE TOTAL OPTICAL DEPTH OF ENTIRE COLUMN
-    # i.e. tau_clm = total optical depth from upper boundary 
+    # i.e. tau_clm = total optical depth from upper boundary
     # to upper boundary of layer n. This is therefore a cumulative
     # quantity - subsequently lower layers contain the sum of the
     # # optical depth of all overlying layers
 
-    tau_clm = np.zeros([nbr_lyr,nbr_wvl])
+    tau_clm = work.zeros('toon_tau_clm', [nbr_lyr,nbr_wvl])
     for i in np.arange(1,nbr_lyr,1):
         #start loop from 2nd layer, i.e. index = 1
         tau_clm[i,:] = tau_clm[i-1,:]+tau_star[i-1,:]
@@ -50,7 +101,7 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
     # calculate radiation reflected skywards by underlying surface (i.e. lower model boundary)
     # remainder is lost
 
-    S_sfc = R_sfc * mu_not * np.exp(-(tau_clm[nbr_lyr-1,:] + tau_star[nbr_lyr-1,:])/mu_not)*np.pi * Fs
+    S_sfc = R_sfc * mu_not[:,None] * np.exp(-(tau_clm[nbr_lyr-1,:] + tau_star[nbr_lyr-1,:])/mu_not[:,None])*np.pi * Fs
 
     ######################################################
     # Apply Two-Stream Approximation (Toon et al, table 1)
@@ -61,18 +112,21 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
     approximation are provided in Toon et al. (1989) Table 1.
 
     The hemispheric mean scheme is derived by assuming that the
-    phase function is equal to 1  + g  in the forward scattering 
-    hemisphere and to 1  - g  in the backward scattering hemisphere. 
+    phase function is equal to 1  + g  in the forward scattering
+    hemisphere and to 1  - g  in the backward scattering hemisphere.
     The asymmetry parameter is g. The hemispheric mean is only
     useful for infrared wavelengths
 
+    gamma1 and gamma2 have shape [layer, wavelength]; gamma3 and gamma4
+    depend on the solar angle and have shape [angle, layer, wavelength]
+
     """
 
     if APRX_TYP == 1:
         #apply Eddington approximation
         gamma1 = (7-(SSA_star * (4+(3*g_star))))/4
         gamma2 = -(1-(SSA_star*(4-(3*g_star))))/4
-        gamma3 = (2-(3*g_star*mu_not))/4
+        gamma3 = (2-(3*g_star*mu))/4
         gamma4 = 1-gamma3
         mu_one = 0.5
 
@@ -80,7 +134,7 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
         #apply quadrature approximation
         gamma1 = np.sqrt(3)*(2-(SSA_star*(1+g_star)))/2
         gamma2 = SSA_star * np.sqrt(3)*(1-g_star)/2
-        gamma3 = (1-(np.sqrt(3)*g_star*mu_not))/2
+        gamma3 = (1-(np.sqrt(3)*g_star*mu))/2
         gamma4 = 1-gamma3
         mu_one = 1/np.sqrt(3)
 
@@ -88,7 +142,7 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
         #apply hemispheric mean approximation
         gamma1 = 2 - (SSA_star*(1+g_star))
         gamma2 = SSA_star*(1-g_star)
-        gamma3 = (1-(np.sqrt(3) * g_star*mu_not))/2
+        gamma3 = (1-(np.sqrt(3) * g_star*mu))/2
         gamma4 = 1-gamma3
         mu_one = 0.5
 
@@ -113,48 +167,34 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
     ######################################
 
     # C is the direct beam flux calculated at the top and bottom of each layer, i,
-    # see Toon equations 23 and 24
+    # see Toon equations 23 and 24. Angles with no direct-beam flux get zeros.
 
     """ N.B. consider adding in stability check here as per Flanner's Matlab code """
 
-    C_pls_btm = np.zeros([nbr_lyr,nbr_wvl])
-    C_mns_btm = np.zeros([nbr_lyr,nbr_wvl])
-    C_pls_top = np.zeros([nbr_lyr, nbr_wvl])
-    C_mns_top = np.zeros([nbr_lyr, nbr_wvl])
-
-    for i in np.arange(0,nbr_lyr,1):
+    has_direct = (np.sum(Fs,axis=1) > 0.0)[:,None,None]
+    pi_Fs = SSA_star*np.pi*Fs[:,None,:]
 
-        if np.sum(Fs) > 0.0:
+    C_pls_btm = np.where(has_direct, (pi_Fs*np.exp(-(tau_clm+tau_star)/mu)*
+                        (((gamma1-(1/mu))*gamma3)+(gamma4*gamma2)))/((lam**2)-(1/(mu**2))), 0)
 
-            C_pls_btm[i,:] = (SSA_star[i,:]*np.pi*Fs*np.exp(-(tau_clm[i,:]+tau_star[i,:])/mu_not)*
-                                (((gamma1[i,:]-(1/mu_not))*gamma3[i,:])+(gamma4[i,:]*gamma2[i,:])))\
-                                /((lam[i,:]**2)-(1/(mu_not**2)))
+    C_mns_btm = np.where(has_direct, (pi_Fs*np.exp(-(tau_clm+tau_star)/mu)*
+                        (((gamma1+(1/mu))*gamma4)+(gamma2*gamma3)))/((lam**2)-(1/(mu**2))), 0)
 
-            C_mns_btm[i,:] = (SSA_star[i,:]*np.pi*Fs*
-                                np.exp(-(tau_clm[i,:]+tau_star[i,:])/mu_not) * (((gamma1[i,:]+(1/mu_not))*gamma4[i,:])+
-                                (gamma2[i,:]*gamma3[i,:])))/((lam[i,:]**2)-(1/mu_not**2))
+    C_pls_top = np.where(has_direct, (pi_Fs*np.exp(-tau_clm/mu)*
+                        (((gamma1-(1/mu))*gamma3)+(gamma4*gamma2)))/((lam**2)-(1/(mu**2))), 0)
 
-            C_pls_top[i,:] = (SSA_star[i,:] * np.pi * Fs * np.exp(-tau_clm[i,:]/mu_not)* ((gamma1[i,:] - (1/mu_not))
-                                * gamma3[i,:] + (gamma4[i,:]*gamma2[i,:])))/((lam[1,:]**2)-(1/mu_not**2))
-
-            C_mns_top[i,:] = (SSA_star[i,:] * np.pi * Fs * np.exp(-tau_clm[i,:]/mu_not) * ((gamma1[i,:]+(1/mu_not))
-                                * gamma4[i,:] + (gamma2[i,:]*gamma3[i,:])))/((lam[i,:]**2)-(1/mu_not**2))
-
-        else:
-            # no direct-beam flux:
-            C_pls_btm[i,:] = 0
-            C_mns_btm[i,:] = 0
-            C_pls_top[i,:] = 0
-            C_mns_top[i,:] = 0
+    C_mns_top = np.where(has_direct, (pi_Fs*np.exp(-tau_clm/mu)*
+                        (((gamma1+(1/mu))*gamma4)+(gamma2*gamma3)))/((lam**2)-(1/(mu**2))), 0)
 
 
     # Toon equations 41-43.
     # Boundary values for i=1 and i=2nbr_lyr, specifics for i=odd and i=even
-    # Set up lists
-    A = np.zeros([2*nbr_lyr,nbr_wvl])
-    B = np.zeros([2*nbr_lyr,nbr_wvl])
-    D = np.zeros([2*nbr_lyr,nbr_wvl])
-    E = np.zeros([2*nbr_lyr,nbr_wvl])
+    # Set up lists. The matrix coefficients A, B and D do not depend on the
+    # solar angle; the right hand side E does.
+    A = work.zeros('toon_A', [2*nbr_lyr,nbr_wvl])
+    B = work.zeros('toon_B', [2*nbr_lyr,nbr_wvl])
+    D = work.zeros('toon_D', [2*nbr_lyr,nbr_wvl])
+    E = work.zeros('toon_E', [nbr_ang,2*nbr_lyr,nbr_wvl])
 
     ###########################################
     # Initialize tridiagonal matrix solution
@@ -163,26 +203,26 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
     # expanding the number of layers to 2*nbr_lyr so that fluxes at upper and lower
     # layer boundaries can be resolved. This section was confusing to code - for each layer
     # index (n) a second pair of indices (2 x i) are required. Different solutions are
-    # applied depending upon whether i is even or odd. To translate the indexing for this 
+    # applied depending upon whether i is even or odd. To translate the indexing for this
     # from FORTRAN/MATLAB into Python, it was necessary to assert n = (i/2)-1 for even layers
-    # and n = floor(i/2) for odd layers, with specific rules for the boundaries i = 0 and 
+    # and n = floor(i/2) for odd layers, with specific rules for the boundaries i = 0 and
     # i = nbr_lyrs-1 (i.e. top surface and bottom surface).
 
     for i in np.arange(0,2*nbr_lyr,1):
- 
-        #TOP LAYER    
+
+        #TOP LAYER
         if i==0:
             A[0,:] = 0.0
             B[0,:] = e1[0,:]
             D[0,:] = -e2[0,:]
-            E[0,:] = Fd-C_mns_top[0,:]
+            E[:,0,:] = Fd-C_mns_top[:,0,:]
 
         # BOTTOM LAYER
         elif i== 2*nbr_lyr-1:
             A[i,:] = e1[nbr_lyr-1,:]-(R_sfc * e3[nbr_lyr-1,:])
             B[i,:] = e2[nbr_lyr-1,:]-(R_sfc * e4[nbr_lyr-1,:])
             D[i,:] = 0.0
-            E[i,:] = S_sfc[:] - C_pls_btm[nbr_lyr-1,:] + (R_sfc * C_mns_btm[nbr_lyr-1,:])
+            E[:,i,:] = S_sfc - C_pls_btm[:,nbr_lyr-1,:] + (R_sfc * C_mns_btm[:,nbr_lyr-1,:])
 
 
         # EVEN NUMBERED LAYERS
@@ -191,7 +231,7 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
             A[i,:] = (e2[n,:] * e3[n,:])-(e4[n,:] * e1[n,:])
             B[i,:] = (e1[n,:] * e1[n+1,:])-(e3[n,:] * e3[n+1,:])
             D[i,:] = (e3[n,:] * e4[n+1,:])-(e1[n,:] * e2[n+1,:])
-            E[i,:] = (e3[n,:] * (C_pls_top[n+1,:] - C_pls_btm[n,:])) +  (e1[n,:] * (C_mns_btm[n,:] - C_mns_top[n+1,:]))
+            E[:,i,:] = (e3[n,:] * (C_pls_top[:,n+1,:] - C_pls_btm[:,n,:])) +  (e1[n,:] * (C_mns_btm[:,n,:] - C_mns_top[:,n+1,:]))
 
         # ODD NUMBERED LAYERS
         elif (i%2 ==1) and (i < 2*nbr_lyr-1):
@@ -200,152 +240,170 @@ def toon_solver(APRX_TYP, DELTA, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl, R_sfc, w
             A[i,:] = (e2[n+1,:] * e1[n,:])-(e3[n,:] * e4[n+1,:])
             B[i,:] = (e2[n,:] * e2[n+1,:])-(e4[n,:] * e4[n+1,:])
             D[i,:] = (e1[n+1,:] * e4[n+1,:])-(e2[n+1,:] * e3[n+1,:])
-            E[i,:] = (e2[n+1,:] * (C_pls_top[n+1,:] - C_pls_btm[n,:])) + (e4[n+1,:] * (C_mns_top[n+1,:] - C_mns_btm[n,:]))
+            E[:,i,:] = (e2[n+1,:] * (C_pls_top[:,n+1,:] - C_pls_btm[:,n,:])) + (e4[n+1,:] * (C_mns_top[:,n+1,:] - C_mns_btm[:,n,:]))
 
-    # Now the actual tridiagonal matrix solving. Simply dividing A/B and E/B 
+    # Now the actual tridiagonal matrix solving. Simply dividing A/B and E/B
     # throws an exception due to division by zero. Here we use numpy's nan_to_num
     # function to achieve the division where possible and replace nans with zeros.
     # We also set numpy to ignore the division error.
 
     # for bottom layer only
     # Toon et al Eq 45
-    AS = np.zeros([2*nbr_lyr,nbr_wvl])
-    DS = np.zeros([2*nbr_lyr,nbr_wvl])
-
-    np.seterr(divide='ignore',invalid='ignore')
-    AS[2*nbr_lyr-1,:] = np.nan_to_num(A[2*nbr_lyr-1,:]/B[2*nbr_lyr-1,:])
-    DS[2*nbr_lyr-1,:] = np.nan_to_num(E[2*nbr_lyr-1,:]/B[2*nbr_lyr-1,:])
-
-    # for all layers above bottom layer, starting at second-to-bottom and progressing towards
-    # surface:
-    # Toon et al Eq 46
-    X = np.zeros([nbr_lyr*2,nbr_wvl])
-    for i in np.arange(2*nbr_lyr-2,-1, -1):
-        X[i,:] = 1/(B[i,:]-(D[i,:] * AS[i+1,:]))
-        AS[i,:] = np.nan_to_num(A[i,:]*X[i,:])
-        DS[i,:] = np.nan_to_num((E[i,:]-(D[i,:]*DS[i+1,:]))*X[i,:])
+    AS = work.zeros('toon_AS', [2*nbr_lyr,nbr_wvl])
+    DS = work.zeros('toon_DS', [nbr_ang,2*nbr_lyr,nbr_wvl])
+
+    # the division errors are only ignored within this call (np.errstate), not for the whole process
+    with np.errstate(divide='ignore',invalid='ignore'):
+
+        AS[2*nbr_lyr-1,:] = np.nan_to_num(A[2*nbr_lyr-1,:]/B[2*nbr_lyr-1,:])
+        DS[:,2*nbr_lyr-1,:] = np.nan_to_num(E[:,2*nbr_lyr-1,:]/B[2*nbr_lyr-1,:])
+
+        # for all layers above bottom layer, starting at second-to-bottom and progressing towards
+        # surface:
+        # Toon et al Eq 46
+        X = work.zeros('toon_X', [nbr_lyr*2,nbr_wvl])
+        for i in np.arange(2*nbr_lyr-2,-1, -1):
+            X[i,:] = 1/(B[i,:]-(D[i,:] * AS[i+1,:]))
+            AS[i,:] = np.nan_to_num(A[i,:]*X[i,:])
+            DS[:,i,:] = np.nan_to_num((E[:,i,:]-(D[i,:]*DS[:,i+1,:]))*X[i,:])
 
     # then for all layers, progressing from surface to bottom
     # Toon et al Eq 47
-    Y = np.zeros([nbr_lyr*2,nbr_wvl])
+    Y = work.zeros('toon_Y', [nbr_ang,nbr_lyr*2,nbr_wvl])
 
     for i in np.arange(0,2*nbr_lyr,1):
         if i ==0:
-            Y[0,:] = DS[0,:]
+            Y[:,0,:] = DS[:,0,:]
         else:
-            Y[i,:] = DS[i,:] - (AS[i,:]*Y[i-1,:])
+            Y[:,i,:] = DS[:,i,:] - (AS[i,:]*Y[:,i-1,:])
+
 
-    
     #############################################################
     # CALCULATE DIRECT BEAM FLUX AT BOTTOM OF EACH LAYER
 
-    # loop through layers
-    for i in np.arange(0,nbr_lyr,1):
-
-        # (Toon et al. eq 50)
-        direct[i,:] = mu_not * np.pi * Fs * np.exp(-(tau_clm[i,:] + tau_star[i,:]) / mu_not)
+    # Y at the top (even) and bottom (odd) of each layer: [angle, layer, wavelength]
+    Y_top = Y[:,0::2,:]
+    Y_btm = Y[:,1::2,:]
 
-        # net flux (positive upward = F_up - F_down) at the base of each layer (Toon et al. Eq 48)
-        F_net[i,:] = (Y[2*i,:] * (e1[i,:]-e3[i,:])) + (Y[2*i+1,:] * (e2[i,:] - e4[i,:])) + C_pls_btm[i,:] - C_mns_btm[i,:] - direct[i,:]
+    # (Toon et al. eq 50)
+    direct = mu * np.pi * Fs[:,None,:] * np.exp(-(tau_clm + tau_star) / mu)
 
-        # mean intensity at the base of each layer (Toon et al. Eq 49)
-        intensity[i,:] = (1/mu_one) * (Y[2*i,:] * (e1[i,:] + e3[i,:]) + Y[2*i+1,:] * (e2[i,:] + e4[i,:]) + C_pls_btm[i,:] + C_mns_btm[i,:]) + (direct[i,:]/mu_not)
-        intensity[i, :] = intensity[i, :] / (4 * np.pi)
+    # net flux (positive upward = F_up - F_down) at the base of each layer (Toon et al. Eq 48),
+    # or only of the bottom layer if the per-layer outputs are not needed
+    b = slice(None) if per_layer or transfer else slice(nbr_lyr-1, None)
+    F_net = (Y_top[:,b] * (e1[b]-e3[b])) + (Y_btm[:,b] * (e2[b] - e4[b])) + C_pls_btm[:,b] - C_mns_btm[:,b] - direct[:,b]
 
     # Upward flux at upper model boundary (Toon et al Eq 31)
-    F_top_pls = (Y[0,:] * (np.exp(-lam[0,:] * tau_star[0,:]) + GAMMA[0,:])) + (Y[1,:] * (np.exp(-lam[0,:] * tau_star[0,:])-GAMMA[0,:])) + C_pls_top[0,:]
+    F_top_pls = (Y[:,0,:] * (np.exp(-lam[0,:] * tau_star[0,:]) + GAMMA[0,:])) + (Y[:,1,:] * (np.exp(-lam[0,:] * tau_star[0,:])-GAMMA[0,:])) + C_pls_top[:,0,:]
+
+    # The mean intensities (Toon et al. Eq 49) are not outputs of the solver, so they are not
+    # calculated; the upward and downward fluxes at each interface are only needed for transfer
+
+    if transfer:
 
-    for i in np.arange(0,nbr_lyr,1):
         # Upward flux at the bottom of each layer interface (Toon et al. Eq31)
-        F_up[i,:] = Y[2*i,:] * (np.exp(0) + GAMMA[i,:] * np.exp(-lam[i,:] * tau_star[i,:])) + Y[2*i+1,:] * (np.exp(0) - GAMMA[i,:] * np.exp(-lam[i,:] * tau_star[i,:])) + C_pls_btm[i,:]
+        F_up = Y_top * (np.exp(0) + GAMMA * np.exp(-lam * tau_star)) + Y_btm * (np.exp(0) - GAMMA * np.exp(-lam * tau_star)) + C_pls_btm
 
         # Downward flux at the bottom of each layer interface (Toon et al. Eq32) plus direct beam component
-        F_down[i,:] = Y[2*i,:] * (GAMMA[i,:] * np.exp(0) + np.exp(-lam[i,:] * tau_star[i,:])) + Y[2*i+1,:] * (GAMMA[i,:] * np.exp(0) - np.exp(-lam[i,:] * tau_star[i,:])) + C_mns_btm[i,:] + direct[i,:]
+        F_down = Y_top * (GAMMA * np.exp(0) + np.exp(-lam * tau_star)) + Y_btm * (GAMMA * np.exp(0) - np.exp(-lam * tau_star)) + C_mns_btm + direct
 
-        # Derived net (upward-downward) flux (should equal F_net)
-        F_net2[i,:] = F_up[i,:] - F_down[i,:]
+        # fluxes at the surface followed by the bottom of each layer
+        up = np.concatenate([F_top_pls[:,None,:], F_up], axis=1)
+        down = np.concatenate([((mu_not[:,None] * np.pi * Fs) + Fd)[:,None,:], F_down], axis=1)
+        n = nbr_ang//2
 
-        intensity2[i,:] = F_up[i,:] + F_down[i,:]
+        transfer = collections.namedtuple("transfer", "dir_up, dir_down, dir_net, dif_up, dif_down, dif_net")
+        out = [up[:n], down[:n], up[:n]-down[:n], up[n:], down[n:], up[n:]-down[n:]]
 
-    # surface planar intensity
-    intensity2_top[:] = F_top_pls + ((mu_not * np.pi * Fs) + Fd)
+        if single_angle:
+            out = [x[0] for x in out]
+
+        return wvl, transfer(*out)
 
     # Net flux at lower model boundary = bulk transmission through entire media
     # = energy absorbed by underlying surface
-    F_btm_net[0,:] = -F_net[nbr_lyr-1,:]
+    F_btm_net[:,:] = -F_net[:,-1,:]
+
 
-    
     # Hemispheric wavelength-dependent albedo
-    albedo = F_top_pls/ ((mu_not * np.pi * Fs)+ Fd)
+    albedo = F_top_pls/ ((mu_not[:,None] * np.pi * Fs)+ Fd)
 
     # Net flux at upper model boundary
-    F_top_net[0,:] = F_top_pls - ((mu_not * np.pi * Fs) + Fd)
-
-    # absorbed flux in each layer (negative if there is net emission (bnd_typ = 4))
-    for i in np.arange(0,nbr_lyr,1):
-        if i ==0:
-            F_abs[0,:] = F_net[0,:]-F_top_net
-        else:
-            F_abs[i,:] = F_net[i,:] - F_net[i-1,:]
+    F_top_net[:,:] = F_top_pls - ((mu_not[:,None] * np.pi * Fs) + Fd)
 
     # set indices for constraining calculations to VIS and NIR bands
-    vis_max_idx = 39
-    nir_max_idx = len(wvl)
+    grid = SpectralGrid.default()
+    vis_max_idx = grid.vis_max_idx
+    nir_max_idx = grid.nir_max_idx
 
-    # Spectrally-integrated absorption in each layer:
-    abs_slr = np.sum(F_abs,axis=1)
+    abs_slr = heat_rt = None
 
-    for i in np.arange(0,nbr_lyr,1):
-        abs_vis[i] = np.sum(F_abs[i,0:vis_max_idx])
-        abs_nir[i] = np.sum(F_abs[i,vis_max_idx:nir_max_idx])
+    if per_layer:
 
-    # Spectrally - integrated absorption by underlying surface:
-    abs_slr_btm = sum(np.squeeze(F_btm_net))
-    abs_vis_btm = sum(np.squeeze(F_btm_net[0:vis_max_idx]))
-    abs_nir_btm = sum(np.squeeze(F_btm_net[0,vis_max_idx:nir_max_idx]))
+        # absorbed flux in each layer (negative if there is net emission (bnd_typ = 4))
+        F_abs = np.diff(F_net, axis=1, prepend=F_top_net[:,None,:])
 
-    # Calculate radiative heating rate in kelvin per second.
-    # Multiply by 3600 to convert to K per hour
-    # specfic heta capacity of ice = 2117 J kg-1 K-1
-    heat_rt = abs_slr / (L_snw * 2117) # [K / s]
-    heat_rt = heat_rt * 3600 # [K / hr]
+        # Spectrally-integrated absorption in each layer:
+        abs_slr = np.sum(F_abs,axis=2)
+
+        # Calculate radiative heating rate in kelvin per second.
+        # Multiply by 3600 to convert to K per hour
+        # specfic heta capacity of ice = 2117 J kg-1 K-1
+        heat_rt = abs_slr / (np.asarray(L_snw) * 2117) # [K / s]
+        heat_rt = heat_rt * 3600 # [K / hr]
+
+        F_abs_col = np.sum(F_abs,axis=1)
+
+    else:
+        # absorption by the whole column from the net fluxes at its top and bottom
+        F_abs_col = F_net[:,-1,:] - F_top_net
 
     # Energy conservation check:
     # % Incident direct + diffuse radiation equals(absorbed + transmitted + bulk_reflected)
-    energy_sum = (mu_not * np.pi * Fs) + Fd - (sum(F_abs) + F_btm_net + F_top_pls)
+    energy_sum = (mu_not[:,None] * np.pi * Fs) + Fd - (F_abs_col + F_btm_net + F_top_pls)
 
     # spectrally-integrated terms:
     # energy conservation total error
-    energy_error = abs(np.sum(energy_sum))
+    energy_error = abs(np.sum(energy_sum,axis=1))
 
-    if energy_error > 1e-10:
-        energy_conservation_error = np.sum(abs(energy_sum))
+    for energy_conservation_error in np.sum(abs(energy_sum),axis=1)[energy_error > 1e-10]:
         print(f"CONSERVATION OF ENERGY ERROR OF {energy_conservation_error}")
 
     ######################################
     # Re-alias results for outputting
     ######################################
 
-    # total incident insolation(Wm - 2)
-    total_insolation = np.sum((mu_not * np.pi * Fs) + Fd)
+    # Spectrally - integrated solar, visible, and NIR albedos:
+    BBA = BBAVIS = BBANIR = abs_vis_tot = None
 
-    # energy absorbed by all snow layers
-    abs_slr_tot = np.sum(np.sum(F_abs))
+    if wanted('BBA'):
+        BBA = np.sum(flx_slr * albedo,axis=1) / np.sum(flx_slr,axis=1)
 
-    # energy absorbed by underlying substrate
-    energy_abs_under_sfc = np.sum(F_btm_net)
+    if wanted('BBAVIS'):
+        BBAVIS = np.sum(flx_slr[:,0:vis_max_idx]*albedo[:,0:vis_max_idx],axis=1)/ np.sum(flx_slr[:,0:vis_max_idx],axis=1)
 
-    # Spectrally - integrated solar, visible, and NIR albedos:
-    BBA = np.sum(flx_slr * albedo) / np.sum(flx_slr)
+    if wanted('BBANIR'):
+        BBANIR = np.sum(flx_slr[:,vis_max_idx:nir_max_idx]*albedo[:,vis_max_idx: nir_max_idx],axis=1) / np.sum(flx_slr[:,vis_max_idx:nir_max_idx],axis=1)
+
+    # % Spectrally - integrated VIS total snowpack absorption:
+    if wanted('abs_vis_tot'):
+        abs_vis_tot = np.sum(flx_slr[:,0:vis_max_idx]*(1 - albedo[:,0:vis_max_idx]),axis=1)
+
+    if single_angle:
+
+        # F_btm_net keeps its leading axis of length 1, as it always has for a single angle
+        albedo, BBA, BBAVIS, BBANIR, abs_slr, abs_vis_tot, heat_rt, F_top_pls = \
+            [None if x is None else x[0] for x in (albedo, BBA, BBAVIS, BBANIR, abs_slr, abs_vis_tot, heat_rt, F_top_pls)]
 
-    BBAVIS = sum(flx_slr[0:vis_max_idx]*albedo[0:vis_max_idx])/ sum(flx_slr[0:vis_max_idx])
+    if out is not None:
 
-    BBANIR = sum(flx_slr[vis_max_idx:nir_max_idx]*albedo[vis_max_idx: nir_max_idx]) / sum(flx_slr[vis_max_idx:nir_max_idx])
+        # write the spectral outputs into the caller's buffers
+        values = {'albedo': albedo, 'F_btm_net': F_btm_net, 'F_top_pls': F_top_pls}
 
-    # % Spectrally - integrated VIS and NIR total snowpack absorption:
-    abs_vis_tot = sum(flx_slr[0:vis_max_idx]*(1 - albedo[0:vis_max_idx]))
-    abs_nir_tot = sum(flx_slr[vis_max_idx:nir_max_idx]*(1 - albedo[vis_max_idx:nir_max_idx]))
+        for name, buffer in out.items():
+            np.copyto(buffer, values[name])
 
+        albedo, F_btm_net, F_top_pls = [out.get(name, values[name]) for name in ('albedo', 'F_btm_net', 'F_top_pls')]
 
 
-    return wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, abs_vis_tot, heat_rt, F_btm_net, F_top_pls
\ No newline at end of file
+    return wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, abs_vis_tot, heat_rt, F_btm_net, F_top_pls
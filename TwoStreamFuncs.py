@@ -1,65 +1,136 @@
+import collections
+
+# run parameters (see TwoStreamFuncs.generate_ice_physical_params). Instances are immutable, hashable and
+# picklable, so they can be shared between threads and sent to worker processes; use _replace to change a field.
+Params = collections.namedtuple("Params", "rho_layers, grain_rds, layer_type, dz, mss_cnc_glacier_algae, solzen, incoming_i,"\
+    " DIRECT, cache_dir, cache_size, dir_base")
+
 
 class TwoStreamFuncs:
+
+    DIR_BASE = '/home/joe/Code/BioSNICAR_GO_PY/' # location of the BioSNICAR_GO_PY folder, unless set in params
+    OUTPUTS = ('albedo', 'BBA', 'F_btm_net', 'F_top_pls') # solver outputs returned by call_snicar
     
     def __init__(self):
 
 
         return
 
-    def generate_ice_physical_params(density,grain_rds,layer_type,dz,algae,solzen, incoming_i, DIRECT):
+    def generate_ice_physical_params(density,grain_rds,layer_type,dz,algae,solzen, incoming_i, DIRECT, cache_dir=None,\
+        cache_size=2e9, dir_base=None):
 
         """
-        takes user-defined params and collects them into a named tuple for passing to call_snicar()
+        takes user-defined params, checks them and collects them into an immutable named tuple
+        (Params) for passing to call_snicar(). Lists (one value per layer) are stored as tuples, so
+        params can be hashed and compared by value. Invalid values raise a ValueError.
+
+        if cache_dir is set, column solves and hole floor results are cached on disk there (see
+        CacheFuncs), up to cache_size bytes
+
+        dir_base is the location of the BioSNICAR_GO_PY folder holding the optical property and
+        irradiance files (default DIR_BASE)
         
         """
 
-        import collections
+        import numpy as np
+
+        density, grain_rds, layer_type, dz = (TwoStreamFuncs._freeze(np.atleast_1d(x))\
+            for x in (density, grain_rds, layer_type, dz))
+
+        n_layers = len(dz)
+
+        if n_layers == 0 or not (len(density) == len(grain_rds) == len(layer_type) == n_layers):
+            raise ValueError("ERROR: density, grain_rds, layer_type and dz need one value per layer"\
+                " (got {}, {}, {} and {})".format(len(density), len(grain_rds), len(layer_type), n_layers))
+
+        if min(dz) <= 0 or min(density) <= 0 or min(grain_rds) <= 0:
+            raise ValueError("ERROR: layer thickness, density and grain radius must be greater than zero")
+
+        algae = TwoStreamFuncs._freeze(algae)
+
+        if np.ndim(algae) > 0 and len(algae) != n_layers:
+            raise ValueError("ERROR: algae needs one value, or one value per layer")
+
+        if np.min(algae) < 0:
+            raise ValueError("ERROR: algae concentration cannot be negative")
+
+        solzen = TwoStreamFuncs._freeze(solzen)
+
+        if np.min(solzen) <= 0 or np.max(solzen) >= 90:
+            raise ValueError("ERROR: solar zenith must be between 0 and 90 degrees")
+
+        if incoming_i not in range(7):
+            raise ValueError("ERROR: incoming_i must be 0 - 6 (atmospheric profile)")
 
-        params = collections.namedtuple("params","rho_layers, grain_rds, layer_type, dz, mss_cnc_glacier_algae, solzen")
-        params.grain_rds = grain_rds
-        params.rho_layers = density
-        params.layer_type = layer_type
-        params.dz = dz
-        params.mss_cnc_glacier_algae = algae
-        params.solzen = solzen
-        params.incoming_i = incoming_i
-        params.DIRECT = DIRECT
+        return Params(density, grain_rds, layer_type, dz, algae, solzen, int(incoming_i), TwoStreamFuncs._freeze(DIRECT),\
+            cache_dir, cache_size, dir_base)
 
-        return params
 
+    def _freeze(x):
 
-    def generate_incoming_irradiance(params):
+        # returns sequences (lists, arrays) as tuples of Python numbers and numbers as Python numbers
 
-        import xarray as xr
+        import numpy as np
+
+        value = np.asarray(x).tolist()
+
+        return tuple(value) if isinstance(value, list) else value
+
+
+    def data_dir(params):
+
+        """
+        Returns the location of the BioSNICAR_GO_PY folder for params (params.dir_base if set,
+        otherwise DIR_BASE)
+
+        """
+
+        dir_base = getattr(params, 'dir_base', None)
+
+        return TwoStreamFuncs.DIR_BASE if dir_base is None else dir_base
+
+
+    def generate_incoming_irradiance(params, trim=True):
+
+        """
+        Returns the spectral irradiance (W m-2 per band) for params.incoming_i, params.DIRECT and
+        params.solzen. By default the bands below the model grid WL are removed; trim=False returns
+        all 480 SNICAR bands.
+
+        """
+
+        import numpy as np
+        from IOFuncs import IOFuncs
+        from SpectralGrid import SpectralGrid
 
         incoming_i = params.incoming_i
         DIRECT = params.DIRECT
         solzen = params.solzen 
 
-        dir_fsds = '/home/joe/Code/BioSNICAR_GO_PY/Data/Mie_files/480band/fsds/'
+        dir_fsds = TwoStreamFuncs.data_dir(params) + 'Data/Mie_files/480band/fsds/'
         zen = str('SZA'+str(solzen).rjust(2,'0'))
         
         if DIRECT:
             if incoming_i == 0:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mlw_clr_"+zen+".nc")) 
+                path = str(dir_fsds + "swnb_480bnd_mlw_clr_"+zen+".nc") 
                 
             elif incoming_i == 1:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mls_clr_"+zen+".nc"))
+                path = str(dir_fsds + "swnb_480bnd_mls_clr_"+zen+".nc")
                 
             elif incoming_i == 2:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_saw_clr_"+zen+".nc"))
+                path = str(dir_fsds + "swnb_480bnd_saw_clr_"+zen+".nc")
                 
             elif incoming_i == 3:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_sas_clr_"+zen+".nc"))
+                path = str(dir_fsds + "swnb_480bnd_sas_clr_"+zen+".nc")
                 
             elif incoming_i == 4:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_smm_clr_"+zen+".nc"))
+                path = str(dir_fsds + "swnb_480bnd_smm_clr_"+zen+".nc")
                 
             elif incoming_i == 5:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_hmn_clr_"+zen+".nc"))
+                path = str(dir_fsds + "swnb_480bnd_hmn_clr_"+zen+".nc")
                 
             elif incoming_i == 6:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_toa_clr.nc"))
+                path = str(dir_fsds + "swnb_480bnd_toa_clr.nc")
 
             else:
                 raise ValueError ("Invalid choice of atmospheric profile")
@@ -68,50 +139,167 @@ class TwoStreamFuncs:
         else:
 
             if incoming_i == 0:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mlw_cld.nc"))
+                path = str(dir_fsds + "swnb_480bnd_mlw_cld.nc")
             elif incoming_i == 1:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_mls_cld.nc"))
+                path = str(dir_fsds + "swnb_480bnd_mls_cld.nc")
             elif incoming_i == 2:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_saw_cld.nc"))
+                path = str(dir_fsds + "swnb_480bnd_saw_cld.nc")
             elif incoming_i == 3:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_sas_cld.nc"))
+                path = str(dir_fsds + "swnb_480bnd_sas_cld.nc")
             elif incoming_i == 4:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_smm_cld.nc"))
+                path = str(dir_fsds + "swnb_480bnd_smm_cld.nc")
             elif incoming_i == 5:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_hmn_cld.nc"))   
+                path = str(dir_fsds + "swnb_480bnd_hmn_cld.nc")   
             elif incoming_i == 6:
-                Incoming_file = xr.open_dataset(str(dir_fsds + "swnb_480bnd_toa_cld.nc"))
+                path = str(dir_fsds + "swnb_480bnd_toa_cld.nc")
 
             else:
                 raise ValueError ("Invalid choice of atmospheric profile") 
 
 
         #flx_dwn_sfc is the spectral irradiance in W m-2 and is pre-calculated (flx_frc_sfc*flx_bb_sfc in original code)
-        incoming = Incoming_file['flx_dwn_sfc'].values 
+        incoming = np.array(IOFuncs.read_many({'flx': (path, ['flx_dwn_sfc'])})['flx']['flx_dwn_sfc'])
         incoming[incoming<=0]=1e-30
-        incoming = incoming[10:]
+        if trim:
+            incoming = SpectralGrid.default().to_model(incoming)
 
         return incoming
 
 
-    def call_snicar(params):
+    def incident_flux(params, incoming_i=None, DIRECT=None):
+
+        """
+        Returns the direct and diffuse spectral flux (480 bands) incident at the top of the SNICAR column
+        for an atmospheric profile, in the form used by snicar_feeder, so that applying them to transfer
+        functions (see apply_transfer) reproduces call_snicar. incoming_i and DIRECT default to the values
+        in params and can be set here to load other profiles or sky conditions without a new params.
+
+        """
+
+        import numpy as np
+
+        incoming_i = params.incoming_i if incoming_i is None else incoming_i
+        DIRECT = params.DIRECT if DIRECT is None else DIRECT
+
+        profile = TwoStreamFuncs.generate_ice_physical_params(params.rho_layers, params.grain_rds, params.layer_type,\
+            params.dz, params.mss_cnc_glacier_algae, params.solzen, incoming_i, DIRECT, dir_base=TwoStreamFuncs.data_dir(params))
+
+        flx_slr = TwoStreamFuncs.generate_incoming_irradiance(profile, trim=False)
+        mu_not = np.round((np.cos(params.solzen * (np.pi / 180))),2)
+
+        if DIRECT:
+            return flx_slr, np.zeros(len(flx_slr))
+
+        else:
+            return np.zeros(len(flx_slr)), flx_slr/mu_not*np.pi
+
+
+    def apply_transfer(transfer, direct, diffuse, cloud_fraction=None):
+
+        """
+        Applies unit-illumination transfer functions (from call_snicar(params, transfer=True)) to
+        incident direct and diffuse flux (e.g. from incident_flux). direct and diffuse can hold any
+        number of spectra as long as the last axis is wavelength, e.g. [n_spectra, 480], so many
+        profiles or times are one array product instead of one SNICAR run each.
+
+        If cloud_fraction (a number or 1D array) is given, the sky is a mix of the two: direct is
+        weighted by 1 - cloud_fraction and diffuse by cloud_fraction, and the outputs gain a leading
+        cloud fraction axis when cloud_fraction is an array.
+
+        Returns a named tuple of up, down and net flux at each layer interface (shape
+        [..., nbr_lyr+1, nbr_wvl]), spectral albedo, F_top_pls and F_btm_net (as returned by call_snicar).
+
+        """
 
-        from SNICAR_feeder import snicar_feeder
+        import collections
+        import numpy as np
 
-    	# set dir_base to the location of the BioSNICAR_GO_PY folder
+        direct = np.asarray(direct, dtype=float)[...,None,:]
+        diffuse = np.asarray(diffuse, dtype=float)[...,None,:]
+
+        if cloud_fraction is not None:
+            cloud_fraction = np.asarray(cloud_fraction, dtype=float)
+            cloud_fraction = cloud_fraction.reshape(cloud_fraction.shape + (1,)*max(direct.ndim, diffuse.ndim))
+            direct = (1-cloud_fraction)*direct
+            diffuse = cloud_fraction*diffuse
+
+        up = direct*transfer.dir_up + diffuse*transfer.dif_up
+        down = direct*transfer.dir_down + diffuse*transfer.dif_down
+        net = up - down
+
+        fluxes = collections.namedtuple("fluxes", "up, down, net, albedo, F_top_pls, F_btm_net")
+
+        return fluxes(up, down, net, up[...,0,:]/down[...,0,:], up[...,0,:], -net[...,-1,:])
+
+
+    def call_snicar(params, transfer=False, prefetch=False, workspace=None, solver=None, dz_sweep=None):
+
+        """
+        Runs SNICAR for the ice column in params and returns albedo, BBA, F_btm_net and F_top_pls.
+
+        If transfer is True the solver instead returns the column's transfer functions per unit
+        incident direct and diffuse flux (see apply_transfer), which do not depend on the
+        irradiance profile or sky condition.
+
+        If prefetch is True nothing is solved: the input files for params start loading in the
+        background (see IOFuncs) so that a later call with the same files does not wait for them,
+        and None is returned.
+
+        workspace is the SolverWorkspace holding the solver's intermediate arrays (default: the
+        workspace of the current thread).
+
+        Only the outputs returned (OUTPUTS) are calculated by the solver; the heating rates,
+        VIS/NIR albedos and per-layer absorption are skipped.
+
+        solver is 'toon' or 'adding_doubling' (see SNICAR_feeder.SOLVERS). By default the faster
+        solver that is valid for the column is used: Toon for columns of granular layers only,
+        adding-doubling for columns with solid ice layers (SNICAR_feeder.select_solver). The
+        outputs have the same shapes for both solvers.
+
+        dz_sweep can be a list of layer thicknesses (each in place of params.dz) for which the column
+        is solved together (see SNICAR_feeder, DZ_SWEEP); a list with the result for each is then
+        returned and nothing is cached. Use call_snicar_sweep, which also caches each column.
+
+        """
+
+        import collections
+        import numpy as np
+        from SNICAR_feeder import snicar_feeder, select_solver, SOLVERS
+
+        if solver is not None and solver not in SOLVERS:
+            raise ValueError(f"ERROR: unknown solver '{solver}', expected one of {SOLVERS}")
+
+    	# location of the BioSNICAR_GO_PY folder
+
+        dir_base = TwoStreamFuncs.data_dir(params)
+
+        cache_dir = getattr(params, 'cache_dir', None)
+
+        if cache_dir is not None and dz_sweep is None:
+
+            from CacheFuncs import CacheFuncs
+
+            key = CacheFuncs.key('column', CacheFuncs.column_inputs(params), transfer,\
+                select_solver(params.layer_type) if solver is None else solver, data_dirs=CacheFuncs.data_dirs(params))
+            cached = CacheFuncs.get(cache_dir, key)
+
+            if cached is not None:
+                if prefetch:
+                    return None
+                return collections.namedtuple("transfer", "dir_up, dir_down, dir_net, dif_up, dif_down, dif_net")(*cached)\
+                    if transfer else cached
 
-        dir_base = '/home/joe/Code/BioSNICAR_GO_PY/'
         savepath = dir_base # base path for saving figures
         
-        TOON = False # toggle Toon et al tridiagonal matrix solver
-        ADD_DOUBLE = True # toggle adding-doubling solver
+        TOON = None if solver is None else solver == 'toon' # toggle Toon et al tridiagonal matrix solver (None: chosen by snicar_feeder)
+        ADD_DOUBLE = None if solver is None else solver == 'adding_doubling' # toggle adding-doubling solver
         layer_type = params.layer_type
-        DIRECT   = 1        # 1= Direct-beam incident flux, 0= Diffuse incident flux
+        DIRECT   = params.DIRECT        # 1= Direct-beam incident flux, 0= Diffuse incident flux
         APRX_TYP = 1        # 1= Eddington, 2= Quadrature, 3= Hemispheric Mean
         DELTA    = 1        # 1= Apply Delta approximation, 0= No delta
-        solzen   = params.solzen      # if DIRECT give solar zenith angle (degrees from 0 = nadir, 90 = horizon)
+        solzen   = params.solzen      # if DIRECT give solar zenith angle (degrees from 0 = nadir, 90 = horizon), or a list of angles to solve together
         rf_ice = 2        # define source of ice refractive index data. 0 = Warren 1984, 1 = Warren 2008, 2 = Picard 2016
-        incoming_i = 4
+        incoming_i = params.incoming_i
         nbr_lyr = len(params.dz)  # number of snow layers
         R_sfc = 0.15 # reflectance of underlying surface - set across all wavelengths
         rwater = [0]*len(params.dz) # if  using Mie calculations, add radius of optional liquid water coating
@@ -195,8 +383,7 @@ class TwoStreamFuncs:
         #######################################
 
             
-        [wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, heat_rt, F_btm_net, F_top_pls] =\
-        snicar_feeder(dir_base,\
+        outputs = snicar_feeder(dir_base,\
         rf_ice, incoming_i, DIRECT, layer_type,\
         APRX_TYP, DELTA, solzen, TOON, ADD_DOUBLE, R_sfc, dz, rho_layers, grain_rds,\
         side_length, depth, rwater, nbr_lyr, nbr_aer, grain_shp, shp_fctr, grain_ar,\
@@ -211,6 +398,101 @@ class TwoStreamFuncs:
         FILE_ash1, FILE_ash2, FILE_ash3, FILE_ash4, FILE_ash5, FILE_ash_st_helens, FILE_Skiles_dust1, FILE_Skiles_dust2,\
         FILE_Skiles_dust3, FILE_Skiles_dust4, FILE_Skiles_dust5, FILE_GreenlandCentral1,\
         FILE_GreenlandCentral2, FILE_GreenlandCentral3, FILE_GreenlandCentral4, FILE_GreenlandCentral5,\
-        FILE_Cook_Greenland_dust_L, FILE_Cook_Greenland_dust_C, FILE_Cook_Greenland_dust_H, FILE_snw_alg, FILE_glacier_algae)
+        FILE_Cook_Greenland_dust_L, FILE_Cook_Greenland_dust_C, FILE_Cook_Greenland_dust_H, FILE_snw_alg, FILE_glacier_algae,\
+        TRANSFER=transfer, PREFETCH=prefetch, WORKSPACE=workspace, OUTPUTS=TwoStreamFuncs.OUTPUTS, DZ_SWEEP=dz_sweep)
+
+        if prefetch:
+            return None
+
+        if dz_sweep is not None:
+            [wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, heat_rt, F_btm_net, F_top_pls] = outputs
+            return [(albedo[k], BBA[k], F_btm_net[k], F_top_pls[k]) for k in range(len(dz_sweep))]
+
+        if transfer:
+            wvl, result = outputs
+
+        else:
+            [wvl, albedo, BBA, BBAVIS, BBANIR, abs_slr, heat_rt, F_btm_net, F_top_pls] = outputs
+
+            # the Toon solver keeps a leading axis of length 1 on F_btm_net for a single angle
+            result = (albedo, BBA, np.reshape(F_btm_net, np.shape(albedo)), F_top_pls)
+
+        if cache_dir is not None and dz_sweep is None:
+            CacheFuncs.put(cache_dir, key, tuple(result), params.cache_size)
+
+        return result
+
+
+    def call_snicar_sweep(params, thicknesses, solver=None, block=256):
+
+        """
+        Solves the column in params for every layer thicknesses in thicknesses (each a list with
+        one value per layer in m, or a number for single-layer columns) and returns a list with
+        the result of call_snicar for each, as if params.dz had been set to them.
+
+        Depth sweeps (e.g. dz = [hole_d/100] for every hole of a survey) otherwise solve one full
+        column per depth. Here the files are read once and up to block columns are solved
+        together in one solver call (see SNICAR_feeder.solve_sweep); the results are the same as
+        from call_snicar. Columns found in the cache of params are not solved again and the others
+        are added to it.
+
+        """
+
+        import numpy as np
+        from SNICAR_feeder import select_solver, SOLVERS
+
+        if solver is not None and solver not in SOLVERS:
+            raise ValueError(f"ERROR: unknown solver '{solver}', expected one of {SOLVERS}")
+
+        dzs = [TwoStreamFuncs._freeze(np.atleast_1d(np.asarray(d, dtype=float))) for d in thicknesses]
+
+        if any(len(dz) != len(params.dz) for dz in dzs) or (dzs and min(min(dz) for dz in dzs) <= 0):
+            raise ValueError("ERROR: each thickness needs one value per layer of params, greater than zero")
+
+        cache_dir = getattr(params, 'cache_dir', None)
+        results = [None]*len(dzs)
+        keys = {}
+
+        if cache_dir is not None:
+
+            from CacheFuncs import CacheFuncs
+
+            for i, dz in enumerate(dzs):
+                keys[i] = CacheFuncs.key('column', CacheFuncs.column_inputs(params._replace(dz=dz)), False,\
+                    select_solver(params.layer_type) if solver is None else solver, data_dirs=CacheFuncs.data_dirs(params))
+                results[i] = CacheFuncs.get(cache_dir, keys[i])
+
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        for start in range(0, len(missing), block):
+
+            chunk = missing[start:start+block]
+
+            for i, result in zip(chunk, TwoStreamFuncs.call_snicar(params, solver=solver, dz_sweep=[dzs[i] for i in chunk])):
+
+                results[i] = result
+
+                if cache_dir is not None:
+                    CacheFuncs.put(cache_dir, keys[i], result, params.cache_size)
+
+        return results
+
+
+    def call_snicar_batch(params_list, transfer=False):
+
+        """
+        Runs call_snicar for every params in params_list and returns a list of the results. The
+        input files for the next column are read in the background while the current one is solved.
+
+        """
+
+        results = []
+
+        for i, params in enumerate(params_list):
+
+            if i + 1 < len(params_list):
+                TwoStreamFuncs.call_snicar(params_list[i+1], prefetch=True)
+
+            results.append(TwoStreamFuncs.call_snicar(params, transfer))
 
-        return albedo, BBA, F_btm_net, F_top_pls
+        return results
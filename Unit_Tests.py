@@ -194,8 +194,867 @@ def check_internal_reflections(nAir, kAir, nWat, kWat, WL):
 
     return
 
+
+def check_hole_population():
+
+    """
+    checks that the nodes of each distribution have weights summing to 1 and reproduce its known mean
+    and variance (Gaussian quadrature) or mean (stratified sampling), that hole_population combines them
+    into a table with the same moments, and that integrating a population of a single hole gives the
+    hole_fluxes result for that hole
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from SurfaceFuncs import SurfaceFuncs
+    from HoleDistFuncs import HoleDistFuncs
+    from SpectralGrid import SpectralGrid
+
+    width = HoleDistFuncs.parametric('lognormal', median=0.2, sigma=0.3)
+    depth = HoleDistFuncs.parametric('normal', mean=0.1, sd=0.02)
+    water_fraction = HoleDistFuncs.parametric('uniform', low=0, high=1)
+
+    # distribution, number of nodes, mean, variance (None if not reproduced) and relative tolerance
+    cases = [(width, 5, 0.2*np.exp(0.3**2/2), 0.2**2*np.exp(0.3**2)*(np.exp(0.3**2)-1), 1e-5),
+        (depth, 5, 0.1, 0.02**2, 1e-12), (water_fraction, 5, 0.5, 1/12, 1e-12),
+        (HoleDistFuncs.parametric('gamma', shape=2, scale=0.05), 20, 0.1, None, 2e-2)]
+
+    for dist, n_nodes, mean, variance, tolerance in cases:
+
+        values, weights = HoleDistFuncs.nodes(dist, n_nodes)
+        node_mean = np.sum(weights*values)
+
+        assert abs(np.sum(weights) - 1) < 1e-12, f"{dist.kind}: weights do not sum to 1"
+        assert abs(node_mean - mean) < tolerance*mean, f"{dist.kind}: nodes do not reproduce the mean"
+        assert variance is None or abs(np.sum(weights*(values-node_mean)**2) - variance) < tolerance*variance,\
+            f"{dist.kind}: nodes do not reproduce the variance"
+
+    population = HoleDistFuncs.hole_population(width, depth, water_fraction, n_nodes=5)
+
+    assert abs(np.sum(population.weight) - 1) < 1e-12, "population weights do not sum to 1"
+    assert abs(np.sum(population.weight*population.hole_w) - cases[0][2]) < 1e-5*cases[0][2], "population width mean differs"
+    assert abs(np.sum(population.weight*population.hole_d) - 0.1) < 1e-12, "population depth mean differs"
+    assert abs(np.sum(population.weight*population.hole_water_d) - 0.1*0.5) < 1e-12, "population water depth mean differs"
+
+    WL = SpectralGrid.default().WL
+    cryoconite_albedo = np.full(len(WL), 0.2)
+    params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [0.1], 0, 45, 4, True)
+
+    single, n_holes = HoleDistFuncs.discrete_population([0.1], [0.3], [0.02], [5])
+    expected = SurfaceFuncs.integrate_population(single, cryoconite_albedo, WL, params, 1e-10)
+    hole = SurfaceFuncs.hole_fluxes(0.1, 0.3, 0.02, cryoconite_albedo, WL, params, 1e-10)
+    area = np.pi*0.15**2
+
+    assert n_holes == 5 and abs(expected.area - area) < 1e-12*area, "single-hole population has the wrong area"
+    assert all(np.allclose(x, area*y, rtol=1e-12, atol=0) for x, y in ((expected.absorbed, hole.absorbed),\
+        (expected.escaping, hole.escaping), (expected.reflected_from_water_surface, hole.reflected_from_water_surface))),\
+        "integrating a single-hole population differs from hole_fluxes"
+
+    print("*** Hole population unit tests passed successfully ***")
+
+    return
+
+
+def check_surface_maps():
+
+    """
+    checks the tiled raster maps against hole_fluxes and call_snicar run for each pixel on its own. The
+    map includes pixels with holes smaller than 5 mm, pixels without hole geometry (bare ice) and a
+    pixel without data, and is split into several tiles.
+
+    """
+
+    import xarray as xr
+    from TwoStreamFuncs import TwoStreamFuncs
+    from SurfaceFuncs import SurfaceFuncs
+    from RasterFuncs import RasterFuncs
+    from SpectralGrid import SpectralGrid
+
+    grid = SpectralGrid.default()
+    WL = grid.WL
+    hole_fraction = np.array([[0.1, 0.2, 0.0], [0.15, 0.1, np.nan]])
+    hole_w = np.array([[0.2, 0.004, 0.0], [0.014, 0.0, 0.2]])
+    hole_d = np.array([[0.1, 0.003, 0.0], [0.012, 0.1, 0.1]])
+    water_fraction = 0.2
+    cryoconite_albedo = np.full(len(WL), 0.2)
+
+    params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [0.5], 0, 45, 4, True)
+    incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+    ice_up = grid.to_model(TwoStreamFuncs.call_snicar(params)[3])
+
+    maps = [xr.DataArray(x, dims=['y', 'x']) for x in (hole_fraction, hole_w, hole_d, np.full((2, 3), water_fraction))]
+    out = RasterFuncs.surface_maps(*maps, params, cryoconite_albedo, WL, 1e-10, tile_size=2).compute()
+
+    for i, j in np.ndindex(hole_fraction.shape):
+
+        if np.isnan(hole_fraction[i, j]):
+            assert np.all(np.isnan(out.albedo.values[i, j])), f"pixel {i, j}: pixel without data is not NaN"
+            continue
+
+        up = ice_up
+        absorbed = np.zeros(len(WL))
+
+        if hole_w[i, j] > 0 and hole_d[i, j] > 0:
+            hole = SurfaceFuncs.hole_fluxes(hole_d[i, j], hole_w[i, j], hole_d[i, j]*water_fraction, cryoconite_albedo, WL,\
+                params, 1e-10, incoming=incoming)
+            up = (1-hole_fraction[i, j])*ice_up + hole_fraction[i, j]*(hole.reflected_from_water_surface + hole.escaping)
+            absorbed = hole_fraction[i, j]*hole.absorbed
+
+        assert np.allclose(out.albedo.values[i, j], up/incoming, rtol=1e-12, atol=0), f"pixel {i, j}: albedo differs"
+        assert np.allclose(out.absorbed.values[i, j], absorbed, rtol=1e-12, atol=0), f"pixel {i, j}: absorbed energy differs"
+
+    print("*** Raster unit tests passed successfully ***")
+
+    return
+
+
+def check_retrieve(WL):
+
+    """
+    checks that retrieve recovers, within xtol, the water depth and the effective hole depth from
+    ratios calculated with forward_model at known values
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from RetrievalFuncs import RetrievalFuncs
+
+    xtol = 1e-3
+    params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [0.1], 0, 45, 4, True)
+    model = RetrievalFuncs.forward_model(params, WL)
+
+    # hole_d, hole_w, parameter, true value (cm)
+    for hole_d, hole_w, parameter, true_value in ((10, 30, 'water_depth', 1.3), (10, 30, 'water_depth', 4.7),\
+        (10, 30, 'depth', 7), (20, 10, 'depth', 15)):
+
+        if parameter == 'water_depth':
+            measured = model(hole_d, hole_w, true_value, hole_w/2)
+        else:
+            measured = model(true_value, hole_w, 0.7*true_value, hole_w/2)
+
+        result = RetrievalFuncs.retrieve(measured, hole_d, hole_w, model, parameter, xtol=xtol)
+
+        assert abs(result.value - true_value) <= xtol,\
+            f"hole {hole_d, hole_w}: retrieved {parameter} {result.value} instead of {true_value}"
+
+    print("*** Retrieval unit tests passed successfully ***")
+
+    return
+
+
+def check_multi_sza():
+
+    """
+    checks that solving a list of solar zenith angles in one call gives the same results as solving each
+    angle on its own, for both solvers
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+
+    solzens = [30, 45, 60]
+
+    for column in (([850], [850], [1], [0.1]), ([400, 850], [500, 850], [0, 1], [0.02, 0.5]),\
+        ([400, 500], [500, 1000], [0, 0], [0.02, 0.1])):
+        for solver in ('toon', 'adding_doubling'):
+
+            if solver == 'toon' and 1 in column[2]:
+                continue
+
+            params = TwoStreamFuncs.generate_ice_physical_params(*column, 1000, solzens, 4, True)
+            together = TwoStreamFuncs.call_snicar(params, solver=solver)
+
+            for i, solzen in enumerate(solzens):
+
+                alone = TwoStreamFuncs.call_snicar(params._replace(solzen=solzen), solver=solver)
+
+                assert all(np.array_equal(np.asarray(x)[i], y) for x, y in zip(together, alone)),\
+                    f"{solver}, column {column}: SZA {solzen} differs when solved with other angles"
+
+    print("*** Multiple solar zenith unit tests passed successfully ***")
+
+    return
+
+
+def check_transfer():
+
+    """
+    checks that applying a column's transfer functions to the incident flux of several atmospheric
+    profiles and skies (incident_flux, apply_transfer) reproduces call_snicar run for each of them, for
+    granular and solid ice, and that a cloud fraction mixes the clear and cloudy results linearly
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+
+    def relative_error(x, y):
+        return np.max(np.abs(np.asarray(x) - np.asarray(y)))/np.max(np.abs(np.asarray(y)))
+
+    for column in (([500], [500], [0], [0.1]), ([850], [850], [1], [0.1])):
+
+        params = TwoStreamFuncs.generate_ice_physical_params(*column, 0, 50, 4, True)
+        transfer = TwoStreamFuncs.call_snicar(params, transfer=True)
+
+        for incoming_i in (2, 4):
+            for DIRECT in (True, False):
+
+                albedo, BBA, F_btm_net, F_top_pls = TwoStreamFuncs.call_snicar(params._replace(incoming_i=incoming_i, DIRECT=DIRECT))
+                fluxes = TwoStreamFuncs.apply_transfer(transfer, *TwoStreamFuncs.incident_flux(params, incoming_i, DIRECT))
+
+                assert max(relative_error(fluxes.albedo, albedo), relative_error(fluxes.F_top_pls, F_top_pls),\
+                    relative_error(fluxes.F_btm_net, F_btm_net)) < 1e-12,\
+                    f"column {column}, profile {incoming_i}, DIRECT {DIRECT}: transfer functions differ from call_snicar"
+
+        clear = TwoStreamFuncs.call_snicar(params._replace(DIRECT=True))
+        cloudy = TwoStreamFuncs.call_snicar(params._replace(DIRECT=False))
+        cloud_fraction = np.array([0, 0.3, 1])
+        fluxes = TwoStreamFuncs.apply_transfer(transfer, TwoStreamFuncs.incident_flux(params, DIRECT=True)[0],\
+            TwoStreamFuncs.incident_flux(params, DIRECT=False)[1], cloud_fraction)
+
+        for i, c in enumerate(cloud_fraction):
+
+            assert relative_error(fluxes.F_top_pls[i], (1-c)*clear[3] + c*cloudy[3]) < 1e-12 and\
+                relative_error(fluxes.F_btm_net[i], (1-c)*clear[2] + c*cloudy[2]) < 1e-12,\
+                f"column {column}, cloud fraction {c}: transfer functions differ from call_snicar"
+
+    print("*** Transfer function unit tests passed successfully ***")
+
+    return
+
+
+def check_cache():
+
+    """
+    checks that a cached result is returned unchanged, that the least recently used entries are evicted
+    when the cache is full and that the running size estimate matches the files
+
+    """
+
+    import os
+    import shutil
+    import tempfile
+    from CacheFuncs import CacheFuncs
+
+    cache_dir = tempfile.mkdtemp()
+    max_size = 1e5
+    value = (np.arange(1000.), 0.5)
+
+    try:
+        CacheFuncs.put(cache_dir, CacheFuncs.key('unit test', 0), value, max_size)
+        cached = CacheFuncs.get(cache_dir, CacheFuncs.key('unit test', 0))
+
+        assert np.array_equal(cached[0], value[0]) and cached[1] == value[1], "cached value changed"
+        assert CacheFuncs.get(cache_dir, CacheFuncs.key('unit test', 1)) is None, "missing entry returned"
+
+        for i in range(1, 40): # about 8.5 kB each
+            CacheFuncs.put(cache_dir, CacheFuncs.key('unit test', i), value, max_size)
+
+        size = sum(entry.stat().st_size for folder in os.scandir(cache_dir) if folder.is_dir()\
+            for entry in os.scandir(folder.path) if entry.name.endswith('.npz'))
+
+        assert size <= max_size, "cache is larger than its limit"
+        assert CacheFuncs._read_size(cache_dir) == size, "cache size estimate does not match the files"
+        assert CacheFuncs.get(cache_dir, CacheFuncs.key('unit test', 0)) is None, "oldest entry was not evicted"
+        assert CacheFuncs.get(cache_dir, CacheFuncs.key('unit test', 39)) is not None, "newest entry was evicted"
+
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print("*** Cache unit tests passed successfully ***")
+
+    return
+
+
+def check_archive():
+
+    """
+    checks that every netCDF variable and csv table read from an optical property archive is identical
+    to the one read from the file itself
+
+    """
+
+    import os
+    import shutil
+    import tempfile
+    import xarray as xr
+    from IOFuncs import IOFuncs
+
+    roots = ['/home/joe/Code/BioSNICAR_GO_PY/Data/Mie_files/480band/lap/', '/home/joe/Code/CryoconiteRTM/Data/']
+    folder = tempfile.mkdtemp()
+
+    try:
+        IOFuncs.build_archive(folder + '/archive.bin', roots, verbose=False)
+        IOFuncs.close_archives()
+        IOFuncs.open_archive(folder + '/archive.bin')
+
+        for root in roots:
+            for name in sorted(os.listdir(root)):
+
+                if name.endswith('.nc'):
+
+                    with xr.open_dataset(root + name) as f:
+                        from_file = {var: f[var].values for var in f.data_vars}
+
+                    from_archive = IOFuncs._from_archive(root + name, list(from_file))
+
+                    assert from_archive is not None, f"{name} is not in the archive"
+                    assert all(np.array_equal(from_archive[var], from_file[var], equal_nan=True) for var in from_file),\
+                        f"{name}: archive differs from the file"
+
+                elif name.endswith('.csv'):
+
+                    assert np.array_equal(IOFuncs.read_csv(root + name), np.genfromtxt(root + name, delimiter=","),\
+                        equal_nan=True), f"{name}: archive differs from the file"
+
+    finally:
+        IOFuncs.close_archives(auto_open=True)
+        shutil.rmtree(folder)
+
+    print("*** Archive unit tests passed successfully ***")
+
+    return
+
+
+def check_optics_tables():
+
+    """
+    checks that the optics tables return the file values exactly at radii on the table grid, change
+    monotonically between neighbouring rows and raise a ValueError outside the table, for ice grains and
+    bubbly ice
+
+    """
+
+    import xarray as xr
+    from OpticsTables import OpticsTables
+    from SNICAR_feeder import REFIDX_NAMES
+
+    dir_base = '/home/joe/Code/BioSNICAR_GO_PY/'
+    ice_dir = dir_base + 'Data/Mie_files/480band/ice_{0}/'.format(REFIDX_NAMES[2])
+    tables = [(lambda radius: OpticsTables.mie_ice(dir_base, 2, radius), ice_dir, 'ice_{}_'.format(REFIDX_NAMES[2]),\
+        ['ss_alb', 'ext_cff_mss', 'asm_prm']), (lambda radius: OpticsTables.bubbly_ice(dir_base, radius),\
+        dir_base + 'Data/bubbly_ice_files/', 'bbl_', ['sca_cff_vlm', 'asm_prm'])]
+
+    for optics, directory, prefix, names in tables:
+
+        radii = OpticsTables.table(directory, prefix, names).radii
+
+        for radius in radii:
+
+            with xr.open_dataset(directory + prefix + '{:04d}.nc'.format(int(radius))) as f:
+                assert all(np.array_equal(optics(radius)[name], f[name].values) for name in names),\
+                    f"{prefix}: radius {radius} on the table grid differs from the file"
+
+        between = [optics(radius) for radius in np.linspace(radii[0], radii[1], 7)]
+
+        for name in names:
+
+            values = np.array([x[name] for x in between])
+            steps = np.diff(values, axis=0)*np.sign(values[-1] - values[0])
+
+            assert np.all(steps >= 0), f"{prefix}: {name} is not monotonic between rows {radii[0]} and {radii[1]}"
+
+        for radius in (radii[0]*0.9, radii[-1]*1.1):
+
+            try:
+                optics(radius)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"{prefix}: radius {radius} outside the table did not raise a ValueError")
+
+    print("*** Optics table unit tests passed successfully ***")
+
+    return
+
+
+# REFERENCE DATA
+# TestData/column_reference_unit_test.csv and TestData/hole_reference_unit_test.csv hold the outputs of
+# call_snicar and CalculateFluxes for the cases below, calculated by the model before the optimisations
+# (commit 390dfaa) with make_reference_data. The first line of each file records the data files they
+# were calculated with (reference_data_version).
+
+# density, grain_rds, layer_type, dz (m), algae, solzen
+REFERENCE_COLUMNS = [([850], [850], [1], [0.1], 0, 45), ([600, 850], [500, 1000], [1, 1], [0.05, 1], 0, 20),\
+    ([400], [500], [0], [0.05], 5000, 60), ([400, 500], [500, 1000], [0, 0], [0.02, 0.1], 0, 60),\
+    ([400, 850], [500, 850], [0, 1], [0.02, 0.5], 0, 30)]
+
+# hole_d, hole_w, hole_water_d, point (cm), solzen; the ice is one layer of bubbly ice as deep as the hole
+REFERENCE_HOLES = [(10, 30, 2, 0, 45), (10, 30, 2, 10, 45), (10, 30, 2, 29, 45), (20, 10, 1, 5, 30)]
+
+
+def reference_data_version():
+
+    """
+    Returns a short hash of the names and sizes of the optical property and irradiance files, so that
+    reference data are only compared with results calculated from the same files
+
+    """
+
+    import hashlib
+    import os
+
+    h = hashlib.sha256()
+
+    for root in ['/home/joe/Code/BioSNICAR_GO_PY/Data/', '/home/joe/Code/CryoconiteRTM/Data/']:
+        for folder, dirs, names in os.walk(root):
+            dirs.sort()
+            for name in sorted(names):
+                if name.endswith(('.nc', '.csv')):
+                    path = os.path.join(folder, name)
+                    h.update(f"{os.path.relpath(path, root)}:{os.path.getsize(path)};".encode())
+
+    return h.hexdigest()[:16]
+
+
+def make_reference_data(model_dir):
+
+    """
+    Writes the reference data in TestData using the model in model_dir, which should be a copy of the
+    model before the optimisations (e.g. from git worktree add <model_dir> 390dfaa). Run it on its own in
+    a fresh interpreter so that the model in model_dir is the one imported. Only functions that the
+    original model already had are used.
+
+    """
+
+    import sys
+    sys.path.insert(0, model_dir)
+    sys.modules.pop('SpecReflFuncs', None)
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from ControlFuncs import ControlFuncs
+
+    columns = []
+    holes = []
+
+    for density, grain_rds, layer_type, dz, algae, solzen in REFERENCE_COLUMNS:
+        params = TwoStreamFuncs.generate_ice_physical_params(density, grain_rds, layer_type, dz, algae, solzen, 4, True)
+        columns.append(np.concatenate([np.ravel(x) for x in TwoStreamFuncs.call_snicar(params)]))
+
+    for hole_d, hole_w, hole_water_d, point, solzen in REFERENCE_HOLES:
+        params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [hole_d/100], 0, solzen, 4, True)
+        out = ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, point, np.ones(470)*0.2, WL, params, 1e-10)
+        holes.append(np.concatenate([np.ravel(x) for x in out]))
+
+    version = reference_data_version()
+
+    np.savetxt('/home/joe/Code/CryoconiteRTM/TestData/column_reference_unit_test.csv', np.array(columns), delimiter=',',\
+        header='data ' + version + '\none row per case in REFERENCE_COLUMNS: albedo (480), BBA, F_btm_net (480), F_top_pls (480)')
+    np.savetxt('/home/joe/Code/CryoconiteRTM/TestData/hole_reference_unit_test.csv', np.array(holes), delimiter=',',\
+        header='data ' + version + '\none row per case in REFERENCE_HOLES: the outputs of CalculateFluxes in order, flattened')
+
+    return
+
+
+def read_reference_data(name):
+
+    """
+    Returns the reference data in TestData/<name>_reference_unit_test.csv, or None (with a message) if
+    they were calculated from other data files than the ones installed here
+
+    """
+
+    path = '/home/joe/Code/CryoconiteRTM/TestData/{}_reference_unit_test.csv'.format(name)
+
+    with open(path) as f:
+        version = f.readline().split()[-1]
+
+    if version != reference_data_version():
+        print("*** {} reference data were made from other data files ({}, here {}): remake them with"\
+            " make_reference_data to run this test ***".format(name, version, reference_data_version()))
+        return None
+
+    return np.genfromtxt(path, delimiter=',')
+
+
+def check_reference_columns():
+
+    """
+    checks call_snicar against the columns calculated by the model before the optimisations. The original
+    model always used the adding-doubling solver, so that solver is compared.
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+
+    reference = read_reference_data('column')
+
+    if reference is None:
+        return
+
+    for case, expected in zip(REFERENCE_COLUMNS, reference):
+
+        params = TwoStreamFuncs.generate_ice_physical_params(*case, 4, True)
+        result = np.concatenate([np.ravel(x) for x in TwoStreamFuncs.call_snicar(params, solver='adding_doubling')])
+
+        # albedo, BBA, F_btm_net, F_top_pls. Layers reached by less than trmin (1e-5) of the direct beam
+        # are now solved rather than skipped, so F_btm_net under thick columns changes by up to about
+        # trmin of the incoming flux
+        for name, part, tolerance in (('albedo', slice(0, 480), 1e-9), ('BBA', slice(480, 481), 1e-9),\
+            ('F_btm_net', slice(481, 961), 1e-4), ('F_top_pls', slice(961, 1441), 1e-9)):
+
+            error = np.max(np.abs(result[part] - expected[part]))/np.max(np.abs(expected[part]))
+            assert error < tolerance, f"column {case}: {name} differs from the reference by {error}"
+
+    print("*** Reference column unit tests passed successfully ***")
+
+    return
+
+
+def check_floor_mean(WL):
+
+    """
+    checks the exact floor mean (FloorMean) against the mean of CalculateFluxes at many evenly spaced
+    points across the hole floor. The sampled mean only converges as 1/n_points near the edge of the lit
+    part of the floor, hence the tolerance.
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from ControlFuncs import ControlFuncs
+
+    n_points = 2000
+    cryoconite_albedo = np.ones(470)*0.2
+
+    for hole_d, hole_w, hole_water_d, solzen in ((10, 30, 2, 45), (30, 10, 0, 30)):
+
+        params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [hole_d/100], 0, solzen, 4, True)
+        column = TwoStreamFuncs.call_snicar(params)
+
+        exact = ControlFuncs.FloorMean(hole_d, hole_w, hole_water_d, cryoconite_albedo, WL, params, 1e-10, column=column)
+        sampled = [ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL, params, 1e-10,\
+            column=column) for point in (np.arange(n_points) + 0.5)*hole_w/n_points]
+
+        for i, x in enumerate(exact):
+
+            mean = np.mean([np.asarray(s[i]) for s in sampled], axis=0)
+            assert np.max(np.abs(mean - x)) < 2e-3*np.max(np.abs(x)),\
+                f"hole {hole_d, hole_w, hole_water_d, solzen}: output {i} of FloorMean differs from the sampled mean"
+
+    print("*** Floor mean unit tests passed successfully ***")
+
+    return
+
+
+def check_reflection_factor():
+
+    """
+    checks CylinderFuncs.reflection_factor against a Monte Carlo estimate: beams enter the circular
+    aperture at random points, travel in a straight line (in plan view) and are reflected from the wall
+    every time they reach it
+
+    """
+
+    from CylinderFuncs import CylinderFuncs
+
+    R_air, R_water, T_direct = 0.6, 0.8, 0.95
+    rng = np.random.default_rng(1)
+    n_beams = 200000
+
+    # entry points uniform over the aperture (radius 1), all beams travelling in the +x direction
+    r = np.sqrt(rng.random(n_beams))
+    angle = 2*np.pi*rng.random(n_beams)
+    x, y = r*np.cos(angle), r*np.sin(angle)
+
+    to_wall = -x + np.sqrt(1 - y**2) # distance to the first reflection
+    chord = 2*np.sqrt(1 - y**2) # distance between later reflections
+
+    def reflections(distance):
+        return np.where(distance < to_wall, 0, 1 + np.floor((distance - to_wall)/chord))
+
+    for x_air, x_total in ((0.3, 0.3), (0.5, 1.7), (2.2, 3.1), (0, 4.5), (6.3, 6.3)):
+
+        n_air = reflections(x_air)
+        n_total = reflections(x_total)
+        monte_carlo = np.mean(np.where(n_total == 0, T_direct, R_air**(n_air+1)*R_water**(n_total-n_air)))
+
+        factor = CylinderFuncs.reflection_factor(x_air, [x_total], [R_air], [R_water], [T_direct])[0]
+
+        assert abs(factor - monte_carlo) < 3e-3, f"x_air = {x_air}, x_total = {x_total}: {factor} v {monte_carlo}"
+
+    print("*** Cylinder reflection factor unit tests passed successfully ***")
+
+    return
+
+
+def check_validation(WL):
+
+    """
+    checks the batched validation (ValidationFuncs.run) against the original loop over the field holes
+    in ValidationTests.py
+
+    """
+
+    import pandas as pd
+    from TwoStreamFuncs import TwoStreamFuncs
+    from ControlFuncs import ControlFuncs
+    from ValidationFuncs import ValidationFuncs
+
+    csv_path = '/home/joe/Code/CryoconiteRTM/TestData/FieldMeasurements.csv'
+    params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [1], 0, 25, 4, True)
+    validation = ValidationFuncs.run(csv_path, params, WL, n_workers=1)
+
+    FieldDF = pd.read_csv(csv_path)
+
+    for i in range(len(FieldDF)):
+
+        hole_d = FieldDF['HoleDepth(mm)'][i]/10 - 5
+        hole_w = FieldDF['HoleWidth(mm)'][i]/10
+        hole_water_d = np.round(hole_d*0.7, 0)
+
+        params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [hole_d/100], 0, 25, 4, True)
+        incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+        out = ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, hole_w/2, np.ones(470)*0.2, WL, params, 100)
+        ratio = np.sum((out[4] + out[5])[0:40])/np.sum(incoming)
+
+        assert abs(validation.holes.model_ratio[i] - ratio) < 1e-12, f"hole {i}: validation ratio differs from the loop"
+
+    print("*** Validation unit tests passed successfully ***")
+
+    return
+
+
+def check_service():
+
+    """
+    checks that the service evaluation gives the same results as SurfaceFuncs.hole_fluxes
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from SurfaceFuncs import SurfaceFuncs
+    from ServiceFuncs import ServiceFuncs
+    from SpectralGrid import SpectralGrid
+
+    WL = SpectralGrid.default().WL
+    scenarios = [{}, {'hole_d': 0.1, 'hole_w': 0.3, 'hole_water_d': 0.02, 'solzen': 30}, {}] # the last reuses the column
+    results = ServiceFuncs.evaluate(scenarios)
+
+    for i, values in enumerate(scenarios):
+
+        s = ServiceFuncs.scenario(values)
+        params = TwoStreamFuncs.generate_ice_physical_params(s['density'], s['grain_rds'], s['layer_type'], [s['hole_d']],\
+            s['algae'], s['solzen'], s['incoming_i'], s['DIRECT'])
+        hole = SurfaceFuncs.hole_fluxes(s['hole_d'], s['hole_w'], s['hole_water_d'], np.full(len(WL), s['cryoconite_albedo']),\
+            WL, params, s['tolerance'])
+
+        assert np.array_equal(results['absorbed'][i], hole.absorbed) and np.array_equal(results['escaping'][i], hole.escaping),\
+            f"scenario {i}: service results differ from hole_fluxes"
+
+    print("*** Service unit tests passed successfully ***")
+
+    return
+
+
+def check_params():
+
+    """
+    checks that run parameters are immutable, compare and hash by value, survive pickling and that
+    invalid values raise a ValueError
+
+    """
+
+    import pickle
+    from TwoStreamFuncs import TwoStreamFuncs
+
+    args = ([400, 850], [500, 850], [0, 1], [0.02, 0.5], [0, 1000], 45, 4, True)
+    params = TwoStreamFuncs.generate_ice_physical_params(*args)
+    same = TwoStreamFuncs.generate_ice_physical_params(*[np.array(x) if isinstance(x, list) else x for x in args])
+
+    try:
+        params.solzen = 30
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("params can be changed in place")
+
+    assert isinstance(params.dz, tuple) and isinstance(params.mss_cnc_glacier_algae, tuple), "per-layer values are not tuples"
+    assert params == same and hash(params) == hash(same), "params from lists and arrays differ"
+    assert params != params._replace(solzen=30) and len({params, same, params._replace(solzen=30)}) == 2,\
+        "params with different values are not distinct"
+    assert pickle.loads(pickle.dumps(params)) == params, "params changed when pickled"
+
+    # index of the argument and an invalid value for it
+    for i, value in ((3, [0.02]), (3, [0.02, 0]), (0, [-400, 850]), (1, [0, 850]), (4, [0, 1, 2]), (4, -1),\
+        (5, 0), (5, 90), (6, 7)):
+
+        invalid = list(args)
+        invalid[i] = value
+
+        try:
+            TwoStreamFuncs.generate_ice_physical_params(*invalid)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"argument {i} = {value} did not raise a ValueError")
+
+    print("*** Parameter unit tests passed successfully ***")
+
+    return
+
+
+def check_reference_holes():
+
+    """
+    checks CalculateFluxes against the outputs calculated by the model before the optimisations
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from ControlFuncs import ControlFuncs
+
+    reference = read_reference_data('hole')
+
+    if reference is None:
+        return
+
+    for (hole_d, hole_w, hole_water_d, point, solzen), expected in zip(REFERENCE_HOLES, reference):
+
+        params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [hole_d/100], 0, solzen, 4, True)
+        out = ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, point, np.ones(470)*0.2, WL, params, 1e-10)
+        result = np.concatenate([np.ravel(x) for x in out])
+
+        assert np.max(np.abs(result - expected)) < 1e-10*np.max(np.abs(expected)),\
+            f"hole {hole_d, hole_w, hole_water_d, point, solzen}: CalculateFluxes differs from the reference"
+
+    print("*** Reference hole unit tests passed successfully ***")
+
+    return
+
+
+def check_screen_albedos(WL):
+
+    """
+    checks that every row of ScreenAlbedos equals CalculateFluxes (at a point) or FloorMean (over the
+    floor) run with that albedo spectrum on its own
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from ControlFuncs import ControlFuncs
+
+    hole_d, hole_w, hole_water_d = 10, 30, 2
+    albedos = np.array([np.ones(470)*0.05, np.ones(470)*0.2, np.linspace(0.05, 0.6, 470)])
+
+    params = TwoStreamFuncs.generate_ice_physical_params([850], [850], [1], [hole_d/100], 0, 45, 4, True)
+    column = TwoStreamFuncs.call_snicar(params)
+
+    for point in (5, None):
+
+        screened = ControlFuncs.ScreenAlbedos(hole_d, hole_w, hole_water_d, point, albedos, WL, params, 1e-10, column=column)
+
+        for j, albedo in enumerate(albedos):
+
+            if point is None:
+                alone = ControlFuncs.FloorMean(hole_d, hole_w, hole_water_d, albedo, WL, params, 1e-10, column=column)
+            else:
+                alone = ControlFuncs.CalculateFluxes(hole_d, hole_w, hole_water_d, point, albedo, WL, params, 1e-10, column=column)
+
+            for i, x in enumerate(alone):
+
+                row = screened[i][j] if i < 3 else screened[i]
+                assert np.array_equal(np.asarray(row), np.asarray(x)),\
+                    f"point {point}, spectrum {j}: output {i} of ScreenAlbedos differs from the single-spectrum result"
+
+    print("*** Albedo screening unit tests passed successfully ***")
+
+    return
+
+
+def check_depth_sweep():
+
+    """
+    checks that call_snicar_sweep gives the same results as call_snicar for each layer thickness
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+
+    for column in (([850], [850], [1], [0.1]), ([400, 850], [500, 850], [0, 1], [0.02, 0.5]),\
+        ([400, 500], [500, 1000], [0, 0], [0.02, 0.1])):
+
+        params = TwoStreamFuncs.generate_ice_physical_params(*column, 1000, 45, 4, True)
+        thicknesses = [[dz*scale for dz in column[3]] for scale in (0.3, 1, 2.5)]
+
+        for dz, swept in zip(thicknesses, TwoStreamFuncs.call_snicar_sweep(params, thicknesses)):
+
+            alone = TwoStreamFuncs.call_snicar(params._replace(dz=tuple(dz)))
+
+            assert all(np.array_equal(x, y) for x, y in zip(swept, alone)), f"column {column}: sweep differs at dz = {dz}"
+
+    print("*** Depth sweep unit tests passed successfully ***")
+
+    return
+
+
+def check_atlas():
+
+    """
+    checks that an atlas reproduces the solved columns at its grid points within AtlasFuncs.TOLERANCE
+    and refuses columns outside its grid
+
+    """
+
+    from TwoStreamFuncs import TwoStreamFuncs
+    from AtlasFuncs import AtlasFuncs
+
+    axes = {'density': (800, 900), 'grain_rds': (700, 850), 'dz': (0.05, 0.1), 'solzen': (40, 50), 'algae': (0, 1000)}
+    atlas = AtlasFuncs.build(axes, n_check=0, verbose=False)
+
+    # F_top_pls is compressed within TOLERANCE of its largest value in the atlas
+    mean, coefficients, components = atlas.outputs['F_top_pls']
+    F_top_max = np.max(np.abs(mean + coefficients.reshape(-1, len(components)) @ components))
+
+    for density in axes['density']:
+        for grain_rds in axes['grain_rds']:
+            for dz in axes['dz']:
+                for algae in axes['algae']:
+
+                    params = TwoStreamFuncs.generate_ice_physical_params([density], [grain_rds], [1], [dz], algae, 40, 4, True)
+                    albedo, BBA, F_btm_net, F_top_pls = AtlasFuncs.column(atlas, params)
+                    solved = TwoStreamFuncs.call_snicar(params)
+
+                    assert np.max(np.abs(albedo - solved[0])) <= AtlasFuncs.TOLERANCE['albedo'], "atlas albedo error"
+                    assert abs(BBA - solved[1]) < 1e-12, "atlas BBA error"
+                    assert np.max(np.abs(np.log(np.maximum(F_btm_net, AtlasFuncs.FLOOR)) - np.log(np.maximum(solved[2],\
+                        AtlasFuncs.FLOOR)))) <= AtlasFuncs.TOLERANCE['F_btm_net'], "atlas F_btm_net error"
+                    assert np.max(np.abs(F_top_pls - solved[3])) <= AtlasFuncs.TOLERANCE['F_top_pls']*F_top_max,\
+                        "atlas F_top_pls error"
+
+    try:
+        AtlasFuncs.column(atlas, params._replace(dz=(0.2,)))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("atlas extrapolated outside its grid")
+
+    print("*** Atlas unit tests passed successfully ***")
+
+    return
+
+
 # WHICH FUNCTIONS TO TEST?
 # check_fresnel(nAir,nWat,kAir,kWat,WL,plot_figs=True)
 # check_multiple_reflections(nAir,nWat)
 # check_trans_angle(nAir, nWat)
 check_internal_reflections(nAir,kAir,nWat,kWat,WL)
+check_hole_population()
+check_surface_maps()
+check_retrieve(WL)
+check_multi_sza()
+check_transfer()
+check_cache()
+check_archive()
+check_optics_tables()
+check_reference_columns()
+check_floor_mean(WL)
+check_reflection_factor()
+check_validation(WL)
+check_service()
+check_params()
+check_reference_holes()
+check_screen_albedos(WL)
+check_depth_sweep()
+check_atlas()
+
+# run on its own (comment out the checks above) to remake the reference data from the original model
+# make_reference_data('/home/joe/Code/CryoconiteRTM_390dfaa/')
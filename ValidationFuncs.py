@@ -0,0 +1,190 @@
+"""
+Class ValidationFuncs contains the field validation pipeline: the modelled ratio of hole floor to
+incoming irradiance is compared with the ratio measured in every hole of a field measurement csv
+(e.g. TestData/FieldMeasurements.csv) in one batched run.
+
+The direct beam is cheap; the cost of a validation run is the SNICAR column solve for each hole,
+which only depends on the hole depth. Holes are grouped by depth so that holes with the same depth
+share one column, the distinct columns are solved together as a depth sweep (see
+TwoStreamFuncs.call_snicar_sweep; split between separate processes when there are enough of them)
+and the ratios for all holes are then evaluated with RetrievalFuncs.forward_model using the solved
+columns. With a cache_dir in params (see CacheFuncs) columns are also kept between validation runs.
+
+Functions in this class include:
+
+1) field_holes
+    Reads the hole dimensions and measured ratios from a field measurement csv
+
+2) solve_columns
+    Solves the SNICAR column for each distinct hole depth, in parallel
+
+3) statistics
+    Returns the error statistics for a set of residuals
+
+4) run
+    Runs the validation for every hole and returns the per-hole results and error statistics
+
+5) save
+    Writes the result of run as JSON
+
+"""
+
+
+class ValidationFuncs:
+
+    COLUMNS_PER_WORKER = 512 # starting a worker process costs about as much as hundreds of columns in a sweep
+    SENSOR_BAND = slice(0, 40) # bands of hole floor irradiance summed for comparison with the sensor (0.30 - 0.69 um)
+
+    def __init__(self):
+
+
+        return
+
+
+    def field_holes(csv_path, sensor_height=5, water_fraction=0.7):
+
+        """
+        Returns a pandas DataFrame with the hole depth, width and water depth (cm) and the measured
+        floor/surface irradiance ratio of every hole in csv_path (columns HoleDepth(mm), HoleWidth(mm)
+        and Ratio). The sensor height (cm) is subtracted from the hole depth and the water depth is
+        water_fraction of the hole depth, rounded to the nearest cm.
+
+        """
+
+        import numpy as np
+        import pandas as pd
+
+        FieldDF = pd.read_csv(csv_path)
+        hole_d = FieldDF['HoleDepth(mm)']/10 - sensor_height
+
+        return pd.DataFrame({'hole_d': hole_d, 'hole_w': FieldDF['HoleWidth(mm)']/10,\
+            'hole_water_d': np.round(hole_d*water_fraction, 0), 'measured_ratio': FieldDF['Ratio']})
+
+
+    def _columns(params, dzs):
+
+        # solves the single-layer columns of thickness dzs as one sweep (in this or a worker process)
+        # and returns F_btm_net on the model grid for each
+
+        import numpy as np
+        from TwoStreamFuncs import TwoStreamFuncs
+        from SpectralGrid import SpectralGrid
+
+        grid = SpectralGrid.default()
+
+        return [np.array(grid.to_model(F_btm_net)) for albedo, BBA, F_btm_net, F_top_pls\
+            in TwoStreamFuncs.call_snicar_sweep(params, dzs)]
+
+
+    def solve_columns(depths, params, dz_scale=0.01, depth_decimals=1, n_workers=None):
+
+        """
+        Solves the SNICAR column (params with a single layer of thickness hole_d*dz_scale) for every
+        distinct depth in depths, rounded to depth_decimals as in RetrievalFuncs.forward_model.
+        The columns are solved together as a depth sweep (TwoStreamFuncs.call_snicar_sweep), split
+        between n_workers fresh processes; n_workers = 1 solves them in this process. By default one
+        process is used per COLUMNS_PER_WORKER columns, up to one per CPU, so small validation sets
+        are not slowed down by starting processes.
+
+        Returns a dictionary of rounded depth -> F_btm_net on the model grid.
+
+        """
+
+        import os
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        keys = sorted({round(float(hole_d), depth_decimals) for hole_d in depths})
+        dzs = [key*dz_scale for key in keys]
+
+        if n_workers is None:
+            n_workers = min(os.cpu_count() or 1, -(-len(keys)//ValidationFuncs.COLUMNS_PER_WORKER))
+
+        n_workers = min(int(n_workers), len(keys))
+
+        if n_workers <= 1:
+            return dict(zip(keys, ValidationFuncs._columns(params, dzs)))
+
+        # one sweep of every n_workers-th depth per process (params are picklable)
+        ctx = multiprocessing.get_context('spawn')
+
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as pool:
+            futures = [pool.submit(ValidationFuncs._columns, params, dzs[i::n_workers]) for i in range(n_workers)]
+            columns = {}
+            for i, future in enumerate(futures):
+                columns.update(zip(keys[i::n_workers], future.result()))
+
+        return dict(sorted(columns.items()))
+
+
+    def statistics(residuals):
+
+        """
+        Returns a dictionary of error statistics for residuals (modelled - measured): the number of
+        holes, the mean, standard deviation and maximum of the absolute error, the root mean square
+        error and the bias (mean residual)
+
+        """
+
+        import numpy as np
+
+        residuals = np.asarray(residuals, dtype=float)
+        abs_error = np.abs(residuals)
+
+        return {'n': int(len(residuals)), 'mean_abs_error': float(np.mean(abs_error)),\
+            'std_abs_error': float(np.std(abs_error)), 'max_abs_error': float(np.max(abs_error)),\
+            'rmse': float(np.sqrt(np.mean(residuals**2))), 'bias': float(np.mean(residuals))}
+
+
+    def run(csv_path, params, WL, sensor_height=5, water_fraction=0.7, band=None, n_workers=None, dz_scale=0.01):
+
+        """
+        Runs the validation for every hole in csv_path (see field_holes). The modelled ratio is the
+        total (direct + diffuse) irradiance at the centre of the hole floor summed over band (default
+        SENSOR_BAND) divided by the total incoming irradiance. Hole dimensions are in cm and converted
+        to a column thickness by dz_scale.
+
+        Returns a named tuple with a DataFrame of the holes (dimensions, measured and modelled ratios,
+        residual and absolute error), the error statistics (see statistics), the number of column
+        solves and the wall time (s).
+
+        """
+
+        import collections
+        import time
+        import numpy as np
+        from RetrievalFuncs import RetrievalFuncs
+
+        start = time.perf_counter()
+        band = ValidationFuncs.SENSOR_BAND if band is None else band
+
+        holes = ValidationFuncs.field_holes(csv_path, sensor_height, water_fraction)
+        columns = ValidationFuncs.solve_columns(holes.hole_d, params, dz_scale, n_workers=n_workers)
+
+        ratio = RetrievalFuncs.forward_model(params, WL, dz_scale, band, columns=columns)
+
+        holes['model_ratio'] = [ratio(hole_d, hole_w, hole_water_d, hole_w/2) for hole_d, hole_w, hole_water_d\
+            in zip(holes.hole_d, holes.hole_w, holes.hole_water_d)]
+
+        holes['residual'] = holes.model_ratio - holes.measured_ratio
+        holes['abs_error'] = np.abs(holes.residual)
+
+        validation = collections.namedtuple("validation", "holes, statistics, n_columns, wall_time")
+
+        return validation(holes, ValidationFuncs.statistics(holes.residual), ratio.n_columns, time.perf_counter() - start)
+
+
+    def save(validation, path):
+
+        """
+        Writes the statistics and per-hole results of a validation run to path as JSON
+
+        """
+
+        import json
+
+        with open(path, 'w') as f:
+            json.dump({'statistics': validation.statistics, 'n_columns': validation.n_columns,\
+                'wall_time': validation.wall_time, 'holes': validation.holes.to_dict(orient='records')}, f, indent=2)
+
+        return
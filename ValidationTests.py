@@ -1,34 +1,25 @@
-
-
 import numpy as np
-import math
-import pandas as pd
 import matplotlib.pyplot as plt
-from ControlFuncs import ControlFuncs
 from TwoStreamFuncs import TwoStreamFuncs
-########################
-# IMPORT FIELD DATA
-#######################
+from SpectralGrid import SpectralGrid
+from ValidationFuncs import ValidationFuncs
 
-FieldDF = pd.read_csv('./TestData/FieldMeasurements.csv')
-depths = FieldDF['HoleDepth(mm)']/10
-widths = FieldDF['HoleWidth(mm)']/10
-FieldRatios = FieldDF['Ratio']
-modelRatio = np.zeros(len(depths))
-sensor_height = 5 # sensor height in cm
+# the columns are solved in parallel processes (see ValidationFuncs), so the script must be run as
+# the main module (python ValidationTests.py)
 
-for i in range(len(depths)):
+if __name__ == '__main__':
 
-    hole_d = depths[i] - sensor_height
-    hole_w = widths[i]
-    hole_water_d = np.round(hole_d * 0.7,0)
+    ########################
+    # IMPORT FIELD DATA
+    #######################
 
-    #print("D: ", hole_d, "W: ", hole_w, "WatD: ", hole_water_d)
+    csv_path = './TestData/FieldMeasurements.csv'
+    sensor_height = 5 # sensor height in cm
+    water_fraction = 0.7 # water depth as a fraction of hole depth
+    band = ValidationFuncs.SENSOR_BAND # bands summed for comparison with the sensor
+    n_workers = None # processes used for the column solves (None = chosen from the number of columns)
 
-    hole_ar = int(hole_d/hole_w)
-    point = hole_w/2 # horizontal distance from LH wall to desired location on hole floor
-    cryoconite_albedo = np.ones(470)*0.2 #constant albedo across wavelength for now
-    WL = np.arange(0.3,5,0.01)
+    WL = SpectralGrid.default().WL
 
     #############################################
     ## 3. SET PHYSICAL PROPERTIES OF THE ICE/SNOW
@@ -38,38 +29,30 @@ for i in range(len(depths)):
     density = [850]
     grain_rds = [850]
     layer_type = [1]
-    dz = [hole_d/100] # cm to m
+    dz = [1] # replaced by each hole's depth (cm to m)
     algae = 0
     incoming_i = 4
     DIRECT = True
-    n_internal_reflections = 100
+    cache_dir = None # set to a directory to keep column solves between validation runs
 
     # create named tuple containing snicar input params
-    params = TwoStreamFuncs.generate_ice_physical_params(density,grain_rds,layer_type,dz,algae,solzen,incoming_i,DIRECT)
-    incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
+    params = TwoStreamFuncs.generate_ice_physical_params(density,grain_rds,layer_type,dz,algae,solzen,incoming_i,DIRECT,cache_dir)
+
+    savepath = '/home/joe/Code/CryoconiteRTM/Assets/'
 
     #############################################################
     # END OF USER INPUT (i.e. leave all remaining code unchanged)
     #############################################################
 
-    dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite, total_incoming_energy,\
-    dir_energy_at_hole_floor, diffuse_energy_at_hole_floor = ControlFuncs.CalculateFluxes(\
-        hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL, params, n_internal_reflections)
-
-    total_energy_at_hole_floor = diffuse_energy_at_hole_floor + dir_energy_at_hole_floor
-
-    BB_output = np.sum(total_energy_at_hole_floor[0:40])
-
-    modelRatio[i] = BB_output/np.sum(incoming)
-
+    validation = ValidationFuncs.run(csv_path, params, WL, sensor_height, water_fraction, band, n_workers)
+    ValidationFuncs.save(validation, savepath + 'ValidationTests.json')
 
-error = modelRatio - FieldRatios
-norm_error = abs(error)
+    print("mean error = ", validation.statistics['mean_abs_error'])
+    print("STD error = ", validation.statistics['std_abs_error'])
+    print(f"{validation.statistics['n']} holes, {validation.n_columns} column solves, {validation.wall_time:.1f} s")
 
-print("mean error = ", np.mean(norm_error))
-print("STD error = ", np.std(norm_error))
-plt.scatter(range(len(error)),norm_error)
-plt.title("Absolute error: field measurements v simulations for hole floor irradiance")
-plt.ylim(0,0.5)
-plt.ylabel("Absolute error"), plt.xlabel("Measurement ID")
-plt.savefig('/home/joe/Code/CryoconiteRTM/Assets/ValidationTests.jpg')
\ No newline at end of file
+    plt.scatter(range(len(validation.holes)), validation.holes.abs_error)
+    plt.title("Absolute error: field measurements v simulations for hole floor irradiance")
+    plt.ylim(0,0.5)
+    plt.ylabel("Absolute error"), plt.xlabel("Measurement ID")
+    plt.savefig(savepath + 'ValidationTests.jpg')
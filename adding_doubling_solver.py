@@ -1,28 +1,79 @@
 def adding_doubling_solver(rf_ice, APRX_TYP, DELTA, layer_type, tau, g, SSA, mu_not, nbr_lyr, nbr_wvl,\
-     R_sfc, wvl, Fs, Fd, L_snw, flx_slr, DIRECT, dir_base):
-    
+     R_sfc, wvl, Fs, Fd, L_snw, flx_slr, DIRECT, dir_base, transfer=False, workspace=None, out=None, outputs=None,\
+     columns=1):
+
 
     """
     This script is one of the two optional radiativ transfer solvers available in this package. This
-    script deals with the adding-doubling method as translated from MATLAB code from Chloe Whicker 
-    (UMich) - October 2020. When it becomes available, any use of this adding-doubling script should cite 
+    script deals with the adding-doubling method as translated from MATLAB code from Chloe Whicker
+    (UMich) - October 2020. When it becomes available, any use of this adding-doubling script should cite
     Chloe's paper.
 
     This is the appropriate solver for any configuration where solid ice layers and fresnel reflection
     are included.
 
+    mu_not can be a single cosine of the solar zenith angle or an array of them, in which case Fs, Fd
+    and flx_slr can have one row per angle (shape [n_angles, nbr_wvl]) or be shared by all angles. The
+    layer reflectivities and transmissivities to diffuse radiation (rdif, tdif), the diffuse
+    reflectivity of the layers below each interface (rupdif) and the diffuse transmission down the
+    column (trndif, rdndif) do not depend on the solar angle, so they are calculated once; only the
+    direct beam terms are calculated for each angle. When mu_not is an array every output gains a
+    leading axis of length n_angles.
+
+    All wavelengths are solved together as arrays; the only loops are over layers (which are coupled)
+    and over the gaussian angles used for the diffuse integration.
+
+    The fluxes are linear in the incident direct and diffuse flux. If transfer is True the solver
+    returns the wavelengths and a named tuple of transfer functions instead of the usual outputs:
+    upwelling, downwelling and net (up - down) flux at every layer interface (index 0 = surface,
+    index nbr_lyr = bottom of the column) per unit incident direct flux (dir_up, dir_down, dir_net)
+    and per unit incident diffuse flux (dif_up, dif_down, dif_net), each of shape
+    [nbr_lyr+1, nbr_wvl] (with a leading angle axis if mu_not is an array). Fs, Fd and flx_slr are
+    not used in this case.
+
+    The intermediate arrays are taken from workspace (a SolverWorkspace, by default the one of the
+    current thread), so repeated solves do not allocate them again, and the interface fluxes are
+    calculated in place. The outputs are new arrays, except that out can be a dictionary of arrays
+    for albedo, F_btm_net and/or F_top_pls, which are filled in place and returned.
+
+    outputs can name the outputs that are needed, out of albedo, BBA (alb_slr), BBAVIS (alb_vis),
+    BBANIR (alb_nir), abs_slr (abs_snw_slr), heat_rt, F_btm_net and F_top_pls; the others are not
+    calculated and are returned as None. Unless abs_slr or heat_rt is needed, the fluxes are only
+    calculated at the surface and the bottom of the column rather than at every interface. By
+    default (None) every output is calculated.
+
+    Every calculation is independent between wavelengths, so several columns with the same layer
+    types can be solved together by laying their spectra side by side along the wavelength axis
+    (see SNICAR_feeder, DZ_SWEEP): columns is then the number of columns and nbr_wvl the total
+    length of that axis. Only the spectral outputs are meaningful in this case.
+
     """
-    
+
+    import collections
     import numpy as np
-    import xarray as xr
-    
+    from SpectralGrid import SpectralGrid
+    from IOFuncs import IOFuncs
+    from SNICAR_feeder import REFIDX_NAMES
+    from SolverWorkspace import SolverWorkspace
+
+    work = SolverWorkspace.local() if workspace is None else workspace
+
     #directory
-    dir_RI_ice = str(dir_base + 'Data/') 
+    dir_RI_ice = str(dir_base + 'Data/')
 
     #######################################
     ## DEFINE CONSTANTS AND SET UP ARRAYS
     #######################################
 
+    single_angle = np.ndim(mu_not) == 0
+    mu_not = np.atleast_1d(np.asarray(mu_not, dtype=float))
+    nbr_ang = len(mu_not)
+
+    # incident flux with one row per solar angle
+    Fs = np.broadcast_to(np.asarray(Fs, dtype=float), (nbr_ang, nbr_wvl))
+    Fd = np.broadcast_to(np.asarray(Fd, dtype=float), (nbr_ang, nbr_wvl))
+    flx_slr = np.broadcast_to(np.asarray(flx_slr, dtype=float), (nbr_ang, nbr_wvl))
+
     tau0    = tau.T   # read and transpose tau
     g0      = g.T  # read and transpose g
     SSA0  = SSA.T  # read and transpose SSA
@@ -32,48 +83,34 @@ def adding_doubling_solver(rf_ice, APRX_TYP, DELTA, layer_type, tau, g, SSA, mu_
     trmin   = 1e-5      # minimum transmissivity
     puny    = 1e-10     # not sure how should we define this
 
-    gauspt = [0.9894009, 0.9445750, 0.8656312, 0.7554044, 0.6178762, 0.4580168, 0.2816036, 0.0950125]  # gaussian angles (radians)     
+    gauspt = [0.9894009, 0.9445750, 0.8656312, 0.7554044, 0.6178762, 0.4580168, 0.2816036, 0.0950125]  # gaussian angles (radians)
     gauswt = [0.0271525, 0.0622535, 0.0951585, 0.1246290, 0.1495960, 0.1691565, 0.1826034, 0.1894506] # gaussian weights
 
-    vis_max_idx = 50   # index of maximum visible wavelength (0.7 um)
-    nir_max_idx = 480 # index of max nir wavelength (5 um)
-
-    # empty arrays
-    trndir = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    trntdr = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    trndif = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    rupdir = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    rupdif = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    trndir = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    rdndif = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    fdirup = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    fdifup = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    fdirdn = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    fdifdn = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    dfdir = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    dfdif = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    rdir = np.zeros(shape=[nbr_lyr+1])
-    rdif_a = np.zeros(shape=[nbr_lyr+1])
-    rdif_b = np.zeros(shape=[nbr_lyr+1])   #layer reflectivity to diffuse radiation from below
-    tdir = np.zeros(shape=[nbr_lyr+1])   #layer transmission to direct radiation (solar beam + diffuse)
-    tdif_a = np.zeros(shape=[nbr_lyr+1])   #layer transmission to diffuse radiation from above
-    tdif_b = np.zeros(shape=[nbr_lyr+1])   #layer transmission to diffuse radiation from below
-    trnlay = np.zeros(shape=[nbr_lyr+1])   #solar beam transm for layer (direct beam only)
-    F_up = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    F_dwn = np.zeros(shape=[nbr_wvl,nbr_lyr+1])
-    F_abs = np.zeros(shape=[nbr_wvl,nbr_lyr])
-    F_abs_vis = np.zeros(shape=[nbr_lyr])
-    F_abs_nir = np.zeros(shape=[nbr_lyr])
-    trndir[:,0] =  1 
-    trntdr[:,0] =  1 
-    trndif[:,0] =  1 
-    rdndif[:,0] =  0 
+    grid = SpectralGrid.default()
+    vis_max_idx = grid.vis_max_idx   # index of maximum visible wavelength (0.7 um)
+    nir_max_idx = grid.nir_max_idx # index of max nir wavelength (5 um)
+
+    # empty arrays: [angle, wavelength, interface] for terms depending on the solar angle
+    # and [wavelength, interface] for the diffuse terms that do not
+    shape_dir = [nbr_ang,nbr_wvl,nbr_lyr+1]
+    shape_dif = [nbr_wvl,nbr_lyr+1]
+
+    trndir = work.zeros('trndir', shape_dir)
+    trntdr = work.zeros('trntdr', shape_dir)
+    rupdir = work.zeros('rupdir', shape_dir)
+    trndif = work.zeros('trndif', shape_dif)
+    rupdif = work.zeros('rupdif', shape_dif)
+    rdndif = work.zeros('rdndif', shape_dif)
+    trndir[:,:,0] =  1
+    trntdr[:,:,0] =  1
+    trndif[:,0] =  1
+    rdndif[:,0] =  0
 
     # if there are non zeros in layer type, grab the index of the first fresnel layer
 
     if np.sum(layer_type) > 0:
 
-        lyrfrsnl = layer_type.index(1)
+        lyrfrsnl = list(layer_type).index(1)
         print("\nFirst Fresnel bounday is in layer ", lyrfrsnl)
 
     else:
@@ -84,413 +121,441 @@ def adding_doubling_solver(rf_ice, APRX_TYP, DELTA, layer_type, tau, g, SSA, mu_
         print("There are no ice layers in this model configuration\
              - suggest adding a solid ice layer or using faster Toon method")
 
-    # proceed down one layer at a time: if the total transmission to
-    # the interface just above a given layer is less than trmin, then no
-    # Delta-Eddington computation for that layer is done.
-
-    for wl in np.arange(0,nbr_wvl,1): # loop through wavelengths
-        
-        for lyr in np.arange(0,nbr_lyr,1):   # loop through layers
-
-            # open refractive index file and grab real and imaginary parts
-            refidx_file = xr.open_dataset(dir_RI_ice+'rfidx_ice.nc')
-
-            if rf_ice == 0:
-
-                refidx_re = refidx_file['re_Wrn84'].values
-                refidx_im = refidx_file['im_Wrn84'].values 
-
-            elif rf_ice == 1:
-                refidx_re = refidx_file['re_Wrn08'].values
-                refidx_im = refidx_file['im_Wrn08'].values 
-
-            elif rf_ice == 2:
-                refidx_re = refidx_file['re_Pic16'].values
-                refidx_im = refidx_file['im_Pic16'].values 
-
-
-            refindx = refidx_re[wl]+refidx_im[wl]  # combine real and imaginary parts into one var
-
-            #  compute next layer Delta-eddington solution only if total transmission
-            #  of radiation to the interface just above the layer exceeds trmin.
-            
-            if trntdr[wl,lyr] > trmin: # condition: only run computation if sufficient
-                #flux received from above
-                
-                mu0 = mu_not  # cosine of beam angle is equal to incident beam
-                
-                # . Eq. 20: Briegleb and Light 2007: adjusts beam angle
-                # (i.e. this is Snell's Law for refraction at interface between media)
-                # mu0n = -1 represents light travelling vertically upwards and mu0n = +1 
-                # represents light travellign vertically downwards
-                
-                mu0n = np.sqrt(1-((1-mu0**2)/(refindx*refindx))) 
-                               
-                # condition: if current layer is above fresnel layer or the 
-                # top layer is a Fresnel layer
-                if lyr < lyrfrsnl or lyrfrsnl==0:
-                    
-                    mu0n = mu0 
-
-                elif lyr >= lyrfrsnl:
-                    # within or below FL
-                    mu0n = mu0n 
-
-                # calculation over layers with penetrating radiation
-                # includes optical thickness, single scattering albedo, 
-                # asymmetry parameter and total flux
-                tautot = tau0[wl,lyr] 
-                wtot   = SSA0[wl,lyr] 
-                gtot   = g0[wl,lyr] 
-                ftot   = g0[wl,lyr] * g0[wl,lyr] 
-                
-                # coefficient for delta eddington solution for all layers 
-                # Eq. 50: Briegleb and Light 2007
-                ts   = (1-(wtot * ftot)) * tautot # layer delta-scaled extinction optical depth
-                ws   = ((1-ftot) * wtot) / (1-(wtot * ftot)) # layer delta-scaled single scattering albedo
-                gs   = (gtot-ftot)/(1-ftot) # layer delta-scaled asymmetry parameter
-                lm   = np.sqrt(3 * (1-ws) * (1-ws * gs)) # lambda
-                ue   = 1.5 * (1-ws * gs) / lm # u equation, term in diffuse reflectivity and transmissivity
-                
-                extins = max(exp_min, np.exp(-lm * ts)) # extinction, MAX function lyr keeps from getting an error if the exp(-lm*ts) is < 1e-5
-                ne = (ue+1)**2 / extins - (ue-1)**2 * extins # N equation, term in diffuse reflectivity and transmissivity
-                
-                 # ! first calculation of rdif, tdif using Delta-Eddington formulas
-                 # Eq.: Briegleb 1992  alpha and gamma for direct radiation
-
-                rdif_a[lyr] = (ue**2-1) * (1/extins - extins)/ne # R BAR = layer reflectivity to DIFFUSE radiation
-                tdif_a[lyr] = 4*ue/ne # T BAR layer transmissivity to DIFFUSE radiation
-                
-                 # evaluate rdir, tdir for direct beam
-                trnlay[lyr] = max([exp_min, np.exp(-ts/mu0n)]) # transmission from TOA to interface
-                
-                 #  Eq. 50: Briegleb and Light 2007  alpha and gamma for direct radiation
-                alp = (0.75 * ws * mu0n) * ((1 + gs * (1-ws)) / (1 - lm**2 * mu0n**2 + epsilon))   #alp = alpha(ws,mu0n,gs,lm)
-                gam = (0.5 * ws) * ((1 + 3 * gs * mu0n**2 * (1-ws)) / (1-lm**2 * mu0n**2 + epsilon))     #gam = gamma(ws,mu0n,gs,lm)
-                
-                # apg = alpha plus gamma
-                # amg = alpha minus gamma
-                apg = alp + gam 
-                amg = alp - gam 
-
-                rdir[lyr] = apg*rdif_a[lyr] +  amg*(tdif_a[lyr]*trnlay[lyr] - 1)     #layer reflectivity to DIRECT radiation
-                tdir[lyr] = apg*tdif_a[lyr] + (amg* rdif_a[lyr]-apg+1)*trnlay[lyr]   #layer transmissivity to DIRECT radiation
-                
-                 # recalculate rdif,tdif using direct angular integration over rdir,tdir,
-                 # since Delta-Eddington rdif formula is not well-behaved (it is usually
-                 # biased low and can even be negative)  use ngmax angles and gaussian
-                 # integration for most accuracy:
-                
-                R1 = rdif_a[lyr]   # use R1 as temporary var
-                T1 = tdif_a[lyr]   # use T1 as temporary var
-                swt = 0 
-                smr = 0 
-                smt = 0 
-                
-                 # loop through the gaussian angles for the AD integral
-                for ng in np.arange(0,len(gauspt),1):     #gaussian angles (radians)
-                    
-                    mu  = gauspt[ng]         # solar zenith angles
-                    gwt = gauswt[ng]         # gaussian weight
-                    swt = swt + mu*gwt       # sum of weights
-                    trn = max([exp_min, np.exp(-ts/mu)])   # transmission
-                    
-                    alp = (0.75*ws*mu) * (1 + gs * (1-ws)) / (1 - lm**2 * mu**2 + epsilon)   #alp = alpha(ws,mu0n,gs,lm)
-                    gam = (0.5 * ws) * (1 + 3 * gs * mu**2 * (1-ws)) / (1-lm**2 * mu**2 + epsilon)  #gam = gamma(ws,mu0n,gs,lm)
-                    
-                    apg = alp + gam 
-                    amg = alp - gam 
-                    rdr = apg*R1 + amg*T1*trn - amg 
-                    tdr = apg*T1 + amg*R1*trn - apg*trn + trn 
-                    smr = smr + mu*rdr*gwt   #accumulator for rdif gaussian integration
-                    smt = smt + mu*tdr*gwt   #accumulator for tdif gaussian integration
-
-                
-                rdif_a[lyr] = smr/swt 
-                tdif_a[lyr] = smt/swt 
-                
-                #! homogeneous layer
-                rdif_b[lyr] = rdif_a[lyr] 
-                tdif_b[lyr] = tdif_a[lyr] 
-                
-                ###################################################
-                # Fresnel layer
-                ##############################################################
-                
-                if lyr == lyrfrsnl:
-                    
-                    #! compute fresnel reflection and transmission amplitudes
-                    #! for two polarizations: 1=perpendicular and 2=parallel to
-                    #! the plane containing incident, reflected and refracted rays.
-                    
-                    #! Eq. 22  Briegleb & Light 2007
-                    # inputs to equation 21 (i.e. Fresnel formulae for R and T)
-                    R1 = (mu0 - refindx * mu0n) / (mu0 + refindx * mu0n)    #reflection amplitude factor for perpendicular polarization
-                    R2 = (refindx*mu0 - mu0n) / (refindx * mu0 + mu0n)    #reflection amplitude factor for parallel polarization
-                    T1 = 2 * mu0 / (mu0 + refindx * mu0n)                   #transmission amplitude factor for perpendicular polarization
-                    T2 = 2 * mu0 / (refindx * mu0 + mu0n)                   #transmission amplitude factor for parallel polarization
-                    
-                    #! unpolarized light for direct beam
-                    #! Eq. 21  Brigleb and light 2007
-                    Rf_dir_a = 0.5 * (R1 * R1 + R2 * R2) 
-                    Tf_dir_a = 0.5 * (T1 * T1 + T2 * T2) * refindx * mu0n / mu0 
-                    
-                    # precalculated diffuse reflectivities and transmissivities
-                    # for incident radiation above and below fresnel layer, using
-                    # the direct albedos and accounting for complete internal
-                    # reflection from below. Precalculated because high order
-                    # number of gaussian points (~256) is required for convergence:
-                    
-                    # Eq. 25  Brigleb and light 2007
-                    # diffuse reflection of flux arriving from above
-                    
-                    Rf_dif_a = 0.063             # reflection from diffuse unpolarized radiation
-                    Tf_dif_a = 1 - Rf_dif_a     #t ransmission from diffuse unpolarized radiation
-                    
-                    # diffuse reflection of flux arriving from below
-                    Rf_dif_b = 0.455 
-                    Tf_dif_b = 1 - Rf_dif_b 
-                    
-                    ######################################################################
-                    # the lyr = lyrfrsnl layer properties are updated to combine
-                    # the fresnel (refractive) layer, always taken to be above
-                    # the present layer lyr (i.e. be the top interface):
-                    
-                    rintfc   = 1 / (1-Rf_dif_b*rdif_a[lyr])  # denom interface scattering
-                    
-                    # layer transmissivity to DIRECT radiation
-                    # Eq. B7  Briegleb & Light 2007
-                    tdir[lyr] = Tf_dir_a * tdir[lyr] + Tf_dir_a*rdir[lyr] * Rf_dif_b*rintfc*tdif_a[lyr]   
-
-                    # layer reflectivity to DIRECT radiation
-                    # Eq. B7  Briegleb & Light 2007
-                    rdir[lyr] = Rf_dir_a + Tf_dir_a*rdir[lyr] * rintfc * Tf_dif_b 
-                    
-                    # R BAR = layer reflectivity to DIFFUSE radiation (above)
-                    # Eq. B9  Briegleb & Light 2007
-                    rdif_a[lyr] = Rf_dif_a + Tf_dif_a*rdif_a[lyr] * rintfc * Tf_dif_b 
-                    
-                    # R BAR = layer reflectivity to DIFFUSE radiation (below)
-                    # Eq. B10  Briegleb & Light 2007
-                    rdif_b[lyr] = rdif_b[lyr] + tdif_b[lyr] * Rf_dif_b * rintfc * tdif_a[lyr] 
-                    
-                    # T BAR layer transmissivity to DIFFUSE radiation (above),
-                    # Eq. B9  Briegleb & Light 2007
-                    tdif_a[lyr] = tdif_a[lyr] * rintfc * Tf_dif_a   
-
-                    # Eq. B10  Briegleb & Light 2007
-                    tdif_b[lyr] = tdif_b[lyr] * rintfc * Tf_dif_b   
-                    
-                    #! update trnlay to include fresnel transmission
-                    trnlay[lyr] = Tf_dir_a*trnlay[lyr] 
-                    
-                    # end lyr = lyrfrsnl condition
-                    # end trntdr[lyr, wl] > trmin condition
-                
-                #  ! Calculate the solar beam transmission, total transmission, and
-                #  ! reflectivity for diffuse radiation from below at interface lyr,
-                #  ! the top of the current layer lyr:
-                #  !
-                #  !              layers       interface
-                #  !
-                #  !       ---------------------  lyr-1
-                #  !                lyr-1
-                #  !       ---------------------  lyr
-                #  !                 lyr
-                #  !       ---------------------
-                #  ! note that we ignore refraction between sea ice and underlying ocean:
-                #  !
-                #  !              layers       interface
-                #  !
-                #  !       ---------------------  lyr-1
-                #  !                lyr-1
-                #  !       ---------------------  lyr
-                #  !       \\\\\\\ ocean \\\\\\\
-                
-            
-            # Eq. 51  Briegleb and Light 2007
-
-            trndir[wl,lyr+1] = trndir[wl,lyr]*trnlay[lyr]  # solar beam transmission from top
-            # trnlay = exp(-ts/mu_not) = direct solar beam transmission
-
-            # interface multiple scattering for lyr-1
-            refkm1 = 1/(1 - rdndif[wl,lyr]*rdif_a[lyr])  
-            
-            # direct tran times layer direct ref
-            tdrrdir = trndir[wl,lyr]*rdir[lyr]            
-            
-            # total down diffuse = tot tran - direct tran
-            tdndif = trntdr[wl,lyr] - trndir[wl,lyr]     
-            
-            # total transmission to direct beam for layers above
-            trntdr[wl,lyr+1] = trndir[wl,lyr]*tdir[lyr] + (tdndif + tdrrdir*rdndif[wl,lyr])*refkm1*tdif_a[lyr] 
-            
-            # Eq. B4  Briegleb and Light 2007
-            rdndif[wl,lyr+1] = rdif_b[lyr] + (tdif_b[lyr]*rdndif[wl,lyr]*refkm1*tdif_a[lyr])    #reflectivity to diffuse radiation for layers above
-            trndif[wl,lyr+1] = trndif[wl,lyr]*refkm1*tdif_a[lyr]   #diffuse transmission to diffuse beam for layers above
-        
-        # end main level loop  number of layers
-        
-        # ! compute reflectivity to direct and diffuse radiation for layers
-        # ! below by adding succesive layers starting from the underlying
-        # ! ocean and working upwards:
-        # !
-        # !              layers       interface
-        # !
-        # !       ---------------------  lyr
-        # !                 lyr
-        # !       ---------------------  lyr+1
-        # !                lyr+1
-        # !       ---------------------
-        
-        # set the underlying ground albedo
-        rupdir[wl,nbr_lyr] = R_sfc[wl]    # reflectivity to direct radiation for layers below
-        rupdif[wl,nbr_lyr] = R_sfc[wl]    # reflectivity to diffuse radiation for layers below
-
-
-        for lyr in np.arange(nbr_lyr-1,-1,-1):  # starts at the bottom and works its way up to the top layer
-            
-            #Eq. B5  Briegleb and Light 2007
-            #! interface scattering
-            refkp1 = 1/( 1 - rdif_b[lyr]*rupdif[wl,lyr+1]) 
-            
-            # dir from top layer plus exp tran ref from lower layer, interface
-            # scattered and tran thru top layer from below, plus diff tran ref
-            # from lower layer with interface scattering tran thru top from below
-            rupdir[wl,lyr] = rdir[lyr] + (trnlay[lyr] * rupdir[wl,lyr+1] + (tdir[lyr]-trnlay[lyr])* rupdif[wl,lyr+1])*refkp1*tdif_b[lyr] 
-            
-            # dif from top layer from above, plus dif tran upwards reflected and
-            # interface scattered which tran top from below
-            rupdif[wl,lyr] = rdif_a[lyr] + tdif_a[lyr]*rupdif[wl,lyr+1]*refkp1*tdif_b[lyr] 
-
-    
-    # fluxes at interface
-
-    for wl in np.arange(0,nbr_wvl,1):
-        
-        for lyr in np.arange(0,nbr_lyr+1,1):
-            
-            # Eq. 52  Briegleb and Light 2007
-            # interface scattering
-            refk = 1/(1 - rdndif[wl,lyr]*rupdif[wl,lyr]) 
-            
-            # dir tran ref from below times interface scattering, plus diff
-            # tran and ref from below times interface scattering
-            fdirup[wl,lyr] = (trndir[wl,lyr]*rupdir[wl,lyr] + (trntdr[wl,lyr]-trndir[wl,lyr]) * rupdif[wl,lyr])*refk 
-            
-            # dir tran plus total diff trans times interface scattering plus
-            # dir tran with up dir ref and down dif ref times interface scattering
-            fdirdn[wl,lyr] = trndir[wl,lyr] + (trntdr[wl,lyr]- trndir[wl,lyr] + trndir[wl,lyr] * rupdir[wl,lyr] * rdndif[wl,lyr])*refk 
-            
-            # diffuse tran ref from below times interface scattering
-            fdifup[wl,lyr] = trndif[wl,lyr]*rupdif[wl,lyr]*refk 
-            
-            # diffuse tran times interface scattering
-            fdifdn[wl,lyr] = trndif[wl,lyr]*refk 
-            
-            # dfdir = fdirdn - fdirup
-            dfdir[wl,lyr] = trndir[wl,lyr] + (trntdr[wl,lyr]-trndir[wl,lyr]) * (1 - rupdif[wl,lyr]) * refk - trndir[wl,lyr]*rupdir[wl,lyr]\
-                * (1 - rdndif[wl,lyr]) * refk 
-            
-            if dfdir[wl,lyr] < puny:
-            
-                dfdir[wl,lyr] = 0  #!echmod necessary?
-                # dfdif = fdifdn - fdifup
-            
-            dfdif[wl,lyr] = trndif[wl,lyr] * (1 - rupdif[wl,lyr]) * refk 
-            
-            if dfdif[wl,lyr] < puny:
-
-                dfdif[wl,lyr] = 0  #!echmod necessary?
+    # open refractive index file and grab real and imaginary parts (the read is shared with snicar_feeder)
+    refidx_file = IOFuncs.read_many({'refidx': (dir_RI_ice+'rfidx_ice.nc', ['re_' + REFIDX_NAMES[rf_ice],\
+        'im_' + REFIDX_NAMES[rf_ice]])})['refidx']
+
+    refidx_re = refidx_file['re_' + REFIDX_NAMES[rf_ice]]
+    refidx_im = refidx_file['im_' + REFIDX_NAMES[rf_ice]]
+
+    nbr_col_wvl = nbr_wvl // columns # wavelengths of each column
+    refindx = refidx_re[0:nbr_col_wvl]+refidx_im[0:nbr_col_wvl]  # combine real and imaginary parts into one var
+    refindx = np.tile(refindx, columns) if columns > 1 else refindx
+
+    #######################################################
+    ## LAYER PROPERTIES FOR DIFFUSE RADIATION (ANGLE-FREE)
+    #######################################################
+
+    # calculation over layers with penetrating radiation
+    # includes optical thickness, single scattering albedo,
+    # asymmetry parameter and total flux
+    tautot = tau0[:,0:nbr_lyr]
+    wtot   = SSA0[:,0:nbr_lyr]
+    gtot   = g0[:,0:nbr_lyr]
+    ftot   = g0[:,0:nbr_lyr] * g0[:,0:nbr_lyr]
+
+    # coefficient for delta eddington solution for all layers
+    # Eq. 50: Briegleb and Light 2007
+    ts   = (1-(wtot * ftot)) * tautot # layer delta-scaled extinction optical depth
+    ws   = ((1-ftot) * wtot) / (1-(wtot * ftot)) # layer delta-scaled single scattering albedo
+    gs   = (gtot-ftot)/(1-ftot) # layer delta-scaled asymmetry parameter
+    lm   = np.sqrt(3 * (1-ws) * (1-ws * gs)) # lambda
+    ue   = 1.5 * (1-ws * gs) / lm # u equation, term in diffuse reflectivity and transmissivity
+
+    extins = np.maximum(exp_min, np.exp(-lm * ts)) # extinction, MAX function keeps from getting an error if the exp(-lm*ts) is < 1e-5
+    ne = (ue+1)**2 / extins - (ue-1)**2 * extins # N equation, term in diffuse reflectivity and transmissivity
+
+    # ! first calculation of rdif, tdif using Delta-Eddington formulas
+    # Eq.: Briegleb 1992  alpha and gamma for direct radiation
+
+    rdif_de = (ue**2-1) * (1/extins - extins)/ne # R BAR = layer reflectivity to DIFFUSE radiation
+    tdif_de = 4*ue/ne # T BAR layer transmissivity to DIFFUSE radiation
+
+    # recalculate rdif,tdif using direct angular integration over rdir,tdir,
+    # since Delta-Eddington rdif formula is not well-behaved (it is usually
+    # biased low and can even be negative)  use ngmax angles and gaussian
+    # integration for most accuracy:
+
+    R1 = rdif_de   # use R1 as temporary var
+    T1 = tdif_de   # use T1 as temporary var
+    swt = 0
+    smr = 0
+    smt = 0
+
+    # loop through the gaussian angles for the AD integral
+    for ng in np.arange(0,len(gauspt),1):     #gaussian angles (radians)
+
+        mu  = gauspt[ng]         # solar zenith angles
+        gwt = gauswt[ng]         # gaussian weight
+        swt = swt + mu*gwt       # sum of weights
+        trn = np.maximum(exp_min, np.exp(-ts/mu))   # transmission
+
+        alp = (0.75*ws*mu) * (1 + gs * (1-ws)) / (1 - lm**2 * mu**2 + epsilon)   #alp = alpha(ws,mu0n,gs,lm)
+        gam = (0.5 * ws) * (1 + 3 * gs * mu**2 * (1-ws)) / (1-lm**2 * mu**2 + epsilon)  #gam = gamma(ws,mu0n,gs,lm)
+
+        apg = alp + gam
+        amg = alp - gam
+        rdr = apg*R1 + amg*T1*trn - amg
+        tdr = apg*T1 + amg*R1*trn - apg*trn + trn
+        smr = smr + mu*rdr*gwt   #accumulator for rdif gaussian integration
+        smt = smt + mu*tdr*gwt   #accumulator for tdif gaussian integration
+
+    rdif_a = work.zeros('rdif_a', shape_dif)
+    tdif_a = work.zeros('tdif_a', shape_dif)
+    rdif_a[:,0:nbr_lyr] = smr/swt
+    tdif_a[:,0:nbr_lyr] = smt/swt
+
+    #! homogeneous layer
+    rdif_b = work.empty('rdif_b', shape_dif)
+    tdif_b = work.empty('tdif_b', shape_dif)
+    rdif_b[...] = rdif_a
+    tdif_b[...] = tdif_a
+
+    ###################################################
+    ## LAYER PROPERTIES FOR THE DIRECT BEAM (PER ANGLE)
+    ###################################################
+
+    mu0 = mu_not[:,None,None]  # cosine of beam angle is equal to incident beam
+
+    # . Eq. 20: Briegleb and Light 2007: adjusts beam angle
+    # (i.e. this is Snell's Law for refraction at interface between media)
+    # mu0n = -1 represents light travelling vertically upwards and mu0n = +1
+    # represents light travellign vertically downwards
+    # layers above the fresnel layer (or all layers if the top layer is the
+    # fresnel layer) keep the incident beam angle
+
+    mu0n = work.empty('mu0n', [nbr_ang,nbr_wvl,nbr_lyr])
+    mu0n[...] = mu0
+
+    if 0 < lyrfrsnl < nbr_lyr:
+
+        with np.errstate(invalid='ignore'):
+            mu0n_frsnl = np.sqrt(1-((1-mu_not[:,None]**2)/(refindx[None,:]*refindx[None,:])))
+
+        mu0n[:,:,lyrfrsnl:] = mu0n_frsnl[:,:,None]
+
+    # evaluate rdir, tdir for direct beam
+    trnlay = work.zeros('trnlay', shape_dir)
+    trnlay[:,:,0:nbr_lyr] = np.maximum(exp_min, np.exp(-ts/mu0n)) # transmission from TOA to interface
+
+    #  Eq. 50: Briegleb and Light 2007  alpha and gamma for direct radiation
+    alp = (0.75 * ws * mu0n) * ((1 + gs * (1-ws)) / (1 - lm**2 * mu0n**2 + epsilon))   #alp = alpha(ws,mu0n,gs,lm)
+    gam = (0.5 * ws) * ((1 + 3 * gs * mu0n**2 * (1-ws)) / (1-lm**2 * mu0n**2 + epsilon))     #gam = gamma(ws,mu0n,gs,lm)
+
+    # apg = alpha plus gamma
+    # amg = alpha minus gamma
+    apg = alp + gam
+    amg = alp - gam
+
+    rdir = work.zeros('rdir', shape_dir)
+    tdir = work.zeros('tdir', shape_dir)
+    rdir[:,:,0:nbr_lyr] = apg*rdif_de +  amg*(tdif_de*trnlay[:,:,0:nbr_lyr] - 1)     #layer reflectivity to DIRECT radiation
+    tdir[:,:,0:nbr_lyr] = apg*tdif_de + (amg* rdif_de-apg+1)*trnlay[:,:,0:nbr_lyr]   #layer transmissivity to DIRECT radiation
+
+    ###################################################
+    # Fresnel layer
+    ##############################################################
+
+    if lyrfrsnl < nbr_lyr:
+
+        lyr = lyrfrsnl
+        mu0 = mu_not[:,None]
+        mu0n_lyr = mu0n[:,:,lyr]
+
+        #! compute fresnel reflection and transmission amplitudes
+        #! for two polarizations: 1=perpendicular and 2=parallel to
+        #! the plane containing incident, reflected and refracted rays.
+
+        #! Eq. 22  Briegleb & Light 2007
+        # inputs to equation 21 (i.e. Fresnel formulae for R and T)
+        R1 = (mu0 - refindx * mu0n_lyr) / (mu0 + refindx * mu0n_lyr)    #reflection amplitude factor for perpendicular polarization
+        R2 = (refindx*mu0 - mu0n_lyr) / (refindx * mu0 + mu0n_lyr)    #reflection amplitude factor for parallel polarization
+        T1 = 2 * mu0 / (mu0 + refindx * mu0n_lyr)                   #transmission amplitude factor for perpendicular polarization
+        T2 = 2 * mu0 / (refindx * mu0 + mu0n_lyr)                   #transmission amplitude factor for parallel polarization
+
+        #! unpolarized light for direct beam
+        #! Eq. 21  Brigleb and light 2007
+        Rf_dir_a = 0.5 * (R1 * R1 + R2 * R2)
+        Tf_dir_a = 0.5 * (T1 * T1 + T2 * T2) * refindx * mu0n_lyr / mu0
+
+        # precalculated diffuse reflectivities and transmissivities
+        # for incident radiation above and below fresnel layer, using
+        # the direct albedos and accounting for complete internal
+        # reflection from below. Precalculated because high order
+        # number of gaussian points (~256) is required for convergence:
+
+        # Eq. 25  Brigleb and light 2007
+        # diffuse reflection of flux arriving from above
+
+        Rf_dif_a = 0.063             # reflection from diffuse unpolarized radiation
+        Tf_dif_a = 1 - Rf_dif_a     #t ransmission from diffuse unpolarized radiation
+
+        # diffuse reflection of flux arriving from below
+        Rf_dif_b = 0.455
+        Tf_dif_b = 1 - Rf_dif_b
+
+        ######################################################################
+        # the lyr = lyrfrsnl layer properties are updated to combine
+        # the fresnel (refractive) layer, always taken to be above
+        # the present layer lyr (i.e. be the top interface):
+
+        rintfc   = 1 / (1-Rf_dif_b*rdif_a[:,lyr])  # denom interface scattering
+
+        # layer transmissivity to DIRECT radiation
+        # Eq. B7  Briegleb & Light 2007
+        tdir[:,:,lyr] = Tf_dir_a * tdir[:,:,lyr] + Tf_dir_a*rdir[:,:,lyr] * Rf_dif_b*rintfc*tdif_a[:,lyr]
+
+        # layer reflectivity to DIRECT radiation
+        # Eq. B7  Briegleb & Light 2007
+        rdir[:,:,lyr] = Rf_dir_a + Tf_dir_a*rdir[:,:,lyr] * rintfc * Tf_dif_b
+
+        # R BAR = layer reflectivity to DIFFUSE radiation (above)
+        # Eq. B9  Briegleb & Light 2007
+        rdif_a[:,lyr] = Rf_dif_a + Tf_dif_a*rdif_a[:,lyr] * rintfc * Tf_dif_b
+
+        # R BAR = layer reflectivity to DIFFUSE radiation (below)
+        # Eq. B10  Briegleb & Light 2007
+        rdif_b[:,lyr] = rdif_b[:,lyr] + tdif_b[:,lyr] * Rf_dif_b * rintfc * tdif_a[:,lyr]
+
+        # T BAR layer transmissivity to DIFFUSE radiation (above),
+        # Eq. B9  Briegleb & Light 2007
+        tdif_a[:,lyr] = tdif_a[:,lyr] * rintfc * Tf_dif_a
+
+        # Eq. B10  Briegleb & Light 2007
+        tdif_b[:,lyr] = tdif_b[:,lyr] * rintfc * Tf_dif_b
+
+        #! update trnlay to include fresnel transmission
+        trnlay[:,:,lyr] = Tf_dir_a*trnlay[:,:,lyr]
+
+    #  ! Calculate the solar beam transmission, total transmission, and
+    #  ! reflectivity for diffuse radiation from below at interface lyr,
+    #  ! the top of the current layer lyr:
+    #  !
+    #  !              layers       interface
+    #  !
+    #  !       ---------------------  lyr-1
+    #  !                lyr-1
+    #  !       ---------------------  lyr
+    #  !                 lyr
+    #  !       ---------------------
+    #  ! note that we ignore refraction between sea ice and underlying ocean:
+    #  !
+    #  !              layers       interface
+    #  !
+    #  !       ---------------------  lyr-1
+    #  !                lyr-1
+    #  !       ---------------------  lyr
+    #  !       \\\\\\\ ocean \\\\\\\
+    #
+    # Layers are computed even where the total transmission to the interface just
+    # above them (trntdr) is below trmin. Those layers receive less than trmin of the
+    # incident flux, so they make no significant contribution to the fluxes, and
+    # skipping them would make the diffuse terms depend on the solar angle.
+
+    for lyr in np.arange(0,nbr_lyr,1):
+
+        # Eq. 51  Briegleb and Light 2007
+
+        trndir[:,:,lyr+1] = trndir[:,:,lyr]*trnlay[:,:,lyr]  # solar beam transmission from top
+        # trnlay = exp(-ts/mu_not) = direct solar beam transmission
+
+        # interface multiple scattering for lyr-1
+        refkm1 = 1/(1 - rdndif[:,lyr]*rdif_a[:,lyr])
+
+        # direct tran times layer direct ref
+        tdrrdir = trndir[:,:,lyr]*rdir[:,:,lyr]
+
+        # total down diffuse = tot tran - direct tran
+        tdndif = trntdr[:,:,lyr] - trndir[:,:,lyr]
+
+        # total transmission to direct beam for layers above
+        trntdr[:,:,lyr+1] = trndir[:,:,lyr]*tdir[:,:,lyr] + (tdndif + tdrrdir*rdndif[:,lyr])*refkm1*tdif_a[:,lyr]
+
+        # Eq. B4  Briegleb and Light 2007
+        rdndif[:,lyr+1] = rdif_b[:,lyr] + (tdif_b[:,lyr]*rdndif[:,lyr]*refkm1*tdif_a[:,lyr])    #reflectivity to diffuse radiation for layers above
+        trndif[:,lyr+1] = trndif[:,lyr]*refkm1*tdif_a[:,lyr]   #diffuse transmission to diffuse beam for layers above
+
+    # end main level loop  number of layers
+
+    # ! compute reflectivity to direct and diffuse radiation for layers
+    # ! below by adding succesive layers starting from the underlying
+    # ! ocean and working upwards:
+    # !
+    # !              layers       interface
+    # !
+    # !       ---------------------  lyr
+    # !                 lyr
+    # !       ---------------------  lyr+1
+    # !                lyr+1
+    # !       ---------------------
+
+    # set the underlying ground albedo
+    rupdir[:,:,nbr_lyr] = R_sfc    # reflectivity to direct radiation for layers below
+    rupdif[:,nbr_lyr] = R_sfc    # reflectivity to diffuse radiation for layers below
+
+    for lyr in np.arange(nbr_lyr-1,-1,-1):  # starts at the bottom and works its way up to the top layer
+
+        #Eq. B5  Briegleb and Light 2007
+        #! interface scattering
+        refkp1 = 1/( 1 - rdif_b[:,lyr]*rupdif[:,lyr+1])
+
+        # dir from top layer plus exp tran ref from lower layer, interface
+        # scattered and tran thru top layer from below, plus diff tran ref
+        # from lower layer with interface scattering tran thru top from below
+        rupdir[:,:,lyr] = rdir[:,:,lyr] + (trnlay[:,:,lyr] * rupdir[:,:,lyr+1] + (tdir[:,:,lyr]-trnlay[:,:,lyr])* rupdif[:,lyr+1])*refkp1*tdif_b[:,lyr]
+
+        # dif from top layer from above, plus dif tran upwards reflected and
+        # interface scattered which tran top from below
+        rupdif[:,lyr] = rdif_a[:,lyr] + tdif_a[:,lyr]*rupdif[:,lyr+1]*refkp1*tdif_b[:,lyr]
+
+
+    # fluxes at interface, calculated in place in the workspace. The per-layer outputs and the
+    # transfer functions need every interface; otherwise only the surface (0) and the bottom of the
+    # column (nbr_lyr) are calculated.
+
+    wanted = lambda name: outputs is None or name in outputs
+    per_layer = transfer or wanted('abs_slr') or wanted('heat_rt')
+
+    if not per_layer and nbr_lyr > 1:
+
+        interfaces = [0, nbr_lyr]
+        trndir, trntdr, rupdir = [x[:,:,interfaces] for x in (trndir, trntdr, rupdir)]
+        rdndif, rupdif, trndif = [x[:,interfaces] for x in (rdndif, rupdif, trndif)]
+        shape_dir = [nbr_ang,nbr_wvl,2]
+        shape_dif = [nbr_wvl,2]
+
+    # Eq. 52  Briegleb and Light 2007
+    # interface scattering
+    # refk = 1/(1 - rdndif*rupdif)
+    refk = np.multiply(rdndif, rupdif, out=work.empty('refk', shape_dif))
+    np.subtract(1, refk, out=refk)
+    np.divide(1, refk, out=refk)
+
+    # total transmission minus direct transmission (trntdr-trndir) and
+    # direct transmission times reflectivity from below (trndir*rupdir)
+    tdndif = np.subtract(trntdr, trndir, out=work.empty('tdndif', shape_dir))
+    trnrup = np.multiply(trndir, rupdir, out=work.empty('trnrup', shape_dir))
+
+    # dir tran ref from below times interface scattering, plus diff
+    # tran and ref from below times interface scattering
+    # fdirup = (trndir*rupdir + (trntdr-trndir) * rupdif)*refk
+    fdirup = np.multiply(tdndif, rupdif, out=work.empty('fdirup', shape_dir))
+    np.add(trnrup, fdirup, out=fdirup)
+    np.multiply(fdirup, refk, out=fdirup)
+
+    # dir tran plus total diff trans times interface scattering plus
+    # dir tran with up dir ref and down dif ref times interface scattering
+    # fdirdn = trndir + (trntdr- trndir + trndir * rupdir * rdndif)*refk
+    fdirdn = np.multiply(trnrup, rdndif, out=work.empty('fdirdn', shape_dir))
+    np.add(tdndif, fdirdn, out=fdirdn)
+    np.multiply(fdirdn, refk, out=fdirdn)
+    np.add(trndir, fdirdn, out=fdirdn)
+
+    # diffuse tran ref from below times interface scattering
+    # fdifup = trndif*rupdif*refk
+    fdifup = np.multiply(trndif, rupdif, out=work.empty('fdifup', shape_dif))
+    np.multiply(fdifup, refk, out=fdifup)
+
+    # diffuse tran times interface scattering
+    fdifdn = np.multiply(trndif, refk, out=work.empty('fdifdn', shape_dif))
 
 
     # ----- End Radiative Solver Adding Doubling Method -----
+
+    if transfer:
+
+        # fdir and fdif are the fluxes per unit incident direct and diffuse flux (copied out of the workspace)
+        dir_up, dir_down = [np.swapaxes(x,1,2).copy() for x in (fdirup, fdirdn)]
+        dif_up, dif_down = [np.broadcast_to(x.T.copy(), (nbr_ang,nbr_lyr+1,nbr_wvl)) for x in (fdifup, fdifdn)]
+
+        transfer = collections.namedtuple("transfer", "dir_up, dir_down, dir_net, dif_up, dif_down, dif_net")
+        out = [dir_up, dir_down, dir_up-dir_down, dif_up, dif_down, dif_up-dif_down]
+
+        if single_angle:
+            out = [x[0] for x in out]
+
+        return wvl, transfer(*out)
+
     # ----- Calculate fluxes ----
 
+    # F_up = fdirup*(Fs*mu_not*pi) + fdifup*Fd and F_dwn = fdirdn*(Fs*mu_not*pi) + fdifdn*Fd
+    F_dir = (Fs*mu_not[:,None]*np.pi)[:,:,None]
+    F_dif = work.empty('F_dif', shape_dir)
 
-    for n in np.arange(0,nbr_lyr+1,1):
-        
-        F_up[:,n]  = (fdirup[:,n]*(Fs*mu_not*np.pi) + fdifup[:,n]*Fd) 
-        F_dwn[:,n] = (fdirdn[:,n]*(Fs*mu_not*np.pi) + fdifdn[:,n]*Fd) 
+    F_up = np.multiply(fdirup, F_dir, out=work.empty('F_up', shape_dir))
+    np.add(F_up, np.multiply(fdifup, Fd[:,:,None], out=F_dif), out=F_up)
 
-    F_net = F_up - F_dwn 
+    F_dwn = np.multiply(fdirdn, F_dir, out=work.empty('F_dwn', shape_dir))
+    np.add(F_dwn, np.multiply(fdifdn, Fd[:,:,None], out=F_dif), out=F_dwn)
 
-    # Absorbed flux in each layer
-    #F_abs[:,0:nbr_lyr] = F_net[:,1:]-F_net[:,0:-1]
-    F_abs[:,:] = F_net[:,1:]-F_net[:,0:-1]
+    F_net = np.subtract(F_up, F_dwn, out=work.empty('F_net', shape_dir))
 
     # albedo
-    acal  = F_up[:,0]/F_dwn[:,0] 
+    acal  = F_up[:,:,0]/F_dwn[:,:,0]
 
     # Upward flux at upper model boundary
-    F_top_pls = F_up[:,0] 
-    
+    F_top_pls = F_up[:,:,0].copy()
+
     # Net flux at lower model boundary = bulk transmission through entire
     # media = absorbed radiation by underlying surface:
-    F_btm_net = -F_net[:,nbr_lyr] 
+    F_btm_net = -F_net[:,:,-1]
+
+    abs_snw_slr = heat_rt = None
+
+    if per_layer:
+
+        # Absorbed flux in each layer
+        F_abs = F_net[:,:,1:]-F_net[:,:,0:-1]
 
-    # Spectrally-integrated absorption in each layer:
-    F_abs_slr = np.sum(F_abs,axis=0) 
-    
-    for i in np.arange(0,nbr_lyr,1):
+        # Spectrally-integrated absorption in each layer:
+        F_abs_slr = np.sum(F_abs,axis=1)
 
-        F_abs_vis[i] = sum(F_abs[0:vis_max_idx,i]) 
-        F_abs_nir[i] = sum(F_abs[vis_max_idx:nir_max_idx,i]) 
+        # Radiative heating rate:
+        heat_rt = F_abs_slr/(np.asarray(L_snw)*2117)    #[K/s] 2117 = specific heat ice (J kg-1 K-1)
+        heat_rt = heat_rt*3600               #[K/hr]
 
-    # Spectrally-integrated absorption by underlying surface:
-    F_abs_btm = np.sum(F_btm_net,axis=0) 
-    F_abs_vis_btm = np.sum(F_btm_net[0:vis_max_idx],axis=0) 
-    F_abs_nir_btm = np.sum(F_btm_net[vis_max_idx:nir_max_idx+1],axis=0) 
+        abs_snw_slr = np.sum(F_abs_slr,axis=1)      # total solar absorption by entire snow column (not including underlying substrate) [W/m2]
+        F_abs_col = np.sum(F_abs,axis=2)
 
-    # Radiative heating rate:
-    heat_rt = F_abs_slr/(L_snw*2117)    #[K/s] 2117 = specific heat ice (J kg-1 K-1)
-    heat_rt = heat_rt*3600               #[K/hr]
+    else:
+        # absorption by the whole column from the fluxes at its top and bottom
+        F_abs_col = F_net[:,:,-1]-F_net[:,:,0]
 
     # Energy conservation check:
     # Incident direct+diffuse radiation equals (absorbed+transmitted+bulk_reflected)
-    energy_sum = (mu_not*np.pi*Fs)+Fd - (np.sum(F_abs,axis=1) + F_btm_net + F_top_pls) 
+    energy_sum = (mu_not[:,None]*np.pi*Fs)+Fd - (F_abs_col + F_btm_net + F_top_pls)
 
-    energy_conservation_error = sum(abs(energy_sum)) 
+    energy_conservation_error = np.sum(abs(energy_sum),axis=1)
 
-    if energy_conservation_error > 1e-10:
+    for error in energy_conservation_error[energy_conservation_error > 1e-10]:
 
-        print('energy conservation error: {}'.format(energy_conservation_error))
+        print('energy conservation error: {}'.format(error))
 
     # Hemispheric wavelength-dependent albedo:
-    if DIRECT ==1: 
-    
-        albedo = F_top_pls/((mu_not*np.pi*Fs)+Fd) 
-    
+    if DIRECT ==1:
+
+        albedo = F_top_pls/((mu_not[:,None]*np.pi*Fs)+Fd)
+
     else:
-        albedo = rupdif[:,0] 
+        albedo = np.broadcast_to(rupdif[:,0], (nbr_ang,nbr_wvl))
 
 
     #double check if the albedo calculated are the same
-    adif = np.sum(acal - albedo) 
-    
-    if adif > 1e-10:
-        
+    adif = np.sum(acal - albedo,axis=1)
+
+    if np.any(adif > 1e-10):
+
         print('error in albedo calculation')
 
-    albedo = acal 
+    albedo = acal
 
 
     # Spectrally-integrated solar, visible, and NIR albedos:
-    alb_bb = np.sum(flx_slr*albedo)/np.sum(flx_slr) 
+    alb_bb = alb_vis = alb_nir = None
 
-    alb_vis = np.sum(flx_slr[0:vis_max_idx] * albedo[0:vis_max_idx]) / np.sum(flx_slr[0:vis_max_idx]) 
+    if wanted('BBA'):
+        alb_bb = np.sum(flx_slr*albedo,axis=1)/np.sum(flx_slr,axis=1)
 
-    alb_nir = np.sum(flx_slr[vis_max_idx:nir_max_idx] * albedo[vis_max_idx:nir_max_idx]) / np.sum(flx_slr[vis_max_idx:nir_max_idx]) 
+    if wanted('BBAVIS'):
+        alb_vis = np.sum(flx_slr[:,0:vis_max_idx] * albedo[:,0:vis_max_idx],axis=1) / np.sum(flx_slr[:,0:vis_max_idx],axis=1)
 
-    # Spectrally-integrated VIS and NIR total snowpack absorption:
-    abs_vis = np.sum(flx_slr[0:vis_max_idx] * (1-albedo[0:vis_max_idx])) 
-    abs_nir = np.sum(flx_slr[vis_max_idx:nir_max_idx]*(1-albedo[vis_max_idx:nir_max_idx])) 
+    if wanted('BBANIR'):
+        alb_nir = np.sum(flx_slr[:,vis_max_idx:nir_max_idx] * albedo[:,vis_max_idx:nir_max_idx],axis=1) / np.sum(flx_slr[:,vis_max_idx:nir_max_idx],axis=1)
 
     #########################  OUTPUT  #############################
 
-    flx_dwn_spc = mu_not*np.pi*Fs+Fd  # spectral downwelling flux at model top [W/m2/band]
+    flx_dwn_spc = mu_not[:,None]*np.pi*Fs+Fd  # spectral downwelling flux at model top [W/m2/band]
     alb_slr = alb_bb              # solar broadband albedo
-    abs_snw_slr = np.sum(F_abs_slr)      # total solar absorption by entire snow column (not including underlying substrate) [W/m2]
     # abs_snw_vis = np.sum(F_abs_vis)      # visible solar absorption by entire snow column (not including underlying substrate) [W/m2]
     # abs_snw_nir = np.sum(F_abs_nir)      # near-IR solar absorption by entire snow column (not including underlying substrate) [W/m2]
     # abs_spc = np.sum(F_abs,axis=1)      # spectral absorption by entire snow column [W/m2/band]
@@ -503,4 +568,19 @@ def adding_doubling_solver(rf_ice, APRX_TYP, DELTA, layer_type, tau, g, SSA, mu_
     # abs_ground_vis  = F_abs_vis_btm       # visible absorption by underlying substrate [W/m2]
     # abs_ground_nir  = F_abs_nir_btm       # near-IR absorption by underlying substrate [W/m2]
 
-    return wvl, flx_dwn_spc, albedo, alb_slr, alb_vis, alb_nir, abs_snw_slr, heat_rt, F_btm_net, F_top_pls
\ No newline at end of file
+    if single_angle:
+
+        flx_dwn_spc, albedo, alb_slr, alb_vis, alb_nir, abs_snw_slr, heat_rt, F_btm_net, F_top_pls = \
+            [None if x is None else x[0] for x in (flx_dwn_spc, albedo, alb_slr, alb_vis, alb_nir, abs_snw_slr, heat_rt, F_btm_net, F_top_pls)]
+
+    if out is not None:
+
+        # write the spectral outputs into the caller's buffers
+        values = {'albedo': albedo, 'F_btm_net': F_btm_net, 'F_top_pls': F_top_pls}
+
+        for name, buffer in out.items():
+            np.copyto(buffer, values[name])
+
+        albedo, F_btm_net, F_top_pls = [out.get(name, values[name]) for name in ('albedo', 'F_btm_net', 'F_top_pls')]
+
+    return wvl, flx_dwn_spc, albedo, alb_slr, alb_vis, alb_nir, abs_snw_slr, heat_rt, F_btm_net, F_top_pls
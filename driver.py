@@ -14,6 +14,9 @@ import math
 import matplotlib.pyplot as plt
 from ControlFuncs import ControlFuncs
 from TwoStreamFuncs import TwoStreamFuncs
+from AtlasFuncs import AtlasFuncs
+from SpectralGrid import SpectralGrid
+from RunningMean import RunningMean
 
 
 ########################
@@ -25,8 +28,8 @@ hole_w = 50
 hole_water_d = 5
 hole_ar = hole_d/hole_w
 # point = hole_w/2 # horizontal distance from LH wall to desired location on hole floor
-cryoconite_albedo = np.ones(470)*0.2 #constant albedo across wavelength for now
-WL = np.arange(0.3,5,0.01)
+WL = SpectralGrid.default().WL
+cryoconite_albedo = np.ones(len(WL))*0.2 #constant albedo across wavelength for now
 
 ####################
 ## 2. CONFIGURE RTM 
@@ -41,16 +44,16 @@ algae = 0
 incoming_i = 4
 DIRECT = True
 tolerance = 1e-10 #how close to zero doe the flux need to get before we stop iterating internal reflections?
+cache_dir = None # set to a directory to keep column solves and hole results between runs
+point_spacing = None # None integrates the floor exactly (ControlFuncs.FloorMean); a spacing samples points that far apart instead
+keep_points = False # with point_spacing, keep the spectrum at every point (points x wavelengths) as well as the floor mean
+atlas = None # path of a column atlas (driver_build_atlas.py) to interpolate the ice column instead of solving it
 
 # create named tuple containing snicar input params
-params = TwoStreamFuncs.generate_ice_physical_params(density,grain_rds,layer_type,dz,algae,solzen,incoming_i,DIRECT)
+params = TwoStreamFuncs.generate_ice_physical_params(density,grain_rds,layer_type,dz,algae,solzen,incoming_i,DIRECT,cache_dir)
 incoming = TwoStreamFuncs.generate_incoming_irradiance(params)
 
 
-BB_output_by_point = []
-total_energy_absorbed_by_cryoconite_by_point = []
-
-
 
 #############################################################
 # END OF USER INPUT (i.e. leave all remaining code unchanged)
@@ -59,23 +62,39 @@ total_energy_absorbed_by_cryoconite_by_point = []
 # Validation function will raise errors if input data is invalid
 ControlFuncs.Validate_Input_Data(hole_d, hole_w, hole_water_d, solzen)
 
-for point in np.arange(0, hole_w, 1):
+# the ice column is the same at every point, so it is solved (or interpolated from the atlas) once
+column = TwoStreamFuncs.call_snicar(params) if atlas is None else AtlasFuncs.column(atlas, params)
 
-    # function calls
-    dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite, total_incoming_energy, \
-        dir_energy_at_hole_floor, diffuse_energy_at_hole_floor = ControlFuncs.CalculateFluxes(\
-        hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL, params, tolerance)
+if point_spacing is None:
 
+    # exact mean over the hole floor, one evaluation per group of floor segments (see FloorMean)
+    energy_escaping_internal_reflections, dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite,\
+        total_incoming_energy, dir_energy_at_hole_floor, diffuse_energy_at_hole_floor, F_top_pls,\
+        reflected_from_water_surface = ControlFuncs.FloorMean(\
+        hole_d, hole_w, hole_water_d, cryoconite_albedo, WL, params, tolerance, column=column)
 
     total_energy_absorbed_by_cryoconite = diffuse_energy_absorbed_by_cryoconite + dir_energy_absorbed_by_cryoconite
-    total_energy_absorbed_by_cryoconite_by_point.append(total_energy_absorbed_by_cryoconite)
+    total_energy_absorbed_by_cryoconite_by_point = None
+
+else:
+
+    # points are reduced to a running mean as they are calculated (see RunningMean)
+    absorbed = RunningMean(keep_points)
+
+    for point in np.arange(0, hole_w, point_spacing):
+
+        # function calls
+        energy_escaping_internal_reflections, dir_energy_absorbed_by_cryoconite, diffuse_energy_absorbed_by_cryoconite,\
+            total_incoming_energy, dir_energy_at_hole_floor, diffuse_energy_at_hole_floor, F_top_pls,\
+            reflected_from_water_surface = ControlFuncs.CalculateFluxes(\
+            hole_d, hole_w, hole_water_d, point, cryoconite_albedo, WL, params, tolerance, column=column)
+
+        absorbed.add(diffuse_energy_absorbed_by_cryoconite + dir_energy_absorbed_by_cryoconite)
 
-    BB_output = np.sum(total_energy_absorbed_by_cryoconite)
-    BB_output_by_point.append(BB_output)
+    total_energy_absorbed_by_cryoconite = absorbed.mean # mean across the floor
+    total_energy_absorbed_by_cryoconite_by_point = absorbed.stack() # None unless keep_points
 
-total_energy_absorbed_by_cryoconite_by_point = np.array(total_energy_absorbed_by_cryoconite_by_point)
-total_energy_absorbed_by_cryoconite_by_point = np.mean(total_energy_absorbed_by_cryoconite_by_point,axis=1)
-BB_output = np.mean(BB_output_by_point)
+BB_output = np.sum(total_energy_absorbed_by_cryoconite)
 
 
 # plots and printing
@@ -0,0 +1,38 @@
+"""
+Runs the end-to-end scaling benchmarks in BenchmarkFuncs. Each case runs in a fresh process, so the
+benchmark has to be started from the main module (python driver_benchmark.py).
+
+"""
+
+from BenchmarkFuncs import BenchmarkFuncs
+
+if __name__ == '__main__':
+
+    # values along each axis (see BenchmarkFuncs)
+    axes = {'hole_count': [1, 2, 4, 8, 16],
+        'point_spacing': [0.04, 0.02, 0.01, 0.005], # m; hole_w/point_spacing points per hole
+        'layer_count': [1, 4, 16, 64],
+        'batch_size': [1, 4, 16]}
+
+    # override any entry of BenchmarkFuncs.default_config()
+    config = {'hole_w': 0.2, 'hole_d': 0.2, 'solzen': 45}
+
+    repeats = 3 # the fastest of repeats runs is kept
+    allocations = True # also count allocations with tracemalloc (in a separate, untimed run)
+
+    savepath = '/home/joe/Code/CryoconiteRTM/'
+
+    summary = BenchmarkFuncs.run(axes, config, repeats, allocations)
+
+    BenchmarkFuncs.save_summary(summary, savepath + 'benchmark_summary.json')
+    BenchmarkFuncs.plot(summary, savepath + 'benchmark_scaling.png')
+
+    for axis, exponent in summary['scaling_exponents'].items():
+        print(f"{axis}: wall time ~ size^{exponent:.2f}" if exponent is not None else f"{axis}: single size")
+
+    # run the Toon and adding-doubling solvers on the same granular columns and compare speed and outputs
+    compare_solvers = True
+
+    if compare_solvers:
+        comparison = BenchmarkFuncs.compare_solvers(layer_counts=[1, 4, 16, 64], solzens=[30, 50, 70], config=config)
+        BenchmarkFuncs.save_summary(comparison, savepath + 'solver_comparison.json')
@@ -0,0 +1,13 @@
+"""
+Packs the BioSNICAR and CryoconiteRTM data files (netCDF optical properties and irradiance, csv
+refractive indices) into one memory-mapped archive (see IOFuncs). Once the archive exists it is used
+automatically by every run; rerun this script after changing any of the data files.
+
+"""
+
+from IOFuncs import IOFuncs
+
+archive_path = None # where to write the archive (None: IOFuncs.ARCHIVE_FILE in the CryoconiteRTM data folder)
+roots = None # directories to pack (None: the BioSNICAR and CryoconiteRTM data folders)
+
+IOFuncs.build_archive(archive_path, roots)
@@ -0,0 +1,18 @@
+"""
+Builds the atlas of precomputed single-layer bubbly ice columns (see AtlasFuncs) and saves it to
+AtlasFuncs.ATLAS_FILE in the CryoconiteRTM data folder. The largest errors of the interpolated columns against direct solves are printed
+and stored with the atlas. Set atlas in driver.py to use it in place of the column solves; rebuild
+after changing the data files or the grid below.
+
+"""
+
+from AtlasFuncs import AtlasFuncs
+
+atlas_path = None # where to write the atlas (None: AtlasFuncs.ATLAS_FILE in the CryoconiteRTM data folder)
+axes = AtlasFuncs.AXES # grid of density, grain_rds (bubble radius), dz (m), solzen and algae
+incoming_i = 4
+DIRECT = True
+n_check = 50 # random points compared with direct solves
+
+atlas = AtlasFuncs.build(axes, incoming_i, DIRECT, n_check=n_check)
+AtlasFuncs.save(atlas, atlas_path)
@@ -0,0 +1,52 @@
+"""
+Driver script for retrieving hole water depth (or effective hole depth) from the field measurements
+of hole floor/ice surface irradiance in TestData/FieldMeasurements.csv
+
+The ice configuration matches ValidationTests.py. Instead of assuming a water depth of 0.7 * hole
+depth, the water depth that best reproduces the measured irradiance ratio is retrieved for each hole.
+
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+from TwoStreamFuncs import TwoStreamFuncs
+from RetrievalFuncs import RetrievalFuncs
+from SpectralGrid import SpectralGrid
+
+##########################
+## 1. RETRIEVAL SETTINGS
+##########################
+
+parameter = 'water_depth' # 'water_depth' or 'depth'
+sensor_height = 5 # sensor height in cm
+WL = SpectralGrid.default().WL
+
+#############################################
+## 2. SET PHYSICAL PROPERTIES OF THE ICE/SNOW
+#############################################
+
+solzen = 25
+density = [850]
+grain_rds = [850]
+layer_type = [1]
+dz = [0.1] # replaced by the depth of each hole
+algae = 0
+incoming_i = 4
+DIRECT = True
+
+params = TwoStreamFuncs.generate_ice_physical_params(density,grain_rds,layer_type,dz,algae,solzen,incoming_i,DIRECT)
+
+#############################################################
+# END OF USER INPUT (i.e. leave all remaining code unchanged)
+#############################################################
+
+results = RetrievalFuncs.retrieve_field_measurements('./TestData/FieldMeasurements.csv', params, WL,\
+    parameter=parameter, sensor_height=sensor_height)
+
+print(results)
+print("mean absolute residual = ", np.mean(np.abs(results['residual'])))
+results.to_csv('./retrieval_results.csv', index=False)
+
+plt.scatter(results['hole_d'], results[parameter])
+plt.xlabel("Hole depth (cm)"), plt.ylabel("Retrieved {} (cm)".format(parameter))
+plt.savefig('./retrieval_results.jpg')
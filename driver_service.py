@@ -0,0 +1,20 @@
+"""
+Starts the hole flux service (ServiceFuncs) and keeps it running until interrupted. The workers are
+separate processes, so the service has to be started from the main module (python driver_service.py).
+
+Query it from another program with ServiceFuncs.query, e.g.
+
+    results = ServiceFuncs.query([{'hole_d': 0.2, 'hole_w': 0.1, 'hole_water_d': 0.1, 'solzen': 45}])
+
+"""
+
+from ServiceFuncs import ServiceFuncs
+
+if __name__ == '__main__':
+
+    host = '127.0.0.1' # only accept connections from this machine
+    port = 8765
+    n_workers = 4 # worker processes, each keeping its own data and columns in memory
+    cache_dir = None # set to a directory to keep columns and hole results between restarts
+
+    ServiceFuncs.serve(host, port, n_workers, cache_dir)